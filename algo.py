@@ -3,12 +3,46 @@ import xml.etree.ElementTree as ET
 import os
 from datetime import datetime
 import sys
-
-def generate_routes(trips_file, network_file, output_file):
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+from router import get_router, write_routes
+from leg_cache import get_leg_cache, open_cache_db
+from insertion import (enumerate_candidates, required_legs, evaluate_insertions, best_and_worst, near_best_and_worst,
+                       candidate_legs, price_insertion, bound_insertions, prune_insertions, truck_numbers, Trips)
+from landmarks import load_index
+from cost_matrix import matrix_edges, load_or_build
+from route_stream import process_routes, demux_routes, collect_scenarios, chosen_route
+from result_store import ResultStore
+from trip_set import TripSet
+from network import load_network
+from snapping import snap_order
+from time_dependent import TimeDependentRouter, load_edge_data, load_tripinfo, read_departures, evaluate_insertions_td
+
+@instrument.timed()
+def generate_routes(trips_file, network_file, output_file, backend='duarouter', cache_file=None, trip_set=None):
     """
-    Generates routes using SUMO's duarouter.
+    Generates routes using SUMO's duarouter, or the in-process router when backend is 'internal'.
+    In-process legs are memoized, on disk as well when cache_file is given.
+    A TripSet is routed directly by the in-process router, or written to trips_file for duarouter.
     """
-    subprocess.run(['duarouter', '-n', network_file, '-r', trips_file, '-o', output_file], check=True)
+    if trip_set is not None:
+        instrument.count('legs_routed', len(trip_set))
+    if backend == 'internal':
+        leg_cache = get_leg_cache(network_file, cache_file)
+        write_routes(trips_file, leg_cache, output_file, trip_set)
+        leg_cache.flush()
+    else:
+        if trip_set is not None:
+            trip_set.write(trips_file)
+        instrument.count('duarouter_runs')
+        subprocess.run(['duarouter', '-n', network_file, '-r', trips_file, '-o', output_file], check=True)
+        instrument.count_bytes('xml_bytes_written', output_file, output_file[:-len('.xml')] + '.alt.xml')
 
 def extract_edges_from_routes(file_path):
     """Extract edges from the routes XML file and return as a list of lists."""
@@ -29,21 +63,26 @@ def extract_edges_from_routes(file_path):
 
 def extract_trips(file_path):
     """Extract edges from the trips XML file."""
+    instrument.count_bytes('xml_bytes_parsed', file_path)
     tree = ET.parse(file_path)
     root = tree.getroot()
 
     edges = []
+    trip_ids = []
     for trip in root.findall('trip'):
         from_edge = trip.get('from')
         to_edge = trip.get('to')
         edges.append((from_edge, to_edge))
+        trip_ids.append(trip.get('id'))
     
-    return edges
+    return Trips(edges, trip_ids)
 
+@instrument.timed()
 def parse_routes_alt(file_path):
     """
     Parses the routes.alt.xml file and extracts the cost for each vehicle.
     """
+    instrument.count_bytes('xml_bytes_parsed', file_path)
     try:
         tree = ET.parse(file_path)
         root = tree.getroot()
@@ -54,9 +93,9 @@ def parse_routes_alt(file_path):
             vehicle_id = vehicle.get('id')
             route_distribution = vehicle.find('routeDistribution')
             if route_distribution is not None:
-                for route in route_distribution.findall('route'):
-                    cost = float(route.get('cost', 0))
-                    costs[vehicle_id] = cost
+                route = chosen_route(route_distribution)
+                if route is not None:
+                    costs[vehicle_id] = float(route.get('cost', 0))
         
         return costs
 
@@ -64,189 +103,415 @@ def parse_routes_alt(file_path):
         print(f"Error parsing the XML file: {e}")
         return {}
 
-def create_trips_file(from_edge, to_edge, folder_path, iteration, trip_id, truck_id, order):
+def depart_at(times, k):
     """
-    Creates or updates a trips file with the specified source, destination, and trip_id.
-    If the file already exists, the new trip is appended to it.
+    The depart attribute for times[k], or '0.00' when no departure times are known.
     """
-    trips_file = os.path.join(folder_path, f"trips_{iteration}.xml")
-    new_trip = f'<trip id="{trip_id}_{truck_id}_{order}" depart="0.00" from="{from_edge}" to="{to_edge}"/>\n'
-    
-    if os.path.isfile(trips_file): 
-        with open(trips_file, 'r+') as f:
-            content = f.read().strip()
-            
-            if new_trip.strip() not in content:
-
-                if content.endswith('</routes>'):
-                    content = content[:-len('</routes>')] 
-                f.seek(0)  
-                f.write(content + new_trip + '</routes>')
-                f.truncate()  
-    else:
-        with open(trips_file, 'w') as f:
-            f.write("""<?xml version="1.0" encoding="UTF-8"?>
-<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
-"""+ new_trip + '</routes>')
+    return '0.00' if times is None else f"{times[k]:.2f}"
 
-def merge_routes_alt(input_file, output_file, use_route_distribution=False):
+def get_trip_set(from_edge, to_edge, i, trips, truck_id, departs=None):
     """
-    Merge routes from input_file to output_file, considering route distribution.
+    Trips of the fleet with an extra trip i (from_edge -> to_edge) appended to truck_id.
+    departs is (depart time of every trip, depart time of the extra trip), as set on
+    time-dependent candidates; without it every trip departs at 0.
     """
-    # print(f"Processing files: {input_file} -> {output_file}")
-    try:
-        tree = ET.parse(input_file)
-        root = tree.getroot()
-    except FileNotFoundError:
-        print(f"Error: The file {input_file} was not found.")
-        return
-    except ET.ParseError as e:
-        print(f"Error parsing {input_file}: {e}")
-        return
+    trip_departs, order_departs = departs or (None, None)
+    trip_set = TripSet()
+    for j, ((from_edge1, to_edge1), truck) in enumerate(zip(trips, truck_numbers(trips))):
+        trip_set.add(from_edge1, to_edge1, j, truck, 0, depart_at(trip_departs, j))
 
-    merged_root = ET.Element('routes')
+    trip_set.add(from_edge, to_edge, i, truck_id, 0, depart_at(order_departs, 0))
+    return trip_set
+
+def get(from_edge, to_edge, folder_path, i, trips, network_file, truck_id, backend='duarouter', cache_file=None, departs=None):
+    temp_trips_file = os.path.join(folder_path, f"trips_{i}.xml")
+    temp_route_file = os.path.join(folder_path, f"routes_{i}.xml")
+    temp_routes_alt_file = os.path.join(folder_path, f"routes_{i}.alt.xml")
+    trip_set = get_trip_set(from_edge, to_edge, i, trips, truck_id, departs)
+    generate_routes(temp_trips_file, network_file, temp_route_file, backend, cache_file, trip_set)
     
-    vehicles_info = {}
+    merged_routes_alt_file = os.path.join(folder_path, f"merged_routes_{i}.alt.xml")
+    merged_routes_file = os.path.join(folder_path, f"merged_routes_{i}.xml")
+    _, _, cost_sum = process_routes(temp_route_file, temp_routes_alt_file, merged_routes_file, merged_routes_alt_file)
+    print(f"Total cost for iteration {i}: {round(cost_sum, 3)}")
+    return cost_sum , merged_routes_file, merged_routes_alt_file
 
-    for vehicle in root.findall('vehicle'):
-        vehicle_id_parts = vehicle.get('id').split('_')
-        vehicle_index = vehicle_id_parts[1]  
-
-        if vehicle_index not in vehicles_info:
-            vehicles_info[vehicle_index] = {'cost': 0.0, 'edges': []}
-
-        if use_route_distribution:
-            route_dist_elem = vehicle.find('routeDistribution')
-            if route_dist_elem is not None:
-                for route_elem in route_dist_elem.findall('route'):
-                    route_edges = route_elem.get('edges').split()
-                    route_cost = float(route_elem.get('cost', 0))
-
-                    if vehicles_info[vehicle_index]['edges']:
-                        if vehicles_info[vehicle_index]['edges'][-1] == route_edges[0]:
-                            route_edges = route_edges[1:]
-                    
-                    vehicles_info[vehicle_index]['edges'].extend(route_edges)
-                    vehicles_info[vehicle_index]['cost'] += route_cost
-            else:
-                print(f"Warning: 'routeDistribution' element not found for vehicle {vehicle.get('id')}.")
-        else:
-            route_elem = vehicle.find('route')
-            if route_elem is not None:
-                route_edges = route_elem.get('edges').split()
+        
+def insert_trip_set(from_edge, to_edge, new_order, i, trips, truck, departs=None):
+    """
+    Trips of the fleet with trip i (from_edge -> to_edge) split into from_edge -> new_order -> to_edge.
+    departs is as for get_trip_set(), with the depart times of both new trips.
+    """
+    trip_departs, order_departs = departs or (None, None)
+    trip_set = TripSet()
+    trucks = truck_numbers(trips)
+    for j, (from_edge1, to_edge1) in enumerate(trips):
+        if i == j:
+            break
+        trip_set.add(from_edge1, to_edge1, j, trucks[j], 0, depart_at(trip_departs, j))
 
-                if vehicles_info[vehicle_index]['edges']:
-                    if vehicles_info[vehicle_index]['edges'][-1] == route_edges[0]:
-                        route_edges = route_edges[1:]
+    trip_set.add(from_edge, new_order, i, truck, 0, depart_at(order_departs, 0))
+    trip_set.add(new_order, to_edge, i, truck, 1, depart_at(order_departs, 1))
+    for j, (from_edge1, to_edge1) in enumerate(trips):
+        if j > i:
+            trip_set.add(from_edge1, to_edge1, j, trucks[j], 0, depart_at(trip_departs, j))
+    return trip_set
 
-                vehicles_info[vehicle_index]['edges'].extend(route_edges)
-            else:
-                print(f"Warning: 'route' element not found for vehicle {vehicle.get('id')}.")
+def insert(from_edge, to_edge, new_order, folder_path, i, trips, network_file, truck, backend='duarouter', cache_file=None,
+           departs=None):
+    """
+    Routes the fleet with trip i (from_edge -> to_edge) split into from_edge -> new_order -> to_edge.
+    """
+    temp_trips_file = os.path.join(folder_path, f"trips_{i}.xml")
+    temp_route_file = os.path.join(folder_path, f"routes_{i}.xml")
+    temp_routes_alt_file = os.path.join(folder_path, f"routes_{i}.alt.xml")
+    trip_set = insert_trip_set(from_edge, to_edge, new_order, i, trips, truck, departs)
+    generate_routes(temp_trips_file, network_file, temp_route_file, backend, cache_file, trip_set)
 
-    for vehicle_index, info in vehicles_info.items():
-        vehicle_elem = ET.SubElement(merged_root, 'vehicle', id=vehicle_index, depart='0.00')
-        
-        if use_route_distribution:
-            route_distribution_elem = ET.SubElement(vehicle_elem, 'routeDistribution', last='0')
-            new_route_elem = ET.SubElement(route_distribution_elem, 'route', cost=f"{info['cost']:.2f}", probability='1.00000000')
-            new_route_elem.set('edges', ' '.join(info['edges']))
-        else:
-            new_route_elem = ET.SubElement(vehicle_elem, 'route')
-            new_route_elem.set('edges', ' '.join(info['edges']))
+    merged_routes_alt_file = os.path.join(folder_path, f"merged_routes_{i}.alt.xml")
+    merged_routes_file = os.path.join(folder_path, f"merged_routes_{i}.xml")
+    _, _, cost_sum = process_routes(temp_route_file, temp_routes_alt_file, merged_routes_file, merged_routes_alt_file)
+    print(f"Total cost for iteration {i}: {round(cost_sum, 3)}")
+    return cost_sum, merged_routes_file, merged_routes_alt_file
 
-    merged_tree = ET.ElementTree(merged_root)
-    try:
-        merged_tree.write(output_file, encoding='UTF-8', xml_declaration=True)
-        # print(f"Merged routes file '{output_file}' created successfully.")
-    except Exception as e:
-        print(f"Error writing to {output_file}: {e}")
-        
-def merge_routes(input_file, output_file):
+@instrument.timed()
+def evaluate_candidate(candidate, trips, new_order, folder_path, network_file, backend='duarouter', cache_file=None):
     """
-    Merge routes from input_file to output_file for 'route.xml', ensuring continuous edge paths.
+    Routes the whole fleet for one candidate of insertion.enumerate_candidates().
+    Returns (cost, file reported if it is the best, file reported if it is the worst).
     """
-    # print(f"Processing files: {input_file} -> {output_file}")
-
-    try:
-        tree = ET.parse(input_file)
-        root = tree.getroot()
-    except FileNotFoundError:
-        print(f"Error: The file {input_file} was not found.")
-        return
-    except ET.ParseError as e:
-        print(f"Error parsing {input_file}: {e}")
-        return
+    from_edge, to_edge = trips[candidate['index']]
+    if candidate['kind'] == 'insert':
+        cost, merged_routes_file, _ = insert(from_edge, to_edge, new_order, folder_path, candidate['iteration'],
+                                             trips, network_file, candidate['truck'], backend, cache_file,
+                                             candidate.get('departs'))
+        return cost, merged_routes_file, merged_routes_file
+    return get(to_edge, new_order, folder_path, candidate['iteration'], trips, network_file,
+               candidate['truck'], backend, cache_file, candidate.get('departs'))
+
+def candidate_trip_set(candidate, trips, new_order):
+    """
+    The trips routed for one candidate of insertion.enumerate_candidates().
+    """
+    from_edge, to_edge = trips[candidate['index']]
+    if candidate['kind'] == 'insert':
+        return insert_trip_set(from_edge, to_edge, new_order, candidate['iteration'], trips, candidate['truck'],
+                               candidate.get('departs'))
+    return get_trip_set(to_edge, new_order, candidate['iteration'], trips, candidate['truck'], candidate.get('departs'))
+
+@instrument.timed()
+def evaluate_candidates_batched(candidates, trips, new_order, folder_path, network_file, backend='duarouter', cache_file=None,
+                                store=None):
+    """
+    Routes every candidate's fleet in a single router run. Vehicle ids are namespaced as
+    c{iteration}_{trip}_{truck}_{order} and split back into the usual per-candidate
+    merged_routes_{iteration}.xml / .alt.xml files, so results match evaluate_candidate().
 
-    merged_root = ET.Element('routes')
+    With store, a (ResultStore, run id) pair, candidates are recorded in the store instead:
+    no per-candidate files are written and the batch's trips/routes files are removed.
+    The returned paths are where ResultStore.export() would write each candidate.
+    """
+    batch = TripSet()
+    outputs = {}
+    for candidate in candidates:
+        i = candidate['iteration']
+        batch.extend(candidate_trip_set(candidate, trips, new_order), f"c{i}")
+        outputs[f"c{i}"] = (os.path.join(folder_path, f"merged_routes_{i}.xml"),
+                            os.path.join(folder_path, f"merged_routes_{i}.alt.xml"))
+    trips_file = os.path.join(folder_path, "trips_batch.xml")
+    route_file = os.path.join(folder_path, "routes_batch.xml")
+    route_alt_file = os.path.join(folder_path, "routes_batch.alt.xml")
+    generate_routes(trips_file, network_file, route_file, backend, cache_file, batch)
+    if store is None:
+        totals = demux_routes(route_file, route_alt_file, outputs)
+    else:
+        result_store, run_id = store
+        scenarios = collect_scenarios(route_file, route_alt_file, outputs)
+        totals = {}
+        for candidate in candidates:
+            trucks, routes = scenarios[f"c{candidate['iteration']}"]
+            totals[f"c{candidate['iteration']}"] = (None, result_store.add_candidate(run_id, candidate, trucks, routes))
+        result_store.commit()
+        for path in (trips_file, route_file, route_alt_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    results = []
+    for candidate in candidates:
+        i = candidate['iteration']
+        merged_routes_file, merged_routes_alt_file = outputs[f"c{i}"]
+        _, cost = totals[f"c{i}"]
+        print(f"Total cost for iteration {i}: {round(cost, 3)}")
+        worst_file = merged_routes_file if candidate['kind'] == 'insert' else merged_routes_alt_file
+        results.append((cost, merged_routes_file, worst_file))
+    return results
+
+_scratch_path = None
+
+def _init_worker(folder_path, instrumented=False):
+    """
+    Gives each pool worker its own scratch directory and log file.
+    """
+    global _scratch_path
+    instrument.enable(instrumented)
+    _scratch_path = os.path.join(folder_path, f"worker_{os.getpid()}")
+    os.makedirs(_scratch_path, exist_ok=True)
+    sys.stdout = open(os.path.join(_scratch_path, "output.txt"), 'w', buffering=1)
 
-    vehicles_info = {}
+def _evaluate_in_worker(args):
+    """
+    Evaluates one candidate in the worker's scratch directory and moves its merged routes
+    into folder_path, so result paths match the serial run. The worker's spans and
+    counters travel back with the result.
+    """
+    candidate, trips, new_order, folder_path, network_file, backend, cache_file = args
+    cost, best_file, worst_file = evaluate_candidate(candidate, trips, new_order, _scratch_path,
+                                                     network_file, backend, cache_file)
+    i = candidate['iteration']
+    for name in (f"merged_routes_{i}.xml", f"merged_routes_{i}.alt.xml"):
+        os.replace(os.path.join(_scratch_path, name), os.path.join(folder_path, name))
+    return (cost, os.path.join(folder_path, os.path.basename(best_file)),
+            os.path.join(folder_path, os.path.basename(worst_file)), instrument.drain())
+
+def evaluate_candidates(candidates, trips, new_order, folder_path, network_file, backend='duarouter', cache_file=None, workers=1,
+                        batch=False, store=None):
+    """
+    Evaluates candidates serially, across a process pool when workers > 1, or all in one
+    router run when batch is set or results go to a store (see evaluate_candidates_batched()).
+    Results are returned in candidate order either way.
+    """
+    if batch or store is not None:
+        return evaluate_candidates_batched(candidates, trips, new_order, folder_path, network_file, backend, cache_file, store)
+    if workers <= 1:
+        return [evaluate_candidate(candidate, trips, new_order, folder_path, network_file, backend, cache_file)
+                for candidate in candidates]
+
+    if backend == 'internal' and cache_file:
+        # Set up the shared cache file once, before workers race to create it
+        open_cache_db(cache_file).close()
+
+    tasks = [(candidate, trips, new_order, folder_path, network_file, backend, cache_file) for candidate in candidates]
+    # Spawned workers start clean instead of inheriting open files and SQLite handles
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(folder_path, instrument.is_enabled())) as pool:
+        results = []
+        for cost, best_file, worst_file, recorded in pool.map(_evaluate_in_worker, tasks):
+            instrument.merge(*recorded)
+            results.append((cost, best_file, worst_file))
+    for candidate, (cost, _, _) in zip(candidates, results):
+        print(f"Total cost for iteration {candidate['iteration']}: {round(cost, 3)}")
+    return results
+
+def _init_parser(instrumented=False):
+    instrument.enable(instrumented)
+
+def _merge_in_worker(args):
+    """
+    Merges one candidate's routes in a parser process. Returns the total cost and the
+    worker's spans and counters.
+    """
+    _, _, cost_sum = process_routes(*args)
+    return cost_sum, instrument.drain()
 
-    for vehicle in root.findall('vehicle'):
-        vehicle_id = vehicle.get('id')
-        parts = vehicle_id.split('_')
-        vehicle_id = parts[1]
+async def _run_duarouter(trips_file, network_file, output_file):
+    """
+    Runs duarouter without blocking the event loop; the process is killed when the
+    awaiting task is cancelled.
+    """
+    instrument.count('duarouter_runs')
+    process = await asyncio.create_subprocess_exec('duarouter', '-n', network_file, '-r', trips_file, '-o', output_file)
+    try:
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, 'duarouter')
+    instrument.count_bytes('xml_bytes_written', output_file, output_file[:-len('.xml')] + '.alt.xml')
+
+async def _evaluate_pipelined(candidates, trips, new_order, folder_path, network_file, backend, cache_file, routers, parsers,
+                              slack):
+    loop = asyncio.get_running_loop()
+    # At most `routers` router runs at a time, and no more candidates in flight than the
+    # routers and parsers can hold, so trips are not emitted faster than they are consumed
+    router_slots = asyncio.Semaphore(routers)
+    in_flight = asyncio.Semaphore(routers + parsers)
+    results = {}
+    running = {}
+    best = [float('inf')]
+
+    def lost(candidate):
+        return candidate.get('bound', float('-inf')) - slack > best[0]
+
+    async def evaluate(candidate, pool):
+        i = candidate['iteration']
+        trips_file = os.path.join(folder_path, f"trips_{i}.xml")
+        route_file = os.path.join(folder_path, f"routes_{i}.xml")
+        merged_routes_file = os.path.join(folder_path, f"merged_routes_{i}.xml")
+        merged_routes_alt_file = os.path.join(folder_path, f"merged_routes_{i}.alt.xml")
+        trip_set = candidate_trip_set(candidate, trips, new_order)
+        async with router_slots:
+            if backend == 'internal':
+                # The in-process router holds the GIL; it overlaps with parsing in the pool only
+                generate_routes(trips_file, network_file, route_file, backend, cache_file, trip_set)
+            else:
+                instrument.count('legs_routed', len(trip_set))
+                trip_set.write(trips_file)
+                with instrument.span('duarouter'):
+                    await _run_duarouter(trips_file, network_file, route_file)
+        cost_sum, recorded = await loop.run_in_executor(
+            pool, _merge_in_worker,
+            (route_file, os.path.join(folder_path, f"routes_{i}.alt.xml"), merged_routes_file, merged_routes_alt_file))
+        instrument.merge(*recorded)
+        worst_file = merged_routes_file if candidate['kind'] == 'insert' else merged_routes_alt_file
+        results[i] = (cost_sum, merged_routes_file, worst_file)
+        if cost_sum < best[0]:
+            best[0] = cost_sum
+            for other, task in list(running.values()):
+                if lost(other):
+                    task.cancel()
+
+    def finished(i):
+        # A done callback rather than a finally: a task cancelled before it started never runs its body
+        def release(_):
+            running.pop(i, None)
+            in_flight.release()
+        return release
+
+    tasks = []
+    with ProcessPoolExecutor(max_workers=parsers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_parser, initargs=(instrument.is_enabled(),)) as pool:
+        for candidate in candidates:
+            await in_flight.acquire()
+            if lost(candidate):
+                in_flight.release()
+                continue
+            task = asyncio.create_task(evaluate(candidate, pool))
+            running[candidate['iteration']] = (candidate, task)
+            task.add_done_callback(finished(candidate['iteration']))
+            tasks.append(task)
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException) and not isinstance(outcome, asyncio.CancelledError):
+            raise outcome
+    instrument.count('candidates_cancelled', len(candidates) - len(results))
+    return results
+
+@instrument.timed()
+def evaluate_candidates_pipelined(candidates, trips, new_order, folder_path, network_file, backend='duarouter', cache_file=None,
+                                  routers=2, parsers=1, slack=0.0):
+    """
+    Evaluates candidates like evaluate_candidate(), with up to `routers` router runs in
+    flight while earlier candidates are merged in `parsers` processes, so routing and
+    XML parsing overlap.
+
+    Candidates with a 'bound' (insertion.bound_insertions()) are started cheapest bound
+    first; those whose bound, less slack, exceeds the best cost found are skipped or
+    cancelled, their router process killed. Returns the evaluated candidates and their
+    results, both in candidate order.
+    """
+    if any('bound' in candidate for candidate in candidates):
+        order = sorted(candidates, key=lambda candidate: candidate['bound'])
+    else:
+        order = candidates
+    results = asyncio.run(_evaluate_pipelined(order, trips, new_order, folder_path, network_file, backend, cache_file,
+                                              max(routers, 1), max(parsers, 1), slack))
+    evaluated = [candidate for candidate in candidates if candidate['iteration'] in results]
+    for candidate in evaluated:
+        candidate['total'] = results[candidate['iteration']][0]
+        print(f"Total cost for iteration {candidate['iteration']}: {round(candidate['total'], 3)}")
+    return evaluated, [results[candidate['iteration']] for candidate in evaluated]
+
+@instrument.timed()
+def price_legs(legs, folder_path, network_file, backend='duarouter', cache_file=None):
+    """
+    Returns {(from_edge, to_edge): cost} for all legs, routed in a single batch.
+    """
+    if backend == 'internal':
+        leg_cache = get_leg_cache(network_file, cache_file)
+        leg_costs = {leg: leg_cache.cost(*leg) for leg in legs}
+        leg_cache.flush()
+        return leg_costs
+
+    trip_set = TripSet()
+    for k, (from_edge, to_edge) in enumerate(legs):
+        trip_set.add(from_edge, to_edge, 'leg', k, 0)
+    generate_routes(os.path.join(folder_path, "trips_legs.xml"), network_file,
+                    os.path.join(folder_path, "routes_legs.xml"), backend, cache_file, trip_set)
+    costs = parse_routes_alt(os.path.join(folder_path, "routes_legs.alt.xml"))
+    return {leg: costs.get(f"leg_{k}_0", float('inf')) for k, leg in enumerate(legs)}
+
+def leg_bound(network_file, landmarks=None):
+    """
+    Lower bound of a leg's cost: straight-line distance over the network's bound speed
+    (see network.bound_speed()), or the ALT bound of a landmark index when one is given.
+    """
+    router = load_index(network_file, landmarks) if landmarks else get_router(network_file)
+    return router.lower_bound
 
-        if vehicle_id not in vehicles_info:
-            vehicles_info[vehicle_id] = {'edges': []}
+def rounding_slack(trips):
+    """
+    How far a routed fleet cost can fall below the sum of its exact leg costs: route
+    files round every leg and truck cost to two decimals.
+    """
+    return 0.01 * (len(trips) + 2)
 
-        route_elem = vehicle.find('route')
-        if route_elem is not None:
-            route_edges = route_elem.get('edges').split()
+def evaluate_pruned(candidates, trips, new_order, folder_path, network_file, backend='duarouter', cache_file=None, workers=1,
+                    batch=False, store=None, round_size=1):
+    """
+    Routes in full only the candidates whose lower bound (see insertion.bound_insertions())
+    could still beat the best one routed so far. Returns the evaluated candidates and
+    their results, both in candidate order.
+    """
+    results = {}
 
-            if vehicles_info[vehicle_id]['edges']:
-                if vehicles_info[vehicle_id]['edges'][-1] == route_edges[0]:
-                    route_edges = route_edges[1:]
+    def evaluate(round_candidates):
+        round_results = evaluate_candidates(round_candidates, trips, new_order, folder_path, network_file, backend, cache_file,
+                                            workers, batch, store)
+        for candidate, result in zip(round_candidates, round_results):
+            candidate['total'] = result[0]
+            results[candidate['iteration']] = result
 
-            vehicles_info[vehicle_id]['edges'].extend(route_edges)
-        else:
-            print(f"Warning: 'route' element not found for vehicle {vehicle_id}.")
+    evaluated = prune_insertions(candidates, evaluate, round_size, slack=rounding_slack(trips))
+    return evaluated, [results[candidate['iteration']] for candidate in evaluated]
 
-    for vehicle_id, info in vehicles_info.items():
-        vehicle_elem = ET.SubElement(merged_root, 'vehicle', id=vehicle_id, depart='0.00')
+def price_pruned(candidates, trips, new_order, leg_costs, folder_path, network_file, backend='duarouter', cache_file=None,
+                 round_size=8):
+    """
+    Delta evaluation that prices the new legs of a candidate only while its lower bound
+    could still beat the best delta found. leg_costs holds the fleet's own legs and is
+    extended with every leg priced. Returns the priced candidates in candidate order.
+    """
+    base = sum(leg_costs[leg] for leg in trips)
 
-        new_route_elem = ET.SubElement(vehicle_elem, 'route')
-        new_route_elem.set('edges', ' '.join(info['edges']))
+    def price(round_candidates):
+        legs = [leg for candidate in round_candidates for leg in candidate_legs(candidate, trips, new_order)[0]
+                if leg not in leg_costs]
+        if legs:
+            leg_costs.update(price_legs(list(dict.fromkeys(legs)), folder_path, network_file, backend, cache_file))
+        for candidate in round_candidates:
+            price_insertion(candidate, trips, new_order, lambda from_edge, to_edge: leg_costs[(from_edge, to_edge)], base)
 
-    merged_tree = ET.ElementTree(merged_root)
-    try:
-        merged_tree.write(output_file, encoding='UTF-8', xml_declaration=True)
-        # print(f"Merged routes file '{output_file}' created successfully.")
-    except Exception as e:
-        print(f"Error writing to {output_file}: {e}")
-        
-def get(from_edge, to_edge, folder_path, i, trips, network_file, truck_id):
-    print(truck_id)
-    temp_trips_file = os.path.join(folder_path, f"trips_{i}.xml")
-    temp_route_file = os.path.join(folder_path, f"routes_{i}.xml")
-    temp_routes_alt_file = os.path.join(folder_path, f"routes_{i}.alt.xml")
-    truck =0
-    for j, (from_edge1, to_edge1) in enumerate(trips):
-        if j<4:
-            truck = 1
-        elif j<7:
-            truck = 2
-        else:
-            truck = 3
+    return prune_insertions(candidates, price, round_size, slack=1e-6)
 
-        create_trips_file(from_edge1, to_edge1, folder_path, i, j, truck, 0)
+def write_instrumentation(folder_path):
+    """
+    Writes the run's spans as trace.json (Chrome trace format) and its summary as
+    stats.json, and prints the summary table.
+    """
+    instrument.export_chrome_trace(os.path.join(folder_path, "trace.json"))
+    with open(os.path.join(folder_path, "stats.json"), 'w') as f:
+        json.dump(instrument.stats(), f, indent=2)
+    print(instrument.summary())
 
-    create_trips_file(from_edge, to_edge, folder_path, i, i, truck_id, 0)
-    generate_routes(temp_trips_file, network_file, temp_route_file)
-    
-    merged_routes_alt_file = os.path.join(folder_path, f"merged_routes_{i}.alt.xml")
-    merged_routes_file = os.path.join(folder_path, f"merged_routes_{i}.xml")
-    merge_routes_alt(temp_routes_alt_file, merged_routes_alt_file, use_route_distribution=True)
-    merge_routes(temp_route_file, merged_routes_file)
-    costs = parse_routes_alt(merged_routes_alt_file)
-    cost_sum = sum(costs.values())
-    print(f"Total cost for iteration {i}: {round(cost_sum, 3)}")
-    return cost_sum , merged_routes_file, merged_routes_alt_file
+def main(backend='duarouter', cache_file=None, evaluation='full', workers=1, cost_matrix=None, edge_data=None,
+         network_file='kharagpur.net.xml', trips_file_path='trips.xml', new_order="-1214260859", trace=False,
+         batch=False, store_file=None, prune=False, landmarks=None, pipeline=0, tripinfo=None):
 
-        
-def main():
-    network_file = 'kharagpur.net.xml'
-    new_order = "-1214260859"
-    trips_file_path = 'trips.xml'  # Path to your trips XML file
+    if trace:
+        instrument.enable()
+    instrument.reset()
 
     # Extract trips from the trips XML file
     trips = extract_trips(trips_file_path)
@@ -259,99 +524,160 @@ def main():
     best_path_file = ""
     worst_path_file = ""
     max_cost = 0
-    truck1 = 0
-    trip1 = 0
-    truck2 = 0
-    trip2 = 0
-    to = ""
-    truck = 0
 
     output_file = os.path.join(folder_path, "output.txt")
 
-    with open(output_file, 'w') as f:
-        sys.stdout = f
-        
-        for i, (from_edge, to_edge) in enumerate(trips):
-            if '-'+ to != from_edge:
-                truck = truck + 1
-            if '-' + to != from_edge and i != 0:
-                (cost, merge_routes1, merge_routes_alt1) = get(to, new_order, folder_path, 11 + i, trips, network_file, truck - 1)
+    store = None
+    if store_file:
+        # One SQLite file holds every candidate instead of per-candidate XML files
+        result_store = ResultStore(store_file)
+        store = (result_store, result_store.start_run(folder=folder_path, network=network_file, trips=trips_file_path,
+                                                      new_order=new_order, backend=backend, evaluation=evaluation))
+
+    with open(output_file, 'w') as f, contextlib.redirect_stdout(f):
+
+        if evaluation == 'delta':
+            # Price only the legs each candidate changes, then route the winners in full
+            if edge_data or tripinfo:
+                # Time-dependent pricing: legs are routed at the time the truck reaches them.
+                # Per-edge edgeData measurements override the per-trip tripinfo estimates.
+                network = load_network(network_file)
+                table = load_tripinfo(tripinfo, get_router(network_file)) if tripinfo else None
+                td_router = TimeDependentRouter(network, load_edge_data(edge_data or [], network, table=table))
+                candidates = evaluate_insertions_td(trips, read_departures(trips_file_path), new_order, td_router)
+            elif cost_matrix:
+                matrix = load_or_build(get_router(network_file), matrix_edges(trips, [new_order]), network_file, cost_matrix)
+                candidates = evaluate_insertions(trips, new_order, matrix.cost)
+            elif prune:
+                leg_costs = price_legs(list(dict.fromkeys(trips)), folder_path, network_file, backend, cache_file)
+                bounded = bound_insertions(trips, new_order, leg_bound(network_file, landmarks),
+                                           lambda from_edge, to_edge: leg_costs[(from_edge, to_edge)])
+                candidates = price_pruned(bounded, trips, new_order, leg_costs, folder_path, network_file, backend, cache_file)
+                print(f"Pruned {len(bounded) - len(candidates)} of {len(bounded)} candidates by lower bound")
+            else:
+                leg_costs = price_legs(required_legs(trips, new_order), folder_path, network_file, backend, cache_file)
+                candidates = evaluate_insertions(trips, new_order, lambda from_edge, to_edge: leg_costs[(from_edge, to_edge)])
+            instrument.count('candidates', len(candidates))
+            for candidate in candidates:
+                print(f"Delta cost for iteration {candidate['iteration']}: {round(candidate['delta'], 3)}")
+
+            if edge_data or tripinfo:
+                # Static routing cannot rank time-dependent totals: pick and report by those
+                # totals, and route only the chosen candidates to write their files
+                best, worst = best_and_worst(candidates)
+                evaluated = [best] if worst is best else [candidate for candidate in (best, worst) if candidate is not None]
+                results = evaluate_candidates(evaluated, trips, new_order, folder_path, network_file, backend, cache_file, workers,
+                                              batch, store)
+                if best is not None:
+                    min_cost, best_path_file = best['total'], results[0][1]
+                if worst is not None:
+                    max_cost, worst_path_file = worst['total'], results[-1][2]
+            else:
+                # Route every candidate that rounding could still make the best or the worst, so
+                # near-ties resolve as in the full evaluation
+                evaluated = near_best_and_worst(candidates, rounding_slack(trips))
+                results = evaluate_candidates(evaluated, trips, new_order, folder_path, network_file, backend, cache_file, workers,
+                                              batch, store)
+                for cost, best_file, worst_file in results:
+                    if cost < min_cost:
+                        min_cost = cost
+                        best_path_file = best_file
+                    if cost > max_cost:
+                        max_cost = cost
+                        worst_path_file = worst_file
+        else:
+            candidates = list(enumerate_candidates(trips))
+            instrument.count('candidates', len(candidates))
+            if prune:
+                leg_costs = price_legs(list(dict.fromkeys(trips)), folder_path, network_file, backend, cache_file)
+                candidates = bound_insertions(trips, new_order, leg_bound(network_file, landmarks),
+                                              lambda from_edge, to_edge: leg_costs[(from_edge, to_edge)])
+            if pipeline and not batch and store is None:
+                evaluated, results = evaluate_candidates_pipelined(candidates, trips, new_order, folder_path, network_file,
+                                                                   backend, cache_file, pipeline, workers, rounding_slack(trips))
+            elif prune:
+                round_size = 8 if batch or store is not None else max(workers, 1)
+                evaluated, results = evaluate_pruned(candidates, trips, new_order, folder_path, network_file, backend, cache_file,
+                                                     workers, batch, store, round_size)
+            else:
+                evaluated = candidates
+                results = evaluate_candidates(candidates, trips, new_order, folder_path, network_file, backend, cache_file, workers,
+                                              batch, store)
+            if prune:
+                print(f"Pruned {len(candidates) - len(evaluated)} of {len(candidates)} candidates by lower bound")
+            for cost, best_file, worst_file in results:
                 if cost < min_cost:
                     min_cost = cost
-                    best_path_file = merge_routes1
-                    trip1 = 11 + i
+                    best_path_file = best_file
                 if cost > max_cost:
                     max_cost = cost
-                    worst_path_file = merge_routes_alt1
-                    trip2 = 11 + i
-            to1 = ""
-            truck1 = 0
-            for j, (from_edge1, to_edge1) in enumerate(trips):
-                if i == j:
-                    break
-                if '-' + to1!= from_edge1:
-                    truck1 = truck1 + 1
-                if i != j:
-                    print(truck1)
-                    create_trips_file(from_edge1, to_edge1, folder_path, i, j, truck1, 0)
-                to1 = to_edge1
-  
-            temp_trips_file = os.path.join(folder_path, f"trips_{i}.xml")
-            temp_route_file = os.path.join(folder_path, f"routes_{i}.xml")
-            temp_routes_alt_file = os.path.join(folder_path, f"routes_{i}.alt.xml")
-            
-            create_trips_file(from_edge, new_order, folder_path, i, i, truck, 0)
-            create_trips_file(new_order, to_edge, folder_path, i, i, truck, 1)
-            to1 = ""
-            truck1 = 0
-            for j, (from_edge1, to_edge1) in enumerate(trips):
-                if '-'+ to1!= from_edge1:
-                    truck1 = truck1 + 1
-                if j <= i:
-                    to1 = to_edge1
-                    continue
-
-                if i != j:
-                    create_trips_file(from_edge1, to_edge1, folder_path, i, j, truck1, 0)
-                to1 = to_edge1
-            
-            generate_routes(temp_trips_file, network_file, temp_route_file)
-            
-            merged_routes_alt_file = os.path.join(folder_path, f"merged_routes_{i}.alt.xml")
-            merged_routes_file = os.path.join(folder_path, f"merged_routes_{i}.xml")
-            merge_routes_alt(temp_routes_alt_file, merged_routes_alt_file, use_route_distribution=True)
-            merge_routes(temp_route_file, merged_routes_file)
-
-            costs = parse_routes_alt(merged_routes_alt_file)
-            cost_sum = sum(costs.values())
-            print(f"Total cost for iteration {i}: {round(cost_sum, 3)}")
-
-            if cost_sum < min_cost:
-                min_cost = cost_sum
-                best_path_file = merged_routes_file
-                trip1 = i
-            if cost_sum > max_cost:
-                max_cost = cost_sum
-                worst_path_file = merged_routes_file
-                trip2 = i
-            to = to_edge
-
-        if '-' + to != from_edge:
-            (cost, merge_routes1, merge_routes_alt1) = get(to, new_order, folder_path, 11 + 22, trips, network_file, truck)
-            if cost < min_cost:
-                min_cost = cost
-                best_path_file = merge_routes1
-                trip1 = 11 + 33
-            if cost > max_cost:
-                max_cost = cost
-                worst_path_file = merge_routes_alt1
-                trip2 = 33
-            
+                    worst_path_file = worst_file
+
+        if store is not None:
+            # Only the reported candidates are written out as route files
+            result_store, run_id = store
+            for candidate, (_, best_file, worst_file) in zip(evaluated, results):
+                if best_file == best_path_file or worst_file == worst_path_file:
+                    i = candidate['iteration']
+                    result_store.export(run_id, i, os.path.join(folder_path, f"merged_routes_{i}.xml"),
+                                        os.path.join(folder_path, f"merged_routes_{i}.alt.xml"))
+            result_store.close()
+            print(f"Results stored as run {run_id} in {store_file}")
+
         print(f"Minimum cost: {round(min_cost, 3)} at {best_path_file}")
         print(f"Maximum cost: {round(max_cost, 3)} at {worst_path_file}")
 
-    sys.stdout = sys.__stdout__
+        if backend == 'internal':
+            leg_cache = get_leg_cache(network_file, cache_file)
+            leg_cache.flush()
+            print(f"Leg cache (main process): {leg_cache.stats()}")
 
-if __name__ == "__main__":
-    main()
+        if instrument.is_enabled():
+            write_instrumentation(folder_path)
+
+    return min_cost, best_path_file, max_cost, worst_path_file
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--router', choices=['duarouter', 'internal'], default='duarouter',
+                        help="routing backend: SUMO's duarouter or the in-process router")
+    parser.add_argument('--leg-cache', default=None,
+                        help="SQLite file for the persistent leg-cost cache (internal router only)")
+    parser.add_argument('--evaluation', choices=['full', 'delta'], default='full',
+                        help="route the whole fleet per candidate, or rank candidates by marginal leg cost")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes evaluating candidates in parallel")
+    parser.add_argument('--cost-matrix', default=None,
+                        help="directory of a precomputed cost matrix to price delta evaluation from")
+    parser.add_argument('--edge-data', nargs='+', default=None,
+                        help="SUMO edgeData files with measured travel times for time-dependent delta evaluation")
+    parser.add_argument('--tripinfo', nargs='+', default=None,
+                        help="SUMO tripinfo files whose trip durations scale free-flow times for time-dependent "
+                             "delta evaluation, alone or under --edge-data")
+    parser.add_argument('--network', default='kharagpur.net.xml', help="SUMO network file")
+    parser.add_argument('--trips', default='trips.xml', help="trips file describing the current truck tours")
+    parser.add_argument('--new-order', default="-1214260859", help="edge id of the order to insert")
+    parser.add_argument('--order-lonlat', nargs=2, type=float, default=None, metavar=('LON', 'LAT'),
+                        help="position of the order to insert, snapped to the nearest edge instead of --new-order")
+    parser.add_argument('--batch', action='store_true',
+                        help="route all candidates in a single router run instead of one run per candidate")
+    parser.add_argument('--store', default=None,
+                        help="SQLite result store to record every candidate in, instead of per-candidate route files")
+    parser.add_argument('--pipeline', type=int, default=0, metavar='N',
+                        help="keep up to N router runs in flight while --workers processes merge finished ones "
+                             "(not with --batch or --store); with --prune, candidates that have lost are cancelled")
+    parser.add_argument('--prune', action='store_true',
+                        help="skip candidates whose cost lower bound cannot beat the best one found; the reported "
+                             "maximum is then over the evaluated candidates only")
+    parser.add_argument('--landmarks', default=None,
+                        help="ALT landmark index (landmarks.py build) for tighter --prune bounds")
+    parser.add_argument('--trace', action='store_true',
+                        help="record timing spans and counters; writes trace.json, stats.json and a summary to the run folder")
+    args = parser.parse_args()
+    if args.order_lonlat is not None:
+        args.new_order = snap_order(args.network, *args.order_lonlat)
+    main(backend=args.router, cache_file=args.leg_cache, evaluation=args.evaluation, workers=args.workers,
+         cost_matrix=args.cost_matrix, edge_data=args.edge_data, network_file=args.network,
+         trips_file_path=args.trips, new_order=args.new_order, trace=args.trace,
+         batch=args.batch, store_file=args.store, prune=args.prune, landmarks=args.landmarks,
+         pipeline=args.pipeline, tripinfo=args.tripinfo)
@@ -0,0 +1,253 @@
+import argparse
+import heapq
+import math
+import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict
+
+from router import get_router, read_trips
+
+
+class Alternatives:
+    """
+    The k shortest loopless routes of one leg, best first.
+
+    Routes are stored as deviations: route k is the first split edges of route parent
+    followed by its own suffix, so alternatives share their common prefixes instead of
+    each holding a full edge list. Costs follow Router's convention.
+    """
+
+    def __init__(self):
+        self.parents = []
+        self.splits = []
+        self.suffixes = []
+        self.costs = []
+
+    def add(self, parent, split, suffix, cost):
+        self.parents.append(parent)
+        self.splits.append(split)
+        self.suffixes.append(array('i', suffix))
+        self.costs.append(cost)
+
+    def __len__(self):
+        return len(self.costs)
+
+    def path(self, k):
+        """
+        Edge index list of route k.
+        """
+        if self.parents[k] == -1:
+            return list(self.suffixes[k])
+        return self.path(self.parents[k])[:self.splits[k]] + list(self.suffixes[k])
+
+
+def logit_probabilities(costs, theta=0.01):
+    """
+    Choice probabilities proportional to exp(-theta * (cost - best cost)); theta is per
+    second of extra travel time.
+    """
+    if not costs:
+        return []
+    best = min(costs)
+    weights = [math.exp(-theta * (cost - best)) for cost in costs]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+class AlternativeRouter:
+    """
+    Yen's k shortest loopless paths on top of a Router.
+
+    One backward Dijkstra from the target gives the exact remaining cost of every edge.
+    It yields the shortest route directly and serves as the A* heuristic for every spur
+    search; bans only make routes longer, so it stays admissible. Each spur search then
+    settles little more than the edges of its result. Backward trees are kept for the most
+    recent targets, so all legs ending at the same edge share one.
+    """
+
+    def __init__(self, router, max_trees=64):
+        self.router = router
+        self.network = router.network
+        self.max_trees = max_trees
+        self._trees = OrderedDict()
+
+    def _tree(self, target):
+        if target in self._trees:
+            self._trees.move_to_end(target)
+            return self._trees[target]
+        tree = self.router.one_to_all(target, reverse=True)
+        self._trees[target] = tree
+        if len(self._trees) > self.max_trees:
+            self._trees.popitem(last=False)
+        return tree
+
+    def _spur(self, source, target, remaining, banned_edges, banned_next):
+        """
+        A* from source to target avoiding banned_edges, and banned_next as the edge after
+        source. remaining[e] is the unrestricted cost from e to target, e included.
+        Returns (edge index list, cost) or None.
+        """
+        weights = self.router.weights
+        offsets, targets = self.network.offsets, self.network.targets
+        dist = {source: weights[source]}
+        pred = {source: -1}
+        heap = [(remaining[source], source)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if u == target:
+                path = []
+                while u != -1:
+                    path.append(u)
+                    u = pred[u]
+                path.reverse()
+                return path, dist[target]
+            done.add(u)
+            du = dist[u]
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                if v in banned_edges or (u == source and v in banned_next) or remaining[v] == math.inf:
+                    continue
+                nd = du + weights[v]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd + remaining[v] - weights[v], v))
+        return None
+
+    def k_shortest_index(self, source, target, k):
+        """
+        Up to k loopless routes between two edge indices as an Alternatives, best first.
+        """
+        weights = self.router.weights
+        to_target, next_edge = self._tree(target)
+        alternatives = Alternatives()
+        if to_target[source] == math.inf or k < 1:
+            return alternatives
+        first = [source]
+        while first[-1] != target:
+            first.append(next_edge[first[-1]])
+        alternatives.add(-1, 0, first, to_target[source])
+
+        paths = [first]
+        seen = {tuple(first)}
+        candidates = []
+        while len(paths) < k:
+            previous = paths[-1]
+            root_cost = 0.0
+            for i in range(len(previous) - 1):
+                root = previous[:i + 1]
+                banned_next = {path[i + 1] for path in paths if len(path) > i + 1 and path[:i + 1] == root}
+                spur = self._spur(previous[i], target, to_target, set(root[:-1]), banned_next)
+                if spur is not None:
+                    path = root[:-1] + spur[0]
+                    key = tuple(path)
+                    if key not in seen:
+                        seen.add(key)
+                        heapq.heappush(candidates, (root_cost + spur[1], len(candidates), len(paths) - 1, i, spur[0], path))
+                root_cost += weights[previous[i]]
+            if not candidates:
+                break
+            cost, _, parent, split, suffix, path = heapq.heappop(candidates)
+            alternatives.add(parent, split, suffix, cost)
+            paths.append(path)
+        return alternatives
+
+    def k_shortest(self, from_edge, to_edge, k):
+        """
+        Up to k loopless routes between two edge ids as a list of (edge id list, cost), best first.
+        """
+        index = self.network.edge_index
+        if from_edge not in index or to_edge not in index:
+            return []
+        alternatives = self.k_shortest_index(index[from_edge], index[to_edge], k)
+        edge_ids = self.network.edge_ids
+        return [([edge_ids[e] for e in alternatives.path(j)], alternatives.costs[j]) for j in range(len(alternatives))]
+
+
+def tour_alternatives(leg_alternatives, k):
+    """
+    The k cheapest tours made of one alternative per leg, best first. leg_alternatives is
+    a list of (edge id list, cost) lists per leg; returns (edge id list, cost) tuples, with
+    the edge shared by consecutive legs kept once.
+    """
+    if not leg_alternatives or any(not alternatives for alternatives in leg_alternatives):
+        return []
+    start = (0,) * len(leg_alternatives)
+    heap = [(sum(alternatives[0][1] for alternatives in leg_alternatives), start)]
+    seen = {start}
+    tours = []
+    while heap and len(tours) < k:
+        cost, choice = heapq.heappop(heap)
+        edges = []
+        for alternatives, j in zip(leg_alternatives, choice):
+            route_edges = alternatives[j][0]
+            if edges and route_edges and edges[-1] == route_edges[0]:
+                route_edges = route_edges[1:]
+            edges.extend(route_edges)
+        tours.append((edges, cost))
+        for leg, j in enumerate(choice):
+            if j + 1 < len(leg_alternatives[leg]):
+                following = choice[:leg] + (j + 1,) + choice[leg + 1:]
+                if following not in seen:
+                    seen.add(following)
+                    heapq.heappush(heap, (cost - leg_alternatives[leg][j][1] + leg_alternatives[leg][j + 1][1], following))
+    return tours
+
+
+def _distribution(parent, routes, theta):
+    """
+    Adds a routeDistribution of (edge id list, cost) routes to parent, with logit
+    probabilities and last pointing at the cheapest route.
+    """
+    route_dist_elem = ET.SubElement(parent, 'routeDistribution', last='0')
+    for (edges, cost), probability in zip(routes, logit_probabilities([cost for _, cost in routes], theta)):
+        ET.SubElement(route_dist_elem, 'route', cost=f"{cost:.2f}", probability=f"{probability:.8f}",
+                      edges=' '.join(edges))
+    return route_dist_elem
+
+
+def write_alternatives(trips, alternative_router, output_file, k=3, theta=0.01, merged_alt_file=None):
+    """
+    Writes a duarouter-style .alt.xml with up to k alternatives per trip of trips
+    ((vehicle id, depart, from_edge, to_edge) tuples), and optionally a merged file with
+    the k best tours per truck ("{trip}_{truck}_{order}" ids, like merged_routes_*.alt.xml).
+    """
+    alt_root = ET.Element('routes')
+    trucks = OrderedDict()
+    for vehicle_id, depart, from_edge, to_edge in trips:
+        routes = alternative_router.k_shortest(from_edge, to_edge, k)
+        if not routes:
+            print(f"Warning: no route for trip {vehicle_id} from {from_edge} to {to_edge}.")
+            continue
+        vehicle_elem = ET.SubElement(alt_root, 'vehicle', id=vehicle_id, depart=depart)
+        _distribution(vehicle_elem, routes, theta)
+        trucks.setdefault(vehicle_id.split('_')[1], []).append(routes)
+    ET.ElementTree(alt_root).write(output_file, encoding='UTF-8', xml_declaration=True)
+
+    if merged_alt_file is not None:
+        merged_root = ET.Element('routes')
+        for truck, legs in trucks.items():
+            vehicle_elem = ET.SubElement(merged_root, 'vehicle', id=truck, depart='0.00')
+            _distribution(vehicle_elem, tour_alternatives(legs, k), theta)
+        ET.ElementTree(merged_root).write(merged_alt_file, encoding='UTF-8', xml_declaration=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write k alternative routes per trip and per truck tour")
+    parser.add_argument('trips', help="trips file, e.g. trips_5.xml of a run folder")
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--output', default='routes_alternatives.alt.xml')
+    parser.add_argument('--merged-output', default=None, help="also write the k best tours per truck here")
+    parser.add_argument('-k', type=int, default=3, help="alternatives per trip and per tour")
+    parser.add_argument('--theta', type=float, default=0.01, help="logit parameter per second of extra travel time")
+    args = parser.parse_args()
+
+    alternative_router = AlternativeRouter(get_router(args.network))
+    write_alternatives(read_trips(args.trips), alternative_router, args.output, args.k, args.theta, args.merged_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+def generate_network(net_file, n_edges, kind='grid', seed=0, trim=1.0):
+    """
+    Writes a SUMO-compatible .net.xml with about n_edges directed edges. Every street is a
+    pair of edges "eK" / "-eK" like the reverse edges of a real SUMO net.
+
+    'grid' is a regular 100 m grid with two speed classes; 'random' jitters the nodes,
+    randomizes speeds and adds diagonal streets. Lane lengths are trim times the distance
+    between junction centres, as netconvert shortens lanes at junctions.
+    """
+    rng = random.Random(seed)
+    side = max(2, int(math.ceil(math.sqrt(n_edges / 4.0))) + 1)
+    nodes = {}
+    for i in range(side):
+        for j in range(side):
+            x, y = i * 100.0, j * 100.0
+            if kind == 'random':
+                x += rng.uniform(-30, 30)
+                y += rng.uniform(-30, 30)
+            nodes[(i, j)] = (f"n{i}_{j}", x, y)
+
+    streets = []
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side:
+                streets.append(((i, j), (i + 1, j)))
+            if j + 1 < side:
+                streets.append(((i, j), (i, j + 1)))
+            if kind == 'random' and i + 1 < side and j + 1 < side and rng.random() < 0.2:
+                streets.append(((i, j), (i + 1, j + 1)))
+    streets = streets[:max(1, n_edges // 2)]
+
+    edges = []
+    for k, (a, b) in enumerate(streets):
+        speed = rng.choice([8.33, 13.89, 19.44]) if kind == 'random' else (13.89 if k % 5 == 0 else 8.33)
+        edges.append((f"e{k}", a, b, speed))
+        edges.append((f"-e{k}", b, a, speed))
+
+    outgoing = {}
+    for edge in edges:
+        outgoing.setdefault(edge[1], []).append(edge[0])
+
+    with open(net_file, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<net version="1.20">\n')
+        f.write(f'    <location netOffset="0.00,0.00" convBoundary="0.00,0.00,{side * 100.0:.2f},{side * 100.0:.2f}" '
+                f'origBoundary="0.00,0.00,{side * 100.0:.2f},{side * 100.0:.2f}" projParameter="!"/>\n')
+        for edge_id, a, b, speed in edges:
+            (_, x1, y1), (_, x2, y2) = nodes[a], nodes[b]
+            length = max(trim * math.hypot(x2 - x1, y2 - y1), 0.1)
+            f.write(f'    <edge id="{edge_id}" from="{nodes[a][0]}" to="{nodes[b][0]}" priority="1">\n'
+                    f'        <lane id="{edge_id}_0" index="0" speed="{speed:.2f}" length="{length:.2f}" '
+                    f'shape="{x1:.2f},{y1:.2f} {x2:.2f},{y2:.2f}"/>\n    </edge>\n')
+        for node_id, x, y in nodes.values():
+            f.write(f'    <junction id="{node_id}" type="priority" x="{x:.2f}" y="{y:.2f}"/>\n')
+        for edge_id, _, b, _ in edges:
+            for next_edge in outgoing.get(b, ()):
+                f.write(f'    <connection from="{edge_id}" to="{next_edge}" fromLane="0" toLane="0"/>\n')
+        f.write('</net>\n')
+    return [edge_id for edge_id, _, _, _ in edges if not edge_id.startswith('-')]
+
+
+def generate_fleet(trips_file, streets, n_trucks, n_trips, seed=0):
+    """
+    Writes a trips.xml with n_trips chained deliveries spread over n_trucks, in the layout
+    of the project's trips.xml: each trip departs from the reverse of the previous stop.
+    Returns a new order edge that is not yet served.
+    """
+    rng = random.Random(seed)
+    lines = []
+    depart = 0.0
+    for truck in range(n_trucks):
+        count = n_trips // n_trucks + (1 if truck < n_trips % n_trucks else 0)
+        from_edge = rng.choice(streets)
+        for k in range(count):
+            to_edge = rng.choice(streets)
+            while '-' + to_edge == from_edge:
+                to_edge = rng.choice(streets)
+            lines.append(f'    <trip id="{truck}_{k + 1}" depart="{depart:.2f}" from="{from_edge}" to="{to_edge}"/>\n')
+            from_edge = '-' + to_edge
+            depart += 100.0
+    with open(trips_file, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<routes>\n' + ''.join(lines) + '</routes>\n')
+    return '-' + rng.choice(streets)
+
+
+def run_case(case):
+    """
+    Runs one insertion decision for a generated network and fleet and returns its metrics.
+    Meant to run in a fresh process so that peak RSS belongs to this case only.
+    """
+    import algo
+    import instrument
+
+    work_dir = case['work_dir']
+    os.chdir(work_dir)
+    # main() resets the counters; worker processes send theirs back with their results
+    instrument.enable()
+    start = time.perf_counter()
+    min_cost, best_path_file, max_cost, worst_path_file = algo.main(
+        backend=case['router'], evaluation=case['evaluation'], workers=case['workers'],
+        network_file=case['network_file'], trips_file_path=case['trips_file'], new_order=case['new_order'])
+    latency = time.perf_counter() - start
+    counters = instrument.stats()['counters']
+
+    prune_agrees = None
+    if case.get('check_prune'):
+        from insertion import check_pruning
+        from router import get_router
+        leg_router = get_router(case['network_file'])
+        exhaustive, pruned = check_pruning(algo.extract_trips(case['trips_file']), case['new_order'],
+                                           leg_router.lower_bound, leg_router.cost)
+        prune_agrees = (exhaustive and exhaustive['iteration']) == (pruned and pruned['iteration'])
+
+    return {
+        'latency_s': round(latency, 6),
+        'legs_routed': counters.get('legs_routed', 0),
+        'router_searches': counters.get('router_searches', 0),
+        'subprocesses': counters.get('duarouter_runs', 0),
+        'xml_bytes_written': counters.get('xml_bytes_written', 0),
+        'xml_bytes_parsed': counters.get('xml_bytes_parsed', 0),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_child_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        'min_cost': min_cost,
+        'max_cost': max_cost,
+        'best_path_file': os.path.basename(best_path_file),
+        'worst_path_file': os.path.basename(worst_path_file),
+        'prune_agrees': prune_agrees,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic benchmark of the order insertion pipeline")
+    parser.add_argument('--edges', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--trucks', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--trips', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--kind', choices=['grid', 'random'], default='grid')
+    parser.add_argument('--router', choices=['auto', 'duarouter', 'internal'], default='auto',
+                        help="'auto' uses duarouter when installed and the in-process router otherwise")
+    parser.add_argument('--evaluation', choices=['full', 'delta'], nargs='+', default=['full', 'delta'])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trim', type=float, default=1.0,
+                        help="lane length as a fraction of the junction-centre distance")
+    parser.add_argument('--check-prune', action='store_true',
+                        help="check that --prune lower bounds pick the same best candidate as exhaustive pricing")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--keep', action='store_true', help="keep the generated networks and run folders")
+    args = parser.parse_args()
+
+    backend = args.router
+    if backend == 'auto':
+        backend = 'duarouter' if shutil.which('duarouter') else 'internal'
+
+    base_dir = tempfile.mkdtemp(prefix='vrp_benchmark_')
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for n_edges in args.edges:
+            net_file = os.path.join(base_dir, f"grid_{n_edges}.net.xml")
+            streets = generate_network(net_file, n_edges, args.kind, args.seed, args.trim)
+            for n_trucks in args.trucks:
+                for n_trips in args.trips:
+                    if n_trips < n_trucks:
+                        continue
+                    for evaluation in args.evaluation:
+                        work_dir = os.path.join(base_dir, f"e{n_edges}_t{n_trucks}_n{n_trips}_{evaluation}")
+                        os.makedirs(work_dir)
+                        trips_file = os.path.join(work_dir, 'trips.xml')
+                        new_order = generate_fleet(trips_file, streets, n_trucks, n_trips, args.seed)
+                        case = {
+                            'edges': n_edges, 'trucks': n_trucks, 'trips': n_trips, 'kind': args.kind,
+                            'router': backend, 'evaluation': evaluation, 'workers': args.workers,
+                            'network_file': net_file, 'trips_file': trips_file, 'new_order': new_order,
+                            'work_dir': work_dir, 'check_prune': args.check_prune,
+                        }
+                        # Executor workers are not daemonic, so --workers can start a pool of its own
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                            metrics = pool.submit(run_case, case).result()
+                        result = {key: case[key] for key in ('edges', 'trucks', 'trips', 'kind', 'router',
+                                                             'evaluation', 'workers')}
+                        result.update(metrics)
+                        results.append(result)
+                        print(json.dumps(result))
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    disagreements = [result for result in results if result['prune_agrees'] is False]
+    for result in disagreements:
+        print(f"Pruning picked a different best candidate than exhaustive pricing for "
+              f"{result['edges']} edges, {result['trucks']} trucks, {result['trips']} trips")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'duarouter_available': shutil.which('duarouter') is not None,
+            'results': results,
+        }, f, indent=2)
+    if disagreements:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+
+from leg_cache import network_fingerprint
+
+
+def matrix_edges(trips, new_orders=()):
+    """
+    Returns the distinct edges that insertion pricing needs: trip endpoints plus new order edges.
+    """
+    edges = {}
+    for from_edge, to_edge in trips:
+        edges[from_edge] = None
+        edges[to_edge] = None
+    for edge in new_orders:
+        edges[edge] = None
+    return list(edges)
+
+
+def _save_npy(path, array):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class CostMatrix:
+    """
+    Travel costs between a set of edges, persisted in a directory as costs.npy
+    (costs[i, j] is the cost from edges[i] to edges[j]), an optional pred.npy with
+    one shortest-path predecessor tree per source edge, and meta.json.
+    Loaded matrices are memory-mapped read-only, so processes share the pages.
+
+    The files may hold spare rows and columns beyond the edges in meta.json, which
+    add_edges() fills in place; meta.json is written last, so a reader never sees a
+    half-written row.
+    """
+
+    def __init__(self, directory, edges, fingerprint, costs, predecessors=None):
+        self.directory = directory
+        self.edges = list(edges)
+        self.index = {edge: i for i, edge in enumerate(self.edges)}
+        self.fingerprint = fingerprint
+        self.costs = costs
+        self.predecessors = predecessors
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        n = len(meta['edges'])
+        costs = np.load(os.path.join(path, 'costs.npy'), mmap_mode='r')[:n, :n]
+        pred_file = os.path.join(path, 'pred.npy')
+        predecessors = np.load(pred_file, mmap_mode='r')[:n] if os.path.exists(pred_file) else None
+        return cls(path, meta['edges'], meta['fingerprint'], costs, predecessors)
+
+    def _save_meta(self):
+        meta_file = os.path.join(self.directory, 'meta.json')
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'edges': self.edges}, f)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    def __contains__(self, edge):
+        return edge in self.index
+
+    def cost(self, from_edge, to_edge):
+        return float(self.costs[self.index[from_edge], self.index[to_edge]])
+
+    def path(self, from_edge, to_edge, network):
+        """
+        Rebuilds the edge sequence from_edge -> to_edge from the stored predecessor trees.
+        Returns None if unreachable or if the matrix was built without predecessors.
+        """
+        if self.predecessors is None or not np.isfinite(self.cost(from_edge, to_edge)):
+            return None
+        pred = self.predecessors[self.index[from_edge]]
+        e = network.edge_index[to_edge]
+        path = []
+        while e != -1:
+            path.append(network.edge_ids[e])
+            e = int(pred[e])
+        path.reverse()
+        return path
+
+    def add_edge(self, router, edge):
+        self.add_edges(router, [edge])
+
+    def _reserve(self, size):
+        """
+        Makes costs.npy (and pred.npy) hold at least size rows, doubling their capacity
+        when they are full so that repeated additions copy the matrix only O(log n) times.
+        Returns the writable costs and predecessor arrays.
+        """
+        n = len(self.edges)
+        costs_file = os.path.join(self.directory, 'costs.npy')
+        pred_file = os.path.join(self.directory, 'pred.npy')
+        costs = np.lib.format.open_memmap(costs_file, mode='r+')
+        preds = np.lib.format.open_memmap(pred_file, mode='r+') if self.predecessors is not None else None
+        if costs.shape[0] >= size:
+            return costs, preds
+
+        capacity = max(size, 2 * costs.shape[0])
+        grown = np.lib.format.open_memmap(costs_file + '.tmp', mode='w+', dtype=np.float64, shape=(capacity, capacity))
+        grown[:n, :n] = costs[:n, :n]
+        grown.flush()
+        del costs, grown
+        os.replace(costs_file + '.tmp', costs_file)
+        if preds is not None:
+            grown = np.lib.format.open_memmap(pred_file + '.tmp', mode='w+', dtype=np.int32,
+                                              shape=(capacity, preds.shape[1]))
+            grown[:n] = preds[:n]
+            grown.flush()
+            del preds, grown
+            os.replace(pred_file + '.tmp', pred_file)
+        return (np.lib.format.open_memmap(costs_file, mode='r+'),
+                np.lib.format.open_memmap(pred_file, mode='r+') if self.predecessors is not None else None)
+
+    def add_edges(self, router, edges):
+        """
+        Extends the matrix by one row and one column per new edge, using one forward and
+        one backward search per edge instead of recomputing the matrix. Rows and columns
+        are written into spare capacity in place, so only the new entries cost I/O.
+        """
+        new_edges = [edge for edge in dict.fromkeys(edges) if edge not in self.index]
+        if not new_edges:
+            return
+        network = router.network
+        n = len(self.edges)
+        size = n + len(new_edges)
+        targets = [network.edge_index[e] for e in self.edges + new_edges]
+        costs, preds = self._reserve(size)
+
+        for i, edge in enumerate(new_edges, start=n):
+            source = network.edge_index[edge]
+            dist, pred = router.one_to_all(source)
+            reverse_dist, _ = router.one_to_all(source, reverse=True)
+            costs[i, :size] = [dist[t] for t in targets]
+            costs[:size, i] = [reverse_dist[t] for t in targets]
+            costs[i, i] = dist[source]
+            if preds is not None:
+                preds[i] = pred
+        costs.flush()
+        del costs
+        if preds is not None:
+            preds.flush()
+            del preds
+
+        self.edges.extend(new_edges)
+        self.index.update((edge, i) for i, edge in enumerate(new_edges, start=n))
+        self._save_meta()
+        self.costs = np.load(os.path.join(self.directory, 'costs.npy'), mmap_mode='r')[:size, :size]
+        if self.predecessors is not None:
+            self.predecessors = np.load(os.path.join(self.directory, 'pred.npy'), mmap_mode='r')[:size]
+
+
+def build_cost_matrix(router, edges, network_file, path, predecessors=False):
+    """
+    Computes the full cost matrix over edges with one one-to-all search per source edge
+    and writes it to the directory path.
+    """
+    os.makedirs(path, exist_ok=True)
+    network = router.network
+    indices = [network.edge_index[edge] for edge in edges]
+
+    costs = np.empty((len(indices), len(indices)), dtype=np.float64)
+    pred_trees = np.empty((len(indices), len(network)), dtype=np.int32) if predecessors else None
+    for i, source in enumerate(indices):
+        dist, pred = router.one_to_all(source)
+        costs[i] = [dist[t] for t in indices]
+        if predecessors:
+            pred_trees[i] = pred
+
+    _save_npy(os.path.join(path, 'costs.npy'), costs)
+    pred_file = os.path.join(path, 'pred.npy')
+    if predecessors:
+        _save_npy(pred_file, pred_trees)
+    elif os.path.exists(pred_file):
+        os.remove(pred_file)
+
+    matrix = CostMatrix(path, edges, network_fingerprint(network_file), None)
+    matrix._save_meta()
+    return CostMatrix.load(path)
+
+
+def load_or_build(router, edges, network_file, path, predecessors=False):
+    """
+    Loads the matrix at path if it was built for this network, adding any missing edges
+    as new rows and columns; otherwise builds it from scratch.
+    """
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        matrix = CostMatrix.load(path)
+        if matrix.fingerprint == network_fingerprint(network_file):
+            matrix.add_edges(router, edges)
+            return matrix
+    return build_cost_matrix(router, edges, network_file, path, predecessors)
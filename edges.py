@@ -0,0 +1,98 @@
+from array import array
+
+import numpy as np
+
+
+class EdgeTable:
+    """
+    Interns SUMO edge ids to dense int32 indices.
+
+    Routes are kept as array('i') of indices instead of lists of strings; edge ids are
+    only materialized again when XML is written. reverse[e] is the index of the opposite
+    direction of e ("x" <-> "-x"), or -1 while that edge has not been interned; both
+    entries are filled in as soon as the second direction is seen.
+    """
+
+    def __init__(self, edge_ids=()):
+        self.ids = []
+        self.index = {}
+        self.reverse = array('i')
+        for edge_id in edge_ids:
+            self.intern(edge_id)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, edge_id):
+        e = self.index.get(edge_id)
+        if e is None:
+            e = len(self.ids)
+            self.ids.append(edge_id)
+            self.index[edge_id] = e
+            r = self.index.get(edge_id[1:] if edge_id.startswith('-') else '-' + edge_id, -1)
+            self.reverse.append(r)
+            if r >= 0:
+                self.reverse[r] = e
+        return e
+
+    def route(self, edges):
+        """
+        array('i') of a space-separated edges attribute or an iterable of edge ids.
+        """
+        if isinstance(edges, str):
+            edges = edges.split()
+        intern = self.intern
+        return array('i', [intern(edge_id) for edge_id in edges])
+
+    def edge_ids(self, route):
+        ids = self.ids
+        return [ids[e] for e in route]
+
+    def join(self, route):
+        """
+        The edges attribute of a route.
+        """
+        return ' '.join(self.edge_ids(route))
+
+    def is_reverse(self, edge_id, other_id):
+        """
+        True when other_id is the opposite direction of edge_id.
+        """
+        if not edge_id or not other_id:
+            return False
+        other = self.intern(other_id)
+        return self.reverse[self.intern(edge_id)] == other
+
+
+# Process-wide table for routes read from route files; a Network has its own table whose
+# indices match the network's edge indices.
+EDGES = EdgeTable()
+
+
+def append_route(route, leg):
+    """
+    Appends leg to route in place, dropping the first edge of leg when it repeats the
+    last edge of route (the seam between consecutive legs).
+    """
+    if len(route) and len(leg) and route[-1] == leg[0]:
+        route.extend(leg[1:])
+    else:
+        route.extend(leg)
+    return route
+
+
+def join_routes(legs):
+    """
+    Concatenates consecutive leg routes into one int32 array, seams deduplicated as in
+    append_route().
+    """
+    legs = [np.frombuffer(leg, dtype=np.int32) if isinstance(leg, array) else np.asarray(leg, dtype=np.int32)
+            for leg in legs]
+    legs = [leg for leg in legs if len(leg)]
+    if not legs:
+        return np.zeros(0, dtype=np.int32)
+    firsts = np.fromiter((leg[0] for leg in legs), dtype=np.int32, count=len(legs))
+    lasts = np.fromiter((leg[-1] for leg in legs), dtype=np.int32, count=len(legs))
+    skip = np.zeros(len(legs), dtype=bool)
+    skip[1:] = firsts[1:] == lasts[:-1]
+    return np.concatenate([leg[1:] if s else leg for leg, s in zip(legs, skip.tolist())])
@@ -0,0 +1,348 @@
+import argparse
+import itertools
+import json
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from edges import join_routes
+from insertion import truck_numbers, trip_id_trucks
+from leg_cache import get_leg_cache
+from local_search import write_tours
+from snapping import get_snapper
+from trip_set import TRIPS_HEADER
+
+
+class Stop:
+    """
+    A place a truck drives to. arrive is the edge it drives to and depart the edge its
+    next leg leaves from: the reverse edge for trips of a trips file, the same edge for
+    inserted orders. meta holds per-stop data (trip id, depart time, order fields).
+    """
+
+    __slots__ = ('arrive', 'depart', 'meta')
+
+    def __init__(self, arrive, depart=None, meta=None):
+        self.arrive = arrive
+        self.depart = arrive if depart is None else depart
+        self.meta = meta or {}
+
+
+class Truck:
+    """
+    One truck: the depot edge its tour starts from and its stops in driving order.
+    legs[k] is the cost of the leg into stops[k].
+    """
+
+    __slots__ = ('id', 'depot', 'stops', 'legs')
+
+    def __init__(self, truck_id, depot, stops=()):
+        self.id = truck_id
+        self.depot = depot
+        self.stops = list(stops)
+        self.legs = []
+
+    def departs(self, position):
+        """
+        The edge the leg into stops[position] leaves from.
+        """
+        return self.depot if position == 0 else self.stops[position - 1].depart
+
+    def cost(self):
+        return sum(self.legs)
+
+
+def _truck_keys(trip_ids, trips):
+    """
+    Truck of every trip: the prefix of "{truck}_{n}" trip ids as in trips.xml, or
+    insertion.truck_numbers() when ids do not follow that pattern.
+    """
+    prefixes = trip_id_trucks(trip_ids)
+    if prefixes is not None:
+        return prefixes
+    return [str(truck) for truck in truck_numbers(trips)]
+
+
+def trucks_from_trips(trips, keys=None, metas=None):
+    """
+    Trucks of (from_edge, to_edge) trips, one stop per trip, in trip order. keys names
+    the truck of every trip and defaults to the trip id prefix of insertion.Trips, or
+    insertion.truck_numbers(); metas gives each stop's metadata.
+    """
+    if keys is None:
+        keys = _truck_keys(getattr(trips, 'trip_ids', None), trips)
+    trucks = {}
+    for j, (from_edge, to_edge) in enumerate(trips):
+        if keys[j] not in trucks:
+            trucks[keys[j]] = Truck(keys[j], from_edge)
+        truck = trucks[keys[j]]
+        if truck.stops:
+            # The previous stop is left from where this trip starts
+            truck.stops[-1].depart = from_edge
+        truck.stops.append(Stop(to_edge, meta=None if metas is None else metas[j]))
+    return list(trucks.values())
+
+
+def read_trips_file(trips_file):
+    """
+    Trucks of a trips file, one stop per trip, in file order. Each stop keeps its trip
+    id and depart time as metadata.
+    """
+    rows = [(trip.get('id'), trip.get('depart', '0.00'), trip.get('from'), trip.get('to'))
+            for trip in ET.parse(trips_file).getroot().findall('trip')]
+    trips = [(from_edge, to_edge) for _, _, from_edge, to_edge in rows]
+    return trucks_from_trips(trips, _truck_keys([row[0] for row in rows], trips),
+                             [{'trip_id': trip_id, 'depart_time': depart} for trip_id, depart, _, _ in rows])
+
+
+class Fleet:
+    """
+    Trucks with explicit, ordered stops, priced by leg_cost(from_edge, to_edge), e.g. a
+    warm LegCache's cost().
+
+    Insertions update tours and the cached leg costs of the touched truck in place. An
+    order is inserted as a stop between two consecutive stops (or after the last one);
+    its marginal cost is c(prev, order) + c(order, next) - c(prev, next), the same delta
+    insertion.evaluate_insertions() uses.
+    """
+
+    def __init__(self, trucks, leg_cost):
+        self.trucks = trucks
+        self.leg_cost = leg_cost
+        for truck in trucks:
+            self._price(truck)
+
+    @classmethod
+    def from_trips_file(cls, trips_file, leg_cost):
+        return cls(read_trips_file(trips_file), leg_cost)
+
+    def reprice(self, leg_cost):
+        """
+        Switches to a new leg_cost, e.g. the LegCache of a regenerated network, and
+        re-prices every truck with it.
+        """
+        self.leg_cost = leg_cost
+        for truck in self.trucks:
+            self._price(truck)
+
+    def _price(self, truck):
+        truck.legs = [self.leg_cost(truck.departs(k), stop.arrive) for k, stop in enumerate(truck.stops)]
+
+    def total_cost(self):
+        return sum(truck.cost() for truck in self.trucks)
+
+    def truck_insertion(self, t, edge):
+        """
+        Cheapest position for a stop at edge in truck t. Returns (delta, position), with
+        the stop going before stops[position].
+        """
+        truck = self.trucks[t]
+        leg_cost = self.leg_cost
+        best = (math.inf, None)
+        for position in range(len(truck.stops) + 1):
+            delta = leg_cost(truck.departs(position), edge)
+            if position < len(truck.stops):
+                delta += leg_cost(edge, truck.stops[position].arrive) - truck.legs[position]
+            if delta < best[0]:
+                best = (delta, position)
+        return best
+
+    def best_insertion(self, edge):
+        """
+        Cheapest (truck index, position, delta) over all trucks, or None if no truck can reach edge.
+        """
+        best = None
+        for t in range(len(self.trucks)):
+            delta, position = self.truck_insertion(t, edge)
+            if position is not None and (best is None or delta < best[2]):
+                best = (t, position, delta)
+        return best
+
+    def insert(self, edge, t, position, meta=None):
+        """
+        Adds a stop at edge to truck t before stops[position] and returns it.
+        """
+        truck = self.trucks[t]
+        stop = Stop(edge, meta=meta)
+        truck.stops.insert(position, stop)
+        truck.legs.insert(position, self.leg_cost(truck.departs(position), edge))
+        if position + 1 < len(truck.stops):
+            truck.legs[position + 1] = self.leg_cost(edge, truck.stops[position + 1].arrive)
+        return stop
+
+    def insert_orders(self, orders, strategy='sequential', regret=2):
+        """
+        Inserts a wave of orders, dicts with an 'edge' plus any metadata ('id', ...).
+
+        'sequential' takes orders in the given order, each at its cheapest position.
+        'regret' repeatedly inserts the pending order with the largest regret-k value:
+        how much more its insertion would cost in its k-1 next best trucks than in its
+        best one, so orders with few good options are placed first. Only the truck that
+        received an order is re-priced for the orders still pending.
+
+        Returns one result per order, in input order: the truck id, position (the depot
+        is 0, as in service.py) and delta at the time of insertion, or an error.
+        """
+        results = [None] * len(orders)
+        if strategy == 'sequential':
+            for o, order in enumerate(orders):
+                best = self.best_insertion(order['edge'])
+                if best is None or math.isinf(best[2]):
+                    results[o] = self._rejected(order)
+                    continue
+                results[o] = self._commit(order, *best)
+            return results
+
+        if strategy != 'regret':
+            raise ValueError(f"unknown insertion strategy {strategy!r}")
+        options = {o: [self.truck_insertion(t, order['edge']) for t in range(len(self.trucks))]
+                   for o, order in enumerate(orders)}
+        while options:
+            chosen, chosen_key = None, None
+            for o, truck_options in options.items():
+                deltas = sorted(delta for delta, _ in truck_options)
+                if not deltas or math.isinf(deltas[0]):
+                    continue
+                # An order with fewer than k reachable trucks has nowhere else to go
+                value = sum(deltas[j] - deltas[0] for j in range(1, min(regret, len(deltas))))
+                key = (value, -deltas[0], -o)
+                if chosen_key is None or key > chosen_key:
+                    chosen, chosen_key = o, key
+            if chosen is None:
+                for o in options:
+                    results[o] = self._rejected(orders[o])
+                break
+            t = min(range(len(self.trucks)), key=lambda t: options[chosen][t][0])
+            delta, position = options.pop(chosen)[t]
+            results[chosen] = self._commit(orders[chosen], t, position, delta)
+            for o in options:
+                options[o][t] = self.truck_insertion(t, orders[o]['edge'])
+        return results
+
+    def _commit(self, order, t, position, delta):
+        meta = {key: value for key, value in order.items() if key != 'edge'}
+        self.insert(order['edge'], t, position, meta)
+        # Positions count the depot as 0, so the first stop is position 1
+        return {'id': order.get('id'), 'edge': order['edge'], 'truck': self.trucks[t].id, 'position': position + 1,
+                'delta': round(delta, 3)}
+
+    @staticmethod
+    def _rejected(order):
+        return {'id': order.get('id'), 'edge': order.get('edge'), 'error': "no truck can reach this edge"}
+
+    def routes(self, t, leg_cache):
+        """
+        Edge ids of truck t's whole route, its legs routed through leg_cache (a LegCache).
+        """
+        truck = self.trucks[t]
+        legs = [leg_cache.route_index(truck.departs(k), stop.arrive) for k, stop in enumerate(truck.stops)]
+        return leg_cache.edges.edge_ids(join_routes([leg[0] for leg in legs if leg is not None]).tolist())
+
+    def tours(self):
+        """
+        (stops, tours) for local_search.LocalSearch and write_tours(). Each stop is
+        (arrival edge, departure edge); each tour lists stop indices, starting with the
+        truck's depot as (None, depot).
+        """
+        stops, tours = [], []
+        for truck in self.trucks:
+            stops.append((None, truck.depot))
+            tour = [len(stops) - 1]
+            for stop in truck.stops:
+                stops.append((stop.arrive, stop.depart))
+                tour.append(len(stops) - 1)
+            tours.append(tour)
+        return stops, tours
+
+    def write_trips(self, trips_file):
+        """
+        Writes the tours as a trips file with "{truck}_{n}" ids, which read_trips_file()
+        and insertion.truck_numbers() group back into the same trucks. Inserted stops,
+        which have no depart time of their own, depart with the stop before them, so
+        depart times never decrease along a tour.
+        """
+        lines = []
+        for truck in self.trucks:
+            depart = 0.0
+            for k, stop in enumerate(truck.stops):
+                depart = max(depart, float(stop.meta.get('depart_time', depart)))
+                lines.append(f'<trip id="{truck.id}_{k + 1}" depart="{depart:.2f}" '
+                             f'from="{truck.departs(k)}" to="{stop.arrive}"/>\n')
+        with open(trips_file, 'w') as f:
+            f.write(TRIPS_HEADER + ''.join(lines) + '</routes>')
+
+
+def read_orders(orders_file):
+    """
+    Yields the orders of a JSONL file, one JSON object per line, skipping blank lines.
+    """
+    with open(orders_file) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def resolve_orders(orders, network_file, edge_index, max_distance=50.0):
+    """
+    Gives every order an 'edge': orders with 'lon'/'lat' are snapped together in one
+    vectorized query. Returns an error message per order, None for orders with a known edge.
+    """
+    located = [order for order in orders if 'edge' not in order and 'lon' in order and 'lat' in order]
+    if located:
+        snapper = get_snapper(network_file)
+        heading = np.array([order.get('heading', np.nan) for order in located], dtype=np.float64)
+        edges, _, _ = snapper.snap_lonlat([[order['lon'], order['lat']] for order in located], max_distance, heading)
+        for order, edge in zip(located, snapper.edge_ids(edges)):
+            if edge is not None:
+                order['edge'] = edge
+    return [None if order.get('edge') in edge_index else "no known edge for this order" for order in orders]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert a stream of orders into the truck tours of a trips file")
+    parser.add_argument('orders', help="JSONL file, one order per line with an 'edge' or 'lon'/'lat' and optional 'id'")
+    parser.add_argument('--trips', default='trips.xml')
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--leg-cache', default=None, help="SQLite file for the persistent leg-cost cache")
+    parser.add_argument('--strategy', choices=['sequential', 'regret'], default='sequential')
+    parser.add_argument('--regret', type=int, default=2, help="k of regret-k insertion")
+    parser.add_argument('--wave', type=int, default=500, help="orders read and inserted together")
+    parser.add_argument('--max-distance', type=float, default=50.0, help="snapping radius for lon/lat orders, metres")
+    parser.add_argument('--results', default='order_results.jsonl', help="one JSON result per order")
+    parser.add_argument('--output', default='merged_routes_fleet.xml', help="merged routes of the final tours")
+    parser.add_argument('--trips-output', default=None, help="also write the final tours as a trips file")
+    args = parser.parse_args()
+
+    leg_cache = get_leg_cache(args.network, args.leg_cache)
+    fleet = Fleet.from_trips_file(args.trips, leg_cache.cost)
+    initial_cost = fleet.total_cost()
+    inserted = rejected = 0
+    orders = read_orders(args.orders)
+    with open(args.results, 'w') as f:
+        while True:
+            wave = list(itertools.islice(orders, args.wave))
+            if not wave:
+                break
+            errors = resolve_orders(wave, args.network, leg_cache.edges.index, args.max_distance)
+            placed = iter(fleet.insert_orders([order for order, error in zip(wave, errors) if error is None],
+                                              args.strategy, args.regret))
+            for order, error in zip(wave, errors):
+                result = next(placed) if error is None else {'id': order.get('id'), 'edge': order.get('edge'), 'error': error}
+                if 'error' in result:
+                    rejected += 1
+                else:
+                    inserted += 1
+                f.write(json.dumps(result) + '\n')
+            leg_cache.flush()
+
+    print(f"Inserted {inserted} orders ({rejected} rejected); cost {round(initial_cost, 3)} -> {round(fleet.total_cost(), 3)}")
+    alt_file = args.output[:-len('.xml')] + '.alt.xml' if args.output.endswith('.xml') else args.output + '.alt'
+    stops, tours = fleet.tours()
+    write_tours(tours, stops, leg_cache, args.output, alt_file, [truck.id for truck in fleet.trucks])
+    if args.trips_output:
+        fleet.write_trips(args.trips_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import json
+import re
+
+import numpy as np
+
+from network import load_network
+from route_stream import iter_vehicles
+
+# WGS84 ellipsoid and UTM constants
+_A = 6378137.0
+_F = 1 / 298.257223563
+_E2 = _F * (2 - _F)
+_EP2 = _E2 / (1 - _E2)
+_K0 = 0.9996
+
+
+def edge_indices(network, edges):
+    """
+    Maps edge ids to an int64 index array; unknown edges are dropped.
+    """
+    index = network.edge_index
+    return np.fromiter((index[edge] for edge in edges if edge in index), dtype=np.int64)
+
+
+def routes_xy(network, routes):
+    """
+    Turns many routes into one flat polyline buffer with a single gather over the edge shapes.
+
+    routes is a list of edge id lists. Returns (xy, offsets): the points of route r are
+    xy[offsets[r]:offsets[r + 1]]. The shared point where one edge ends and the next begins
+    is kept once.
+    """
+    per_route = [edge_indices(network, edges) for edges in routes]
+    counts = np.array([len(edges) for edges in per_route], dtype=np.int64)
+    edges = np.concatenate(per_route) if per_route else np.zeros(0, dtype=np.int64)
+    route_of_edge = np.repeat(np.arange(len(per_route)), counts)
+
+    shape_offsets = np.asarray(network.shape_offsets)
+    starts = shape_offsets[edges]
+    sizes = shape_offsets[edges + 1] - starts
+    # Point k of the gather belongs to edge e = edge_of_point[k] at position k - first[e]
+    edge_of_point = np.repeat(np.arange(len(edges)), sizes)
+    first = np.cumsum(sizes) - sizes
+    points = starts[edge_of_point] + (np.arange(sizes.sum()) - first[edge_of_point])
+    xy = np.asarray(network.shape_xy)[points]
+    route_of_point = route_of_edge[edge_of_point]
+
+    keep = np.ones(len(xy), dtype=bool)
+    if len(xy):
+        same_route = route_of_point[1:] == route_of_point[:-1]
+        keep[1:] = ~(same_route & np.all(xy[1:] == xy[:-1], axis=1))
+    xy = xy[keep]
+    offsets = np.zeros(len(per_route) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(route_of_point[keep], minlength=len(per_route)), out=offsets[1:])
+    return xy, offsets
+
+
+def _utm_zone(proj):
+    match = re.search(r'\+proj=utm\b.*?\+zone=(\d+)', proj)
+    if match is None:
+        return None
+    return int(match.group(1)), '+south' in proj
+
+
+def _utm_to_lonlat(easting, northing, zone, south=False):
+    """
+    Vectorized inverse transverse Mercator (WGS84 UTM) after Snyder, accurate to well under
+    a metre within a zone.
+    """
+    x = easting - 500000.0
+    y = northing - (10000000.0 if south else 0.0)
+    e1 = (1 - np.sqrt(1 - _E2)) / (1 + np.sqrt(1 - _E2))
+    mu = y / _K0 / (_A * (1 - _E2 / 4 - 3 * _E2 ** 2 / 64 - 5 * _E2 ** 3 / 256))
+    phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu)
+            + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+            + (151 * e1 ** 3 / 96) * np.sin(6 * mu)
+            + (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+    sin1, cos1, tan1 = np.sin(phi1), np.cos(phi1), np.tan(phi1)
+    n1 = _A / np.sqrt(1 - _E2 * sin1 ** 2)
+    t1 = tan1 ** 2
+    c1 = _EP2 * cos1 ** 2
+    r1 = _A * (1 - _E2) / (1 - _E2 * sin1 ** 2) ** 1.5
+    d = x / (n1 * _K0)
+    lat = phi1 - (n1 * tan1 / r1) * (d ** 2 / 2
+                                      - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * _EP2) * d ** 4 / 24
+                                      + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * _EP2 - 3 * c1 ** 2) * d ** 6 / 720)
+    lon = (d - (1 + 2 * t1 + c1) * d ** 3 / 6
+           + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * _EP2 + 24 * t1 ** 2) * d ** 5 / 120) / cos1
+    lon0 = np.radians((zone - 1) * 6 - 180 + 3)
+    return np.degrees(lon0 + lon), np.degrees(lat)
+
+
+def _lonlat_to_utm(lon, lat, zone, south=False):
+    """
+    Vectorized forward transverse Mercator (WGS84 UTM), the inverse of _utm_to_lonlat().
+    """
+    phi, lam = np.radians(lat), np.radians(lon) - np.radians((zone - 1) * 6 - 180 + 3)
+    sin, cos, tan = np.sin(phi), np.cos(phi), np.tan(phi)
+    n = _A / np.sqrt(1 - _E2 * sin ** 2)
+    t = tan ** 2
+    c = _EP2 * cos ** 2
+    a = cos * lam
+    m = _A * ((1 - _E2 / 4 - 3 * _E2 ** 2 / 64 - 5 * _E2 ** 3 / 256) * phi
+              - (3 * _E2 / 8 + 3 * _E2 ** 2 / 32 + 45 * _E2 ** 3 / 1024) * np.sin(2 * phi)
+              + (15 * _E2 ** 2 / 256 + 45 * _E2 ** 3 / 1024) * np.sin(4 * phi)
+              - (35 * _E2 ** 3 / 3072) * np.sin(6 * phi))
+    easting = _K0 * n * (a + (1 - t + c) * a ** 3 / 6 + (5 - 18 * t + t ** 2 + 72 * c - 58 * _EP2) * a ** 5 / 120) + 500000.0
+    northing = _K0 * (m + n * tan * (a ** 2 / 2 + (5 - t + 9 * c + 4 * c ** 2) * a ** 4 / 24
+                                     + (61 - 58 * t + t ** 2 + 600 * c - 330 * _EP2) * a ** 6 / 720))
+    return easting, northing + (10000000.0 if south else 0.0)
+
+
+def _projection(network):
+    location = network.location
+    proj = location.get('projParameter', '!')
+    if proj == '!':
+        raise ValueError("network has no geo-projection (projParameter is '!')")
+    offset_x, offset_y = (float(v) for v in location.get('netOffset', '0,0').split(','))
+    return proj, offset_x, offset_y
+
+
+def _pyproj(proj):
+    try:
+        import pyproj
+    except ImportError:
+        raise ValueError(f"projection {proj!r} needs pyproj") from None
+    return pyproj.Proj(proj)
+
+
+def to_lonlat(network, xy):
+    """
+    Projects an (n, 2) array of network coordinates to (n, 2) lon/lat in one shot, using
+    the net's <location> netOffset and projParameter like sumolib's convertXY2LonLat().
+
+    UTM projections are inverted with numpy; any other projection needs pyproj.
+    """
+    proj, offset_x, offset_y = _projection(network)
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    x, y = xy[:, 0] - offset_x, xy[:, 1] - offset_y
+
+    zone = _utm_zone(proj)
+    if zone is not None:
+        lon, lat = _utm_to_lonlat(x, y, *zone)
+    else:
+        lon, lat = _pyproj(proj)(x, y, inverse=True)
+    return np.column_stack([lon, lat])
+
+
+def from_lonlat(network, lonlat):
+    """
+    Projects an (n, 2) array of lon/lat to network coordinates, the inverse of to_lonlat().
+    """
+    proj, offset_x, offset_y = _projection(network)
+    lonlat = np.asarray(lonlat, dtype=np.float64).reshape(-1, 2)
+    zone = _utm_zone(proj)
+    if zone is not None:
+        x, y = _lonlat_to_utm(lonlat[:, 0], lonlat[:, 1], *zone)
+    else:
+        x, y = _pyproj(proj)(lonlat[:, 0], lonlat[:, 1])
+    return np.column_stack([np.asarray(x) + offset_x, np.asarray(y) + offset_y])
+
+
+def read_routes(routes_file):
+    """
+    Returns {vehicle id: edge list} for every vehicle of a routes file such as merged_routes_*.xml.
+    """
+    routes = {}
+    for vehicle in iter_vehicles(routes_file):
+        route = vehicle.find('route')
+        if route is None:
+            route_distribution = vehicle.find('routeDistribution')
+            route = route_distribution.find('route') if route_distribution is not None else None
+        if route is not None:
+            routes[vehicle.get('id')] = route.get('edges', '').split()
+    return routes
+
+
+def routes_geojson(network, routes, lonlat=True):
+    """
+    Builds a GeoJSON FeatureCollection with one LineString per route in {name: edge list}.
+    Coordinates are lon/lat when lonlat is set, network x/y otherwise.
+    """
+    names = list(routes)
+    xy, offsets = routes_xy(network, [routes[name] for name in names])
+    coords = to_lonlat(network, xy) if lonlat and len(xy) else xy
+    coords = np.round(coords, 7 if lonlat else 2).tolist()
+    features = []
+    for r, name in enumerate(names):
+        features.append({
+            'type': 'Feature',
+            'properties': {'vehicle': name, 'edges': len(routes[name])},
+            'geometry': {'type': 'LineString', 'coordinates': coords[offsets[r]:offsets[r + 1]]},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export route files as GeoJSON polylines")
+    parser.add_argument('routes', nargs='+', help="routes files, e.g. merged_routes_*.xml")
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--output', default='routes.geojson')
+    parser.add_argument('--xy', action='store_true', help="keep network coordinates instead of projecting to lon/lat")
+    args = parser.parse_args()
+
+    network = load_network(args.network)
+    routes = {}
+    for routes_file in args.routes:
+        for vehicle, edges in read_routes(routes_file).items():
+            routes[f"{routes_file}:{vehicle}" if len(args.routes) > 1 else vehicle] = edges
+    with open(args.output, 'w') as f:
+        json.dump(routes_geojson(network, routes, lonlat=not args.xy), f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import math
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from insertion import enumerate_candidates, candidate_legs, required_legs, best_and_worst, truck_numbers
+from network import load_network, junction_distances
+from router import Router
+
+
+def read_edge_travel_times(edge_data_file, network):
+    """
+    Returns {edge id: travel time} from a SUMO edgeData output, averaged over its intervals.
+    Speeds are converted with the edge length when no traveltime is given.
+    """
+    totals = {}
+    for _, interval in ET.iterparse(edge_data_file, events=('end',)):
+        if interval.tag != 'interval':
+            continue
+        for edge in interval.findall('edge'):
+            e = network.edge_index.get(edge.get('id'))
+            if e is None:
+                continue
+            if edge.get('traveltime') is not None:
+                travel_time = float(edge.get('traveltime'))
+            elif edge.get('speed') is not None and float(edge.get('speed')) > 0:
+                travel_time = network.lengths[e] / float(edge.get('speed'))
+            else:
+                continue
+            total = totals.setdefault(edge.get('id'), [0.0, 0])
+            total[0] += travel_time
+            total[1] += 1
+        interval.clear()
+    return {edge_id: total / count for edge_id, (total, count) in totals.items()}
+
+
+class IncrementalPlanner:
+    """
+    Keeps every leg needed to price the fleet and all insertion candidates routed, and
+    updates them as edge travel times change.
+
+    An edge -> legs reverse index finds the legs whose route crosses an edge that got
+    slower or closed; only those are re-routed. A leg can only get cheaper through an edge
+    that got faster, so such legs are re-routed only when a straight-line lower bound
+    through that edge (junction-centre distance over network.bound_speed()) beats their
+    current cost; the bound is evaluated for all legs at once per faster edge. Candidate
+    deltas touching a changed leg are re-priced and best/worst are picked again with
+    insertion.best_and_worst().
+    """
+
+    def __init__(self, network, trips, new_order):
+        self.network = network
+        self.trips = trips
+        self.new_order = new_order
+        self.router = Router(network, array('d', network.travel_times))
+        self.distances = junction_distances(network)
+        self.from_node = np.asarray(network.from_node, dtype=np.int64)
+        self.to_node = np.asarray(network.to_node, dtype=np.int64)
+        self.node_x = np.asarray(network.node_x, dtype=np.float64)
+        self.node_y = np.asarray(network.node_y, dtype=np.float64)
+        self.legs = {}
+        self.edge_legs = [set() for _ in range(len(network))]
+        for leg in required_legs(trips, new_order):
+            self._route(leg)
+
+        self.candidates = list(enumerate_candidates(trips))
+        self.leg_candidates = {}
+        for c, candidate in enumerate(self.candidates):
+            added, removed = candidate_legs(candidate, trips, new_order)
+            for leg in added + removed:
+                self.leg_candidates.setdefault(leg, set()).add(c)
+            self._price(c)
+        self._pick()
+
+    def _pick(self):
+        base = self.base_cost()
+        for candidate in self.candidates:
+            candidate['total'] = base + candidate['delta']
+        self.best, self.worst = best_and_worst(self.candidates)
+
+    def _route(self, leg):
+        """
+        (Re-)routes one leg and keeps the reverse index in step. Returns True if its cost changed.
+        """
+        old = self.legs.get(leg)
+        if old is not None:
+            for e in old[0]:
+                self.edge_legs[e].discard(leg)
+        index = self.network.edge_index
+        result = None
+        if leg[0] in index and leg[1] in index:
+            result = self.router.route_index(index[leg[0]], index[leg[1]])
+        path, cost = result if result is not None else ([], math.inf)
+        self.legs[leg] = (path, cost)
+        for e in path:
+            self.edge_legs[e].add(leg)
+        return old is None or old[1] != cost
+
+    def leg_cost(self, from_edge, to_edge):
+        return self.legs[(from_edge, to_edge)][1]
+
+    def _price(self, c):
+        candidate = self.candidates[c]
+        added, removed = candidate_legs(candidate, self.trips, self.new_order)
+        candidate['delta'] = sum(self.leg_cost(*leg) for leg in added) - sum(self.leg_cost(*leg) for leg in removed)
+
+    def base_cost(self):
+        return sum(self.leg_cost(*leg) for leg in self.trips)
+
+    def truck_costs(self):
+        costs = {}
+        for truck, leg in zip(truck_numbers(self.trips), self.trips):
+            costs[truck] = costs.get(truck, 0.0) + self.leg_cost(*leg)
+        return costs
+
+    def _may_improve(self, faster):
+        """
+        For every leg in self.legs, in order: False when no route of the leg through any of
+        the (edge index, new travel time) pairs in faster can beat its current cost.
+        """
+        if not faster or self.router.max_speed <= 0:
+            return np.full(len(self.legs), bool(faster))
+        index = self.network.edge_index
+        sources = np.array([index.get(from_edge, -1) for from_edge, _ in self.legs], dtype=np.int64)
+        targets = np.array([index.get(to_edge, -1) for _, to_edge in self.legs], dtype=np.int64)
+        costs = np.array([cost for _, cost in self.legs.values()])
+        known = (sources >= 0) & (targets >= 0)
+        s, t = np.where(known, sources, 0), np.where(known, targets, 0)
+
+        # Straight-line bound from the end of s to the start of e, and from the end of e to
+        # the start of t, plus the weights of s, e and t
+        start_x, start_y = self.node_x[self.to_node[s]], self.node_y[self.to_node[s]]
+        end_x, end_y = self.node_x[self.from_node[t]], self.node_y[self.from_node[t]]
+        weights = np.asarray(self.router.weights)
+        head = weights[s] + weights[t]
+        inv_speed = 1.0 / self.router.max_speed
+        may_improve = ~known | np.isnan(start_x + start_y + end_x + end_y) | (costs == math.inf)
+        for e, weight in faster:
+            ax, ay = self.node_x[self.from_node[e]], self.node_y[self.from_node[e]]
+            bx, by = self.node_x[self.to_node[e]], self.node_y[self.to_node[e]]
+            if math.isnan(ax + ay + bx + by):
+                return np.ones(len(self.legs), dtype=bool)
+            distance = np.hypot(ax - start_x, ay - start_y) + np.hypot(end_x - bx, end_y - by)
+            may_improve |= (head + distance * inv_speed + weight < costs) | (sources == e) | (targets == e)
+        return may_improve
+
+    def apply(self, changes):
+        """
+        Applies {edge id: new travel time} (math.inf closes an edge) and refreshes the
+        affected legs and candidates. Returns a summary with the legs re-routed, the legs
+        whose cost changed and the new best / worst candidates.
+        """
+        weights = self.router.weights
+        stale = set()
+        faster = []
+        for edge_id, travel_time in changes.items():
+            e = self.network.edge_index.get(edge_id)
+            if e is None or travel_time == weights[e]:
+                continue
+            if travel_time > weights[e]:
+                stale.update(self.edge_legs[e])
+            else:
+                faster.append((e, travel_time))
+                # Keep distance / max_speed a lower bound of every path under the new times
+                if travel_time > 0:
+                    self.router.max_speed = max(self.router.max_speed, self.distances[e] / travel_time)
+                elif self.distances[e] > 0:
+                    self.router.max_speed = math.inf
+            weights[e] = travel_time
+
+        # Unreachable legs may open up through any changed edge
+        stale.update(leg for leg, (_, cost) in self.legs.items() if cost == math.inf)
+        stale.update(leg for leg, may_improve in zip(self.legs, self._may_improve(faster)) if may_improve)
+
+        changed = [leg for leg in stale if self._route(leg)]
+        touched = set()
+        for leg in changed:
+            touched.update(self.leg_candidates.get(leg, ()))
+        for c in touched:
+            self._price(c)
+        self._pick()
+        return {'legs_rerouted': len(stale), 'legs_changed': len(changed), 'candidates_repriced': len(touched),
+                'best': self.best, 'worst': self.worst}
+
+
+def describe(best, worst):
+    """
+    Formats the best / worst candidates. best_and_worst() finds no best when every total
+    is infinite, e.g. once closures cut a leg of the current fleet.
+    """
+    if best is None:
+        return "no candidate has a finite cost (a fleet leg is unreachable)"
+    parts = [f"best iteration {best['iteration']} ({round(best['total'], 3)})"]
+    if worst is not None:
+        parts.append(f"worst iteration {worst['iteration']} ({round(worst['total'], 3)})")
+    return ", ".join(parts)
+
+
+def main():
+    from algo import extract_trips
+
+    parser = argparse.ArgumentParser(description="Refresh the best/worst insertion as edge travel times change")
+    parser.add_argument('edge_data', nargs='+', help="SUMO edgeData files, applied in order as traffic updates")
+    parser.add_argument('--trips', default='trips.xml')
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--new-order', default="-1214260859")
+    args = parser.parse_args()
+
+    network = load_network(args.network)
+    planner = IncrementalPlanner(network, extract_trips(args.trips), args.new_order)
+    print(f"Initial: {describe(planner.best, planner.worst)}")
+    for edge_data_file in args.edge_data:
+        summary = planner.apply(read_edge_travel_times(edge_data_file, network))
+        print(f"{edge_data_file}: {summary['legs_rerouted']} legs re-routed, {summary['legs_changed']} changed; "
+              f"{describe(summary['best'], summary['worst'])}")
+
+
+if __name__ == "__main__":
+    main()
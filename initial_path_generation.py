@@ -1,8 +1,10 @@
-import sumolib
 import subprocess
 import xml.etree.ElementTree as ET
 import folium
 
+from network import load_network
+from geometry import routes_xy
+
 def generate_routes(trips_file, network_file, output_file):
     """
     Generates routes using SUMO's duarouter.
@@ -28,20 +30,14 @@ def get_edge_coordinates(edge_id, net_file):
     """
     Retrieves coordinates for a given edge.
     """
-    net = sumolib.net.readNet(net_file)
-    edge = net.getEdge(edge_id)
-    return edge.getFromNode().getCoord(), edge.getToNode().getCoord()
+    return load_network(net_file).edge_coordinates(edge_id)
 
 def get_path_coordinates(edges, net_file):
     """
-    Retrieves coordinates for a list of edges.
+    Retrieves the shape polyline of a list of edges.
     """
-    coords = []
-    for edge_id in edges:
-        from_coords, to_coords = get_edge_coordinates(edge_id, net_file)
-        coords.append(from_coords)
-        coords.append(to_coords)
-    return coords
+    xy, _ = routes_xy(load_network(net_file), [edges])
+    return [tuple(point) for point in xy.tolist()]
 
 
 def create_trips_file(from_edge, to_edge, trips_file):
@@ -0,0 +1,204 @@
+import re
+
+from edges import EDGES
+
+
+class Trips(list):
+    """
+    (from_edge, to_edge) trips of a trips file, in file order, with their trip ids.
+    """
+
+    def __init__(self, trips=(), trip_ids=None):
+        super().__init__(trips)
+        self.trip_ids = trip_ids
+
+
+def trip_id_trucks(trip_ids):
+    """
+    The truck of every trip as the prefix of "{truck}_{n}" trip ids, as in trips.xml and
+    the files fleet.Fleet.write_trips() writes, or None when ids do not follow that pattern.
+    """
+    if trip_ids and all(re.fullmatch(r'[^_]+_\d+', trip_id or '') for trip_id in trip_ids):
+        return [trip_id.split('_')[0] for trip_id in trip_ids]
+    return None
+
+
+def truck_numbers(trips):
+    """
+    Assigns a truck number to every trip. Trips read with their ids (Trips) are grouped
+    by trip id prefix; otherwise a trip continues the current truck only if it departs
+    from the reverse of the previous trip's destination.
+    """
+    prefixes = trip_id_trucks(getattr(trips, 'trip_ids', None))
+    trucks = []
+    truck = 0
+    if prefixes is not None:
+        for j, prefix in enumerate(prefixes):
+            if j == 0 or prefix != prefixes[j - 1]:
+                truck = truck + 1
+            trucks.append(truck)
+        return trucks
+    to = ""
+    for from_edge, to_edge in trips:
+        if not EDGES.is_reverse(to, from_edge):
+            truck = truck + 1
+        trucks.append(truck)
+        to = to_edge
+    return trucks
+
+
+def enumerate_candidates(trips):
+    """
+    Yields every insertion candidate in the order algo.main() evaluates them.
+
+    'insert' candidates replace trip `index` (a -> b) by a -> new_order -> b.
+    'append' candidates add a leg from the destination of trip `index`, the last stop of
+    `truck`, to new_order.
+    """
+    # Iteration numbers name the candidate's output files: inserts are 0..n-1, the append
+    # before trip i is n + i and the append after the last trip is 2n.
+    n = len(trips)
+    trucks = truck_numbers(trips)
+    for i, (from_edge, to_edge) in enumerate(trips):
+        if i != 0 and trucks[i] != trucks[i - 1]:
+            yield {'iteration': n + i, 'kind': 'append', 'index': i - 1, 'truck': trucks[i] - 1}
+        yield {'iteration': i, 'kind': 'insert', 'index': i, 'truck': trucks[i]}
+
+    # Trips with "{truck}_{n}" ids always get a last-truck append; without ids a last trip
+    # that ends on the reverse of where it started is taken as a closed round trip
+    if trips and (trip_id_trucks(getattr(trips, 'trip_ids', None)) is not None
+                  or not EDGES.is_reverse(trips[-1][1], trips[-1][0])):
+        yield {'iteration': 2 * n, 'kind': 'append', 'index': n - 1, 'truck': trucks[-1]}
+
+
+def candidate_legs(candidate, trips, new_order):
+    """
+    Returns the legs added and removed by a candidate as two lists of (from_edge, to_edge).
+    """
+    from_edge, to_edge = trips[candidate['index']]
+    if candidate['kind'] == 'insert':
+        return [(from_edge, new_order), (new_order, to_edge)], [(from_edge, to_edge)]
+    return [(to_edge, new_order)], []
+
+
+def required_legs(trips, new_order):
+    """
+    Returns every distinct leg needed to price the current fleet and all candidates.
+    """
+    legs = dict.fromkeys(trips)
+    for candidate in enumerate_candidates(trips):
+        added, _ = candidate_legs(candidate, trips, new_order)
+        legs.update(dict.fromkeys(added))
+    return list(legs)
+
+
+def evaluate_insertions(trips, new_order, leg_cost):
+    """
+    Prices every candidate by its marginal cost c(a, new) + c(new, b) - c(a, b), or
+    c(last, new) for appends, instead of re-routing the whole fleet.
+
+    leg_cost maps (from_edge, to_edge) to a cost. Each candidate gets 'delta' and
+    'total', the fleet cost after the insertion.
+    """
+    base = sum(leg_cost(from_edge, to_edge) for from_edge, to_edge in trips)
+    candidates = []
+    for candidate in enumerate_candidates(trips):
+        price_insertion(candidate, trips, new_order, leg_cost, base)
+        candidates.append(candidate)
+    return candidates
+
+
+def price_insertion(candidate, trips, new_order, leg_cost, base):
+    """
+    Sets a candidate's 'delta' and 'total' as evaluate_insertions() does, given the cost
+    base of the current fleet.
+    """
+    added, removed = candidate_legs(candidate, trips, new_order)
+    candidate['delta'] = sum(leg_cost(*leg) for leg in added) - sum(leg_cost(*leg) for leg in removed)
+    candidate['total'] = base + candidate['delta']
+    return candidate
+
+
+def bound_insertions(trips, new_order, leg_bound, leg_cost):
+    """
+    Gives every candidate a lower bound 'bound' on its fleet cost without routing its
+    new legs. leg_bound must never exceed the cost of a leg; leg_cost prices the legs of
+    the current fleet exactly, since the leg an insert removes enters with a minus sign.
+    """
+    base = sum(leg_cost(from_edge, to_edge) for from_edge, to_edge in trips)
+    candidates = []
+    for candidate in enumerate_candidates(trips):
+        added, removed = candidate_legs(candidate, trips, new_order)
+        candidate['bound'] = base + sum(leg_bound(*leg) for leg in added) - sum(leg_cost(*leg) for leg in removed)
+        candidates.append(candidate)
+    return candidates
+
+
+def prune_insertions(candidates, evaluate, round_size=1, slack=0.0, key='total'):
+    """
+    Evaluates candidates exactly in order of their 'bound', round_size at a time, and
+    stops once the cheapest cost found is below the bound of every candidate left, less
+    slack (rounding the evaluation may apply to costs). evaluate(candidates) must set key
+    on each candidate it is given.
+
+    Returns the evaluated candidates in their original order, so best_and_worst() over
+    them picks the same best candidate as over all candidates. The worst is only the
+    worst of those evaluated.
+    """
+    order = sorted(range(len(candidates)), key=lambda c: candidates[c]['bound'])
+    best = float('inf')
+    done = 0
+    while done < len(order) and candidates[order[done]]['bound'] - slack <= best:
+        batch = [candidates[c] for c in order[done:done + round_size]]
+        evaluate(batch)
+        best = min([best] + [candidate[key] for candidate in batch])
+        done += len(batch)
+    return [candidates[c] for c in sorted(order[:done])]
+
+
+def check_pruning(trips, new_order, leg_bound, leg_cost):
+    """
+    Picks the best candidate once by pricing every candidate and once with
+    prune_insertions() over bound_insertions(), and returns both. They differ only if
+    leg_bound overestimates some leg's cost.
+    """
+    exhaustive, _ = best_and_worst(evaluate_insertions(trips, new_order, leg_cost))
+    base = sum(leg_cost(from_edge, to_edge) for from_edge, to_edge in trips)
+
+    def evaluate(candidates):
+        for candidate in candidates:
+            price_insertion(candidate, trips, new_order, leg_cost, base)
+
+    pruned, _ = best_and_worst(prune_insertions(bound_insertions(trips, new_order, leg_bound, leg_cost), evaluate,
+                                                slack=1e-6))
+    return exhaustive, pruned
+
+
+def near_best_and_worst(candidates, slack, key='total'):
+    """
+    The candidates whose key is within slack of the cheapest or the most expensive one,
+    in candidate order. When routing changes each key by less than slack/2, these include
+    every candidate best_and_worst() can pick over the routed costs.
+    """
+    if not candidates:
+        return []
+    low = min(candidate[key] for candidate in candidates) + slack
+    high = max(candidate[key] for candidate in candidates) - slack
+    return [candidate for candidate in candidates if candidate[key] <= low or candidate[key] >= high]
+
+
+def best_and_worst(candidates, key='total'):
+    """
+    Picks the cheapest and the most expensive candidate with the same strict min/max
+    tracking as algo.main(), so ties resolve to the earliest candidate.
+    """
+    best, worst = None, None
+    min_cost, max_cost = float('inf'), 0
+    for candidate in candidates:
+        if candidate[key] < min_cost:
+            min_cost = candidate[key]
+            best = candidate
+        if candidate[key] > max_cost:
+            max_cost = candidate[key]
+            worst = candidate
+    return best, worst
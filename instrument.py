@@ -0,0 +1,176 @@
+import functools
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_events = []
+_totals = {}
+_counters = {}
+# perf_counter_ns reads CLOCK_MONOTONIC on Linux, so spans drained from pool workers line
+# up with the parent's on one timeline.
+_origin = time.perf_counter_ns()
+_lock = threading.Lock()
+
+
+def enable(on=True):
+    """
+    Turns recording on or off. While off, spans and counters cost one flag check.
+    """
+    global _enabled
+    _enabled = on
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _totals.clear()
+        _counters.clear()
+
+
+def _record(name, start, end):
+    with _lock:
+        _events.append((name, start, end, os.getpid(), threading.get_ident()))
+        _add_total(name, end - start)
+
+
+def _add_total(name, duration):
+    total = _totals.get(name)
+    if total is None:
+        _totals[name] = [1, duration, duration]
+    else:
+        total[0] += 1
+        total[1] += duration
+        total[2] = max(total[2], duration)
+
+
+class span:
+    """
+    Context manager timing a block under name when instrumentation is enabled.
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            _record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function as a span named name (default: its qualified name).
+    """
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(span_name, start, time.perf_counter_ns())
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """
+    Adds n to the counter name when instrumentation is enabled.
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def count_bytes(name, *paths):
+    """
+    Adds the size of every existing file in paths to the counter name when
+    instrumentation is enabled.
+    """
+    if _enabled:
+        count(name, sum(os.path.getsize(path) for path in paths if os.path.exists(path)))
+
+
+def drain():
+    """
+    Returns and clears this process's recorded spans and counters, so a pool worker can
+    hand them to the parent with its result.
+    """
+    with _lock:
+        events, counters = list(_events), dict(_counters)
+        _events.clear()
+        _totals.clear()
+        _counters.clear()
+    return events, counters
+
+
+def merge(events, counters):
+    """
+    Adds spans and counters drained in another process to this one.
+    """
+    for name, start, end, pid, tid in events:
+        with _lock:
+            _events.append((name, start, end, pid, tid))
+            _add_total(name, end - start)
+    with _lock:
+        for name, value in counters.items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def stats():
+    """
+    Returns {'spans': {name: {'calls', 'total_ms', 'mean_ms', 'max_ms'}}, 'counters': {...}}.
+    """
+    with _lock:
+        spans = {name: {'calls': calls, 'total_ms': total / 1e6, 'mean_ms': total / calls / 1e6, 'max_ms': longest / 1e6}
+                 for name, (calls, total, longest) in _totals.items()}
+        return {'spans': spans, 'counters': dict(_counters)}
+
+
+def summary():
+    """
+    Formats the recorded spans and counters as a plain-text table, slowest span first.
+    """
+    data = stats()
+    lines = [f"{'span':<40} {'calls':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10}"]
+    for name, row in sorted(data['spans'].items(), key=lambda item: -item[1]['total_ms']):
+        lines.append(f"{name:<40} {row['calls']:>8} {row['total_ms']:>12.3f} {row['mean_ms']:>10.3f} {row['max_ms']:>10.3f}")
+    if data['counters']:
+        lines.append('')
+        lines.append(f"{'counter':<40} {'value':>8}")
+        for name, value in sorted(data['counters'].items()):
+            lines.append(f"{name:<40} {value:>8}")
+    return '\n'.join(lines)
+
+
+def export_chrome_trace(path):
+    """
+    Writes recorded spans and final counter values in Chrome trace event format
+    (load in chrome://tracing or Perfetto).
+    """
+    with _lock:
+        events = [{'name': name, 'ph': 'X', 'ts': (start - _origin) / 1e3, 'dur': (end - start) / 1e3,
+                   'pid': pid, 'tid': tid}
+                  for name, start, end, pid, tid in _events]
+        end_ts = max((event['ts'] + event['dur'] for event in events), default=0)
+        events.extend({'name': name, 'ph': 'C', 'ts': end_ts, 'pid': os.getpid(), 'args': {name: value}}
+                      for name, value in _counters.items())
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
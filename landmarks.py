@@ -0,0 +1,180 @@
+import argparse
+import math
+import random
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from network import load_network
+from router import Router
+from leg_cache import network_fingerprint
+from route_stream import chosen_route
+
+
+class LandmarkRouter(Router):
+    """
+    A* router guided by ALT (A*, landmarks, triangle inequality) lower bounds.
+
+    from_landmark[v, l] is the cost from landmark l to edge v and to_landmark[v, l]
+    the cost from v to landmark l, both with the Router cost convention. Each query
+    uses only the active landmarks with the tightest bound between its endpoints.
+    """
+
+    def __init__(self, network, landmarks, from_landmark, to_landmark, weights=None, active=4):
+        super().__init__(network, weights)
+        self.landmarks = landmarks
+        self.from_landmark = from_landmark
+        self.to_landmark = to_landmark
+        self.active = active
+        self._from_columns = [array('d', column) for column in np.asarray(from_landmark).T]
+        self._to_columns = [array('d', column) for column in np.asarray(to_landmark).T]
+
+    def _active_landmarks(self, target, source):
+        """
+        The self.active landmarks giving the tightest bound from source to target, or all
+        of them without a source.
+        """
+        if source is None or len(self.landmarks) <= self.active:
+            return range(len(self.landmarks))
+        with np.errstate(invalid='ignore'):
+            forward = self.from_landmark[target] - self.from_landmark[source]
+            backward = self.to_landmark[source] - self.to_landmark[target]
+        bound = np.nan_to_num(np.fmax(forward, backward), nan=-np.inf)
+        return np.argsort(-bound, kind='stable')[:self.active].tolist()
+
+    def _search_heuristic(self, source, target):
+        weights = self.weights
+        w_target = weights[target]
+        # One (from column, from target, to column, to target) per active landmark, as
+        # array('d') columns and Python floats: h runs once per push and numpy ufuncs over
+        # every landmark cost more than the search they save.
+        active = [(self._from_columns[l], self._from_columns[l][target],
+                   self._to_columns[l], self._to_columns[l][target])
+                  for l in self._active_landmarks(target, source)]
+
+        def h(e):
+            # Cost still to pay after e: cost(e -> target) - w[e]
+            bound = 0.0
+            slack = w_target - weights[e]
+            for from_column, from_target, to_column, to_target in active:
+                forward = from_target - from_column[e]
+                if forward > bound:
+                    bound = forward
+                backward = to_column[e] - to_target + slack
+                if backward > bound:
+                    bound = backward
+            return bound
+        return h
+
+
+def select_landmarks(router, count, seed=0):
+    """
+    Picks landmarks greedily: each new landmark is the edge farthest (forward plus
+    backward cost) from the landmarks chosen so far.
+    """
+    n = len(router.network)
+    rng = random.Random(seed)
+    landmarks = [rng.randrange(n)]
+    closeness = np.full(n, np.inf)
+    forward, backward = [], []
+    while True:
+        dist, _ = router.one_to_all(landmarks[-1])
+        reverse_dist, _ = router.one_to_all(landmarks[-1], reverse=True)
+        forward.append(dist)
+        backward.append(reverse_dist)
+        if len(landmarks) == count:
+            break
+        round_trip = np.asarray(dist) + np.asarray(reverse_dist)
+        closeness = np.minimum(closeness, np.where(np.isfinite(round_trip), round_trip, -1.0))
+        closeness[landmarks] = -1.0
+        candidate = int(np.argmax(closeness))
+        if closeness[candidate] <= 0:
+            break
+        landmarks.append(candidate)
+    return landmarks, np.array(forward).T.copy(), np.array(backward).T.copy()
+
+
+def build_index(network_file, index_file, count=16, seed=0):
+    """
+    Preprocesses network_file into an ALT landmark index stored at index_file (.npz).
+    """
+    network = load_network(network_file)
+    landmarks, from_landmark, to_landmark = select_landmarks(Router(network), count, seed)
+    with open(index_file, 'wb') as f:
+        np.savez(f, landmarks=np.array(landmarks, dtype=np.int32), from_landmark=from_landmark,
+                 to_landmark=to_landmark, fingerprint=np.array(network_fingerprint(network_file)))
+    return LandmarkRouter(network, landmarks, from_landmark, to_landmark)
+
+
+def load_index(network_file, index_file):
+    """
+    Loads a LandmarkRouter for network_file. Raises ValueError if the index was built
+    from a different network.
+    """
+    data = np.load(index_file)
+    if str(data['fingerprint']) != network_fingerprint(network_file):
+        raise ValueError(f"{index_file} was built for a different version of {network_file}")
+    return LandmarkRouter(load_network(network_file), data['landmarks'].tolist(),
+                          data['from_landmark'], data['to_landmark'])
+
+
+def validate(router, routes_alt_files, sample=100, seed=0):
+    """
+    Compares router costs against the costs duarouter wrote into routes_*.alt.xml files
+    for a random sample of vehicles, using the route each routeDistribution chose.
+    Returns a list of (vehicle id, duarouter cost, router cost).
+    """
+    trips = []
+    for routes_alt_file in routes_alt_files:
+        for vehicle in ET.parse(routes_alt_file).getroot().findall('vehicle'):
+            route_distribution = vehicle.find('routeDistribution')
+            if route_distribution is None:
+                continue
+            route = chosen_route(route_distribution)
+            if route is None:
+                continue
+            edges = route.get('edges').split()
+            trips.append((vehicle.get('id'), edges[0], edges[-1], float(route.get('cost', 0))))
+
+    rng = random.Random(seed)
+    if len(trips) > sample:
+        trips = rng.sample(trips, sample)
+    return [(vehicle_id, cost, router.cost(from_edge, to_edge)) for vehicle_id, from_edge, to_edge, cost in trips]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ALT landmark index for SUMO networks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="preprocess a .net.xml into a landmark index")
+    build_parser.add_argument('network_file')
+    build_parser.add_argument('index_file')
+    build_parser.add_argument('--landmarks', type=int, default=16)
+
+    validate_parser = subparsers.add_parser('validate', help="compare index costs with duarouter output")
+    validate_parser.add_argument('network_file')
+    validate_parser.add_argument('index_file')
+    validate_parser.add_argument('routes_alt_files', nargs='+')
+    validate_parser.add_argument('--sample', type=int, default=100)
+    validate_parser.add_argument('--tolerance', type=float, default=0.01,
+                                 help="relative difference reported as a mismatch")
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        router = build_index(args.network_file, args.index_file, args.landmarks)
+        print(f"Built {len(router.landmarks)} landmarks for {len(router.network)} edges into {args.index_file}")
+        return
+
+    router = load_index(args.network_file, args.index_file)
+    results = validate(router, args.routes_alt_files, args.sample)
+    mismatches = 0
+    for vehicle_id, expected, actual in results:
+        if math.isinf(actual) or abs(actual - expected) > args.tolerance * max(expected, 1.0):
+            mismatches += 1
+            print(f"Mismatch for vehicle {vehicle_id}: duarouter {expected:.2f}, index {actual:.2f}")
+    print(f"Validated {len(results)} trips, {mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict
+
+import instrument
+from network import stamped
+from router import get_router
+
+
+def network_fingerprint(network_file):
+    """
+    Returns a SHA-1 hex digest of the network file contents.
+    """
+    digest = hashlib.sha1()
+    with open(network_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_cache_db(path):
+    """
+    Opens (creating if needed) the SQLite leg cache at path in WAL mode, so that
+    several processes can share it.
+    """
+    db = sqlite3.connect(path, timeout=30)
+    if db.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+        db.execute("PRAGMA journal_mode=WAL")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS legs (
+            fingerprint TEXT NOT NULL,
+            from_edge TEXT NOT NULL,
+            to_edge TEXT NOT NULL,
+            cost REAL,
+            edges TEXT,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (fingerprint, from_edge, to_edge)
+        )""")
+    db.execute("CREATE INDEX IF NOT EXISTS legs_last_used ON legs (last_used)")
+    return db
+
+
+class LegCache:
+    """
+    Memoizes leg routing results keyed by (from_edge, to_edge, network fingerprint).
+
+    Lookups go through a size-bounded in-memory LRU tier first and an optional
+    SQLite tier on disk second. Misses are routed with the wrapped router and
+    stored in both tiers. Exposes the same route()/cost() interface as Router.
+
+    The memory tier holds routes as array('i') of network edge indices; edge ids are
+    only materialized by route() and when writing to disk.
+    """
+
+    def __init__(self, router, network_file, path=None, max_memory=100000, max_disk=5000000):
+        self.router = router
+        self.edges = router.network.edges
+        self.fingerprint = network_fingerprint(network_file)
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pending_writes = 0
+        self.touched = {}
+        self.db = None
+        if path is not None:
+            self.db = open_cache_db(path)
+            self.disk_size = self.db.execute("SELECT COUNT(*) FROM legs").fetchone()[0]
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, from_edge, to_edge):
+        row = self.db.execute(
+            "SELECT cost, edges FROM legs WHERE fingerprint = ? AND from_edge = ? AND to_edge = ?",
+            (self.fingerprint, from_edge, to_edge)).fetchone()
+        if row is None:
+            return False, None
+        # Reads must not take the write lock other workers share; last_used is written on flush()
+        self.touched[(from_edge, to_edge)] = time.time()
+        cost, edges = row
+        return True, None if cost is None else (self.edges.route(edges), cost)
+
+    def _disk_put(self, from_edge, to_edge, result):
+        cost, edges = (None, None) if result is None else (result[1], self.edges.join(result[0]))
+        row = (self.fingerprint, from_edge, to_edge, cost, edges, time.time())
+        # rowcount is 0 when another worker stored the leg first; only new rows grow the cache
+        inserted = self.db.execute("INSERT OR IGNORE INTO legs VALUES (?, ?, ?, ?, ?, ?)", row).rowcount
+        if not inserted:
+            self.db.execute(
+                "UPDATE legs SET cost = ?, edges = ?, last_used = ? WHERE fingerprint = ? AND from_edge = ? AND to_edge = ?",
+                row[3:] + row[:3])
+        self.disk_size += inserted
+        if self.disk_size > self.max_disk:
+            self._write_touches()
+            excess = self.disk_size - self.max_disk
+            self.db.execute(
+                "DELETE FROM legs WHERE rowid IN (SELECT rowid FROM legs ORDER BY last_used LIMIT ?)",
+                (excess,))
+            self.disk_size = self.db.execute("SELECT COUNT(*) FROM legs").fetchone()[0]
+            self.evictions += excess
+        self.pending_writes += 1
+        if self.pending_writes >= 1000:
+            self.flush()
+
+    def route(self, from_edge, to_edge):
+        """
+        Cached shortest path between two edge ids. Returns (edge id list, cost) or None if unreachable.
+        """
+        result = self.route_index(from_edge, to_edge)
+        return None if result is None else (self.edges.edge_ids(result[0]), result[1])
+
+    def route_index(self, from_edge, to_edge):
+        """
+        Like route(), with the path as array('i') of network edge indices.
+        """
+        key = (from_edge, to_edge)
+        if key in self.memory:
+            self.hits += 1
+            instrument.count('leg_cache.hits')
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        if self.db is not None:
+            found, result = self._disk_get(from_edge, to_edge)
+            if found:
+                self.hits += 1
+                self.disk_hits += 1
+                instrument.count('leg_cache.disk_hits')
+                self._remember(key, result)
+                return result
+
+        self.misses += 1
+        instrument.count('leg_cache.misses')
+        index = self.edges.index
+        result = None
+        if from_edge in index and to_edge in index:
+            result = self.router.route_index(index[from_edge], index[to_edge])
+            if result is not None:
+                result = (array('i', result[0]), result[1])
+        self._remember(key, result)
+        if self.db is not None:
+            self._disk_put(from_edge, to_edge, result)
+        return result
+
+    def cost(self, from_edge, to_edge):
+        result = self.route_index(from_edge, to_edge)
+        return float('inf') if result is None else result[1]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'memory_size': len(self.memory),
+            'disk_size': self.disk_size if self.db is not None else 0,
+        }
+
+    def _write_touches(self):
+        if self.touched:
+            self.db.executemany(
+                "UPDATE legs SET last_used = ? WHERE fingerprint = ? AND from_edge = ? AND to_edge = ?",
+                [(last_used, self.fingerprint, from_edge, to_edge)
+                 for (from_edge, to_edge), last_used in self.touched.items()])
+            self.touched = {}
+
+    def flush(self):
+        if self.db is not None:
+            self._write_touches()
+            self.db.commit()
+        self.pending_writes = 0
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+
+_caches = {}
+
+
+def get_leg_cache(network_file, cache_file=None):
+    """
+    Returns a LegCache for network_file backed by cache_file, created once per process
+    and version of the network file.
+    """
+    # A cache for a regenerated network has stale costs and fingerprint; it is closed
+    return stamped(_caches, network_file, lambda: LegCache(get_router(network_file), network_file, cache_file),
+                   os.path.abspath(cache_file) if cache_file else None, evict=LegCache.close)
@@ -0,0 +1,257 @@
+import argparse
+import random
+import time
+import xml.etree.ElementTree as ET
+
+from router import get_router
+from cost_matrix import matrix_edges, load_or_build
+
+EPSILON = 1e-9
+
+
+def cost_table(stops, leg_cost):
+    """
+    Dense table D[a][b] = cost of driving from stop a's departure edge to stop b's arrival edge,
+    for stops as returned by fleet.Fleet.tours().
+    """
+    table = []
+    for _, depart in stops:
+        table.append([0.0 if arrive is None else leg_cost(depart, arrive) for arrive, _ in stops])
+    return table
+
+
+def tour_cost(tour, table):
+    return sum(table[a][b] for a, b in zip(tour, tour[1:]))
+
+
+class LocalSearch:
+    """
+    Randomized first-improvement local search over open truck tours with fixed starts.
+
+    Moves are intra-route 2-opt and or-opt (segments of 1-3 stops), and inter-route
+    relocate, exchange and cross-exchange (tail swap). Each move is priced in O(1)
+    from the cost table; 2-opt uses per-tour prefix sums of forward and backward leg
+    costs because road costs are asymmetric.
+    """
+
+    def __init__(self, tours, table, seed=0):
+        self.tours = [list(tour) for tour in tours]
+        self.table = table
+        self.rng = random.Random(seed)
+        self.moves_tried = 0
+        self.moves_applied = 0
+        self._prefix = [self._prefix_sums(tour) for tour in self.tours]
+
+    def _prefix_sums(self, tour):
+        table = self.table
+        forward, backward = [0.0], [0.0]
+        for a, b in zip(tour, tour[1:]):
+            forward.append(forward[-1] + table[a][b])
+            backward.append(backward[-1] + table[b][a])
+        return forward, backward
+
+    def _touched(self, *route_indices):
+        for r in set(route_indices):
+            self._prefix[r] = self._prefix_sums(self.tours[r])
+        self.moves_applied += 1
+
+    def total_cost(self):
+        return sum(tour_cost(tour, self.table) for tour in self.tours)
+
+    def _leg(self, a, b):
+        return 0.0 if b is None else self.table[a][b]
+
+    def try_two_opt(self):
+        r = self.rng.randrange(len(self.tours))
+        tour = self.tours[r]
+        if len(tour) < 3:
+            return
+        i = self.rng.randrange(1, len(tour))
+        j = self.rng.randrange(1, len(tour))
+        if i > j:
+            i, j = j, i
+        if i == j:
+            return
+        self.moves_tried += 1
+        forward, backward = self._prefix[r]
+        before, after = tour[i - 1], tour[j + 1] if j + 1 < len(tour) else None
+        delta = (self.table[before][tour[j]] + self._leg(tour[i], after) + (backward[j] - backward[i])
+                 - self.table[before][tour[i]] - self._leg(tour[j], after) - (forward[j] - forward[i]))
+        if delta < -EPSILON:
+            tour[i:j + 1] = reversed(tour[i:j + 1])
+            self._touched(r)
+
+    def try_or_opt(self):
+        r = self.rng.randrange(len(self.tours))
+        tour = self.tours[r]
+        length = self.rng.randint(1, 3)
+        if len(tour) < length + 2:
+            return
+        i = self.rng.randrange(1, len(tour) - length + 1)
+        j = i + length - 1
+        # Insert the segment between tour[k] and tour[k + 1], outside the segment itself
+        k = self.rng.randrange(0, len(tour))
+        if i - 1 <= k <= j:
+            return
+        self.moves_tried += 1
+        table = self.table
+        before, after = tour[i - 1], tour[j + 1] if j + 1 < len(tour) else None
+        q, nxt = tour[k], tour[k + 1] if k + 1 < len(tour) else None
+        delta = (self._leg(before, after) - table[before][tour[i]] - self._leg(tour[j], after)
+                 + table[q][tour[i]] + self._leg(tour[j], nxt) - self._leg(q, nxt))
+        if delta < -EPSILON:
+            segment = tour[i:j + 1]
+            rest = tour[:i] + tour[j + 1:]
+            position = rest.index(q) + 1
+            tour[:] = rest[:position] + segment + rest[position:]
+            self._touched(r)
+
+    def _pick_two_routes(self):
+        if len(self.tours) < 2:
+            return None
+        a, b = self.rng.sample(range(len(self.tours)), 2)
+        return a, b
+
+    def try_relocate(self):
+        routes = self._pick_two_routes()
+        if routes is None:
+            return
+        a, b = routes
+        tour_a, tour_b = self.tours[a], self.tours[b]
+        if len(tour_a) < 2:
+            return
+        i = self.rng.randrange(1, len(tour_a))
+        k = self.rng.randrange(0, len(tour_b))
+        self.moves_tried += 1
+        x = tour_a[i]
+        before, after = tour_a[i - 1], tour_a[i + 1] if i + 1 < len(tour_a) else None
+        q, nxt = tour_b[k], tour_b[k + 1] if k + 1 < len(tour_b) else None
+        delta = (self._leg(before, after) - self.table[before][x] - self._leg(x, after)
+                 + self.table[q][x] + self._leg(x, nxt) - self._leg(q, nxt))
+        if delta < -EPSILON:
+            del tour_a[i]
+            tour_b.insert(k + 1, x)
+            self._touched(a, b)
+
+    def try_exchange(self):
+        routes = self._pick_two_routes()
+        if routes is None:
+            return
+        a, b = routes
+        tour_a, tour_b = self.tours[a], self.tours[b]
+        if len(tour_a) < 2 or len(tour_b) < 2:
+            return
+        i = self.rng.randrange(1, len(tour_a))
+        j = self.rng.randrange(1, len(tour_b))
+        self.moves_tried += 1
+        x, y = tour_a[i], tour_b[j]
+        pa, na = tour_a[i - 1], tour_a[i + 1] if i + 1 < len(tour_a) else None
+        pb, nb = tour_b[j - 1], tour_b[j + 1] if j + 1 < len(tour_b) else None
+        delta = (self.table[pa][y] + self._leg(y, na) + self.table[pb][x] + self._leg(x, nb)
+                 - self.table[pa][x] - self._leg(x, na) - self.table[pb][y] - self._leg(y, nb))
+        if delta < -EPSILON:
+            tour_a[i], tour_b[j] = y, x
+            self._touched(a, b)
+
+    def try_cross_exchange(self):
+        routes = self._pick_two_routes()
+        if routes is None:
+            return
+        a, b = routes
+        tour_a, tour_b = self.tours[a], self.tours[b]
+        i = self.rng.randrange(0, len(tour_a))
+        j = self.rng.randrange(0, len(tour_b))
+        self.moves_tried += 1
+        na = tour_a[i + 1] if i + 1 < len(tour_a) else None
+        nb = tour_b[j + 1] if j + 1 < len(tour_b) else None
+        if na is None and nb is None:
+            return
+        delta = (self._leg(tour_a[i], nb) + self._leg(tour_b[j], na)
+                 - self._leg(tour_a[i], na) - self._leg(tour_b[j], nb))
+        if delta < -EPSILON:
+            tour_a[i + 1:], tour_b[j + 1:] = tour_b[j + 1:], tour_a[i + 1:]
+            self._touched(a, b)
+
+    def run(self, budget, max_moves=None):
+        """
+        Applies improving moves until the wall-clock budget (seconds) or max_moves runs out.
+        """
+        moves = [self.try_two_opt, self.try_or_opt, self.try_relocate, self.try_exchange, self.try_cross_exchange]
+        deadline = time.perf_counter() + budget
+        while time.perf_counter() < deadline:
+            for _ in range(1000):
+                self.rng.choice(moves)()
+            if max_moves is not None and self.moves_tried >= max_moves:
+                break
+        return self.tours
+
+
+def write_tours(tours, stops, router, output_file, alt_file=None, truck_ids=None):
+    """
+    Writes tours as merged routes (one vehicle per truck, with the ids in truck_ids or
+    1..n) in the merged_routes_*.xml format, and optionally the matching .alt.xml with
+    per-truck costs. Trucks left without stops are omitted.
+    """
+    routes_root = ET.Element('routes')
+    alt_root = ET.Element('routes')
+    for t, tour in enumerate(tours):
+        truck = truck_ids[t] if truck_ids is not None else t + 1
+        if len(tour) < 2:
+            continue
+        edges = []
+        cost = 0.0
+        for a, b in zip(tour, tour[1:]):
+            result = router.route(stops[a][1], stops[b][0])
+            if result is None:
+                print(f"Warning: no route from {stops[a][1]} to {stops[b][0]} for truck {truck}.")
+                continue
+            route_edges, leg_cost = result
+            if edges and edges[-1] == route_edges[0]:
+                route_edges = route_edges[1:]
+            edges.extend(route_edges)
+            cost += leg_cost
+
+        vehicle_elem = ET.SubElement(routes_root, 'vehicle', id=str(truck), depart='0.00')
+        ET.SubElement(vehicle_elem, 'route', edges=' '.join(edges))
+        alt_vehicle_elem = ET.SubElement(alt_root, 'vehicle', id=str(truck), depart='0.00')
+        route_distribution_elem = ET.SubElement(alt_vehicle_elem, 'routeDistribution', last='0')
+        ET.SubElement(route_distribution_elem, 'route', cost=f"{cost:.2f}", probability='1.00000000',
+                      edges=' '.join(edges))
+
+    ET.ElementTree(routes_root).write(output_file, encoding='UTF-8', xml_declaration=True)
+    if alt_file is not None:
+        ET.ElementTree(alt_root).write(alt_file, encoding='UTF-8', xml_declaration=True)
+
+
+def main():
+    from algo import extract_trips
+    from fleet import Fleet, trucks_from_trips
+
+    parser = argparse.ArgumentParser(description="Re-optimize the truck tours of a trips file")
+    parser.add_argument('--trips', default='trips.xml')
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--output', default='merged_routes_reoptimized.xml')
+    parser.add_argument('--budget', type=float, default=10.0, help="wall-clock budget in seconds")
+    parser.add_argument('--cost-matrix', default='cost_matrix', help="cost matrix directory to reuse or build")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    trips = extract_trips(args.trips)
+    router = get_router(args.network)
+    matrix = load_or_build(router, matrix_edges(trips), args.network, args.cost_matrix)
+
+    fleet = Fleet(trucks_from_trips(trips), matrix.cost)
+    stops, tours = fleet.tours()
+    table = cost_table(stops, matrix.cost)
+    search = LocalSearch(tours, table, args.seed)
+    initial_cost = search.total_cost()
+    search.run(args.budget)
+    print(f"Cost {round(initial_cost, 3)} -> {round(search.total_cost(), 3)} "
+          f"({search.moves_applied} of {search.moves_tried} moves applied)")
+
+    alt_file = args.output[:-len('.xml')] + '.alt.xml' if args.output.endswith('.xml') else args.output + '.alt'
+    write_tours(search.tours, stops, router, args.output, alt_file, [truck.id for truck in fleet.trucks])
+
+
+if __name__ == "__main__":
+    main()
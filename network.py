@@ -0,0 +1,311 @@
+import json
+import math
+import os
+import shutil
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from edges import EdgeTable
+
+
+class Network:
+    """
+    Compact, read-only view of a SUMO network.
+
+    Edges are interned to dense indices by an EdgeTable. Successors are stored CSR-style:
+    the successors of edge e are targets[offsets[e]:offsets[e + 1]]. The shape
+    polyline of edge e is shape_xy[shape_offsets[e]:shape_offsets[e + 1]].
+    """
+
+    def __init__(self, edge_ids, from_node, to_node, lengths, speeds, offsets, targets, node_x, node_y,
+                 shape_offsets=None, shape_xy=None, location=None):
+        self.edges = EdgeTable(edge_ids)
+        self.edge_ids = self.edges.ids
+        self.edge_index = self.edges.index
+        self.from_node = from_node
+        self.to_node = to_node
+        self.lengths = lengths
+        self.speeds = speeds
+        self.travel_times = array('d', (length / speed for length, speed in zip(lengths, speeds)))
+        self.offsets = offsets
+        self.targets = targets
+        self.node_x = node_x
+        self.node_y = node_y
+        self.shape_offsets = shape_offsets
+        self.shape_xy = shape_xy
+        self.location = location or {}
+        self.max_speed = bound_speed(self, self.travel_times)
+        self._reverse = None
+
+    def __len__(self):
+        return len(self.edge_ids)
+
+    def successors(self, e):
+        return self.targets[self.offsets[e]:self.offsets[e + 1]]
+
+    def reverse_adjacency(self):
+        """
+        Returns (offsets, sources) of the predecessor lists in CSR form, built on first use.
+        """
+        if self._reverse is None:
+            predecessors = [[] for _ in range(len(self))]
+            for e in range(len(self)):
+                for k in range(self.offsets[e], self.offsets[e + 1]):
+                    predecessors[self.targets[k]].append(e)
+            offsets = array('i', [0])
+            sources = array('i')
+            for pred in predecessors:
+                sources.extend(pred)
+                offsets.append(len(sources))
+            self._reverse = (offsets, sources)
+        return self._reverse
+
+    def edge_coordinates(self, edge_id):
+        """
+        Returns the (x, y) coordinates of the from and to node of an edge.
+        """
+        e = self.edge_index[edge_id]
+        from_node, to_node = self.from_node[e], self.to_node[e]
+        return (self.node_x[from_node], self.node_y[from_node]), (self.node_x[to_node], self.node_y[to_node])
+
+
+def junction_distances(network):
+    """
+    Returns the straight-line distance between the from and to junction centres of every
+    edge, 0 where a junction has no coordinates.
+    """
+    from_node = np.asarray(network.from_node, dtype=np.int64)
+    to_node = np.asarray(network.to_node, dtype=np.int64)
+    node_x = np.asarray(network.node_x, dtype=np.float64)
+    node_y = np.asarray(network.node_y, dtype=np.float64)
+    distances = np.hypot(node_x[to_node] - node_x[from_node], node_y[to_node] - node_y[from_node])
+    return np.nan_to_num(distances, nan=0.0)
+
+
+def bound_speed(network, travel_times):
+    """
+    Returns the highest junction-centre distance / travel time over all edges. Lanes are
+    trimmed at junctions and can be shorter than the distance between junction centres,
+    so the top lane speed is not enough: only this speed keeps distance / speed below the
+    cost of every path, which A* and the pruning bounds rely on. math.inf if an edge
+    covers distance in no time.
+    """
+    if not len(network.from_node):
+        return 0.0
+    distances = junction_distances(network)
+    travel_times = np.asarray(travel_times, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = np.where(distances > 0, distances / travel_times, 0.0)
+    return float(np.nan_to_num(speeds, nan=0.0, posinf=math.inf).max())
+
+
+def _parse_shape(shape):
+    return [tuple(float(v) for v in point.split(',')[:2]) for point in shape.split()]
+
+
+def parse_network(net_file):
+    """
+    Parses a SUMO .net.xml file into a Network. Internal (junction) edges are skipped.
+    """
+    edge_ids = []
+    edge_nodes = []
+    lengths = array('d')
+    speeds = array('d')
+    shapes = []
+    node_ids = {}
+    node_x = array('d')
+    node_y = array('d')
+    connections = []
+    location = {}
+
+    def node(node_id):
+        if node_id not in node_ids:
+            node_ids[node_id] = len(node_x)
+            node_x.append(math.nan)
+            node_y.append(math.nan)
+        return node_ids[node_id]
+
+    for _, elem in ET.iterparse(net_file, events=('end',)):
+        if elem.tag == 'edge':
+            if elem.get('function') != 'internal':
+                lanes = elem.findall('lane')
+                if lanes:
+                    edge_ids.append(elem.get('id'))
+                    edge_nodes.append((elem.get('from'), elem.get('to')))
+                    lengths.append(float(lanes[0].get('length')))
+                    speeds.append(max(float(lane.get('speed')) for lane in lanes))
+                    shapes.append(_parse_shape(elem.get('shape') or lanes[0].get('shape', '')))
+            elem.clear()
+        elif elem.tag == 'junction':
+            if not elem.get('id').startswith(':'):
+                n = node(elem.get('id'))
+                node_x[n] = float(elem.get('x'))
+                node_y[n] = float(elem.get('y'))
+            elem.clear()
+        elif elem.tag == 'connection':
+            from_edge = elem.get('from')
+            if not from_edge.startswith(':'):
+                connections.append((from_edge, elem.get('to')))
+            elem.clear()
+        elif elem.tag == 'location':
+            location = dict(elem.attrib)
+
+    edge_index = {edge_id: e for e, edge_id in enumerate(edge_ids)}
+    from_node = array('i', (node(f) for f, _ in edge_nodes))
+    to_node = array('i', (node(t) for _, t in edge_nodes))
+
+    successors = [set() for _ in edge_ids]
+    for from_edge, to_edge in connections:
+        if from_edge in edge_index and to_edge in edge_index:
+            successors[edge_index[from_edge]].add(edge_index[to_edge])
+
+    offsets = array('i', [0])
+    targets = array('i')
+    for succ in successors:
+        targets.extend(sorted(succ))
+        offsets.append(len(targets))
+
+    shape_offsets = np.zeros(len(edge_ids) + 1, dtype=np.int64)
+    shape_points = []
+    for e, shape in enumerate(shapes):
+        if not shape:
+            shape = [(node_x[from_node[e]], node_y[from_node[e]]), (node_x[to_node[e]], node_y[to_node[e]])]
+        shape_points.extend(shape)
+        shape_offsets[e + 1] = len(shape_points)
+    shape_xy = np.array(shape_points, dtype=np.float64).reshape(-1, 2)
+
+    return Network(edge_ids, from_node, to_node, lengths, speeds, offsets, targets, node_x, node_y,
+                   shape_offsets, shape_xy, location)
+
+
+_ARRAYS = {
+    'from_node': 'i', 'to_node': 'i', 'lengths': 'd', 'speeds': 'd',
+    'offsets': 'i', 'targets': 'i', 'node_x': 'd', 'node_y': 'd',
+}
+
+
+def source_stamp(net_file):
+    """
+    Size and modification time of net_file, which identify its version.
+    """
+    stat = os.stat(net_file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def stamped(cache, net_file, build, *key, evict=None):
+    """
+    Per-process memo for objects built from a network file: returns cache's entry for
+    net_file, the extra key and the file's current source_stamp(), calling build() on a
+    miss. Entries built from another version of the file are dropped first, and passed
+    to evict if given.
+    """
+    path = os.path.abspath(net_file)
+    stamp = tuple(source_stamp(net_file).values())
+    full_key = (path, key, stamp)
+    if full_key not in cache:
+        for stale in [other for other in cache if other[0] == path and other[2] != stamp]:
+            value = cache.pop(stale)
+            if evict is not None:
+                evict(value)
+        cache[full_key] = build()
+    return cache[full_key]
+
+
+def _cached_stamp(cache_dir):
+    """
+    The source stamp recorded in cache_dir, or None if it has no readable meta.json.
+    """
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            return json.load(f)['source']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_network(network, net_file, cache_dir):
+    """
+    Writes network as flat .npy arrays plus meta.json into cache_dir, stamped with the
+    size and mtime of net_file so stale caches are detected.
+
+    Several processes may build the same cache at once: each writes its own temporary
+    directory and keeps whichever up-to-date cache gets into place first.
+    """
+    stamp = source_stamp(net_file)
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, 'edge_ids.npy'), np.array(network.edge_ids, dtype=np.str_))
+        for name, typecode in _ARRAYS.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.frombuffer(getattr(network, name), dtype=typecode))
+        np.save(os.path.join(tmp_dir, 'shape_offsets.npy'), network.shape_offsets)
+        np.save(os.path.join(tmp_dir, 'shape_xy.npy'), network.shape_xy)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'source': stamp, 'location': network.location}, f)
+
+        if _cached_stamp(cache_dir) == stamp:
+            return
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, cache_dir)
+        except OSError:
+            # Another process put its cache in place between the check and the replace
+            if _cached_stamp(cache_dir) != stamp:
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_cached_network(net_file, cache_dir):
+    """
+    Loads a network saved by save_network(), or returns None if the cache is missing,
+    unreadable or older than net_file. Adjacency and weights are copied into compact
+    arrays for fast searching; shapes stay memory-mapped and are shared between processes.
+    """
+    if _cached_stamp(cache_dir) != source_stamp(net_file):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r')
+
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {}
+        for name, typecode in _ARRAYS.items():
+            values = array(typecode)
+            values.frombytes(load(name).tobytes())
+            arrays[name] = values
+        edge_ids = load('edge_ids').tolist()
+        shape_offsets, shape_xy = load('shape_offsets'), load('shape_xy')
+    except (OSError, ValueError):
+        # Replaced or removed by another process while reading; the caller parses the XML
+        return None
+    return Network(edge_ids, shape_offsets=shape_offsets, shape_xy=shape_xy,
+                   location=meta['location'], **arrays)
+
+
+_networks = {}
+
+
+def load_network(net_file, cache_dir=None):
+    """
+    Returns the Network for net_file, from the binary cache next to it when that is up
+    to date, parsing the XML (and refreshing the cache) otherwise. Networks are also
+    kept per process, so repeated calls are free.
+    """
+    cache_dir = cache_dir or f"{net_file}.cache"
+
+    def build():
+        network = load_cached_network(net_file, cache_dir)
+        if network is None:
+            network = parse_network(net_file)
+            try:
+                save_network(network, net_file, cache_dir)
+            except OSError as e:
+                print(f"Warning: could not write network cache {cache_dir}: {e}")
+        return network
+
+    return stamped(_networks, net_file, build)
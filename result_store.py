@@ -0,0 +1,193 @@
+import argparse
+import json
+import sqlite3
+import time
+from array import array
+
+from edges import EDGES
+from route_stream import write_merged_routes, write_merged_routes_alt
+
+
+class ResultStore:
+    """
+    SQLite store of insertion runs: one row per candidate and one per candidate truck,
+    with edge sequences interned to integer ids and kept as packed int32 blobs.
+
+    Several runs can share one file, so candidates can be compared across runs with
+    plain SQL. Any candidate can be exported back to merged_routes_*.xml / .alt.xml,
+    byte-identical to the files a per-candidate run writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        if self.db.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                created REAL NOT NULL,
+                meta TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS edges (
+                id INTEGER PRIMARY KEY,
+                edge TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS candidates (
+                run_id INTEGER NOT NULL REFERENCES runs (id),
+                iteration INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                trip_index INTEGER NOT NULL,
+                truck INTEGER NOT NULL,
+                total_cost REAL NOT NULL,
+                PRIMARY KEY (run_id, iteration)
+            );
+            CREATE INDEX IF NOT EXISTS candidates_cost ON candidates (run_id, total_cost);
+            CREATE TABLE IF NOT EXISTS trucks (
+                run_id INTEGER NOT NULL,
+                iteration INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                truck TEXT NOT NULL,
+                cost REAL NOT NULL,
+                edges BLOB NOT NULL,
+                PRIMARY KEY (run_id, iteration, position)
+            );
+        """)
+        self._edge_ids = dict(self.db.execute("SELECT edge, id FROM edges"))
+        self._edges = {edge_id: edge for edge, edge_id in self._edge_ids.items()}
+        # Store id of every edges.EDGES index seen so far, -1 if not looked up yet
+        self._store_ids = array('i')
+
+    def start_run(self, **meta):
+        """
+        Records a new run with free-form metadata (network, trips, new order, ...) and returns its id.
+        """
+        cursor = self.db.execute("INSERT INTO runs (created, meta) VALUES (?, ?)", (time.time(), json.dumps(meta)))
+        self.db.commit()
+        return cursor.lastrowid
+
+    def _store_id(self, edge):
+        edge_id = self._edge_ids.get(edge)
+        if edge_id is None:
+            edge_id = self.db.execute("INSERT INTO edges (edge) VALUES (?)", (edge,)).lastrowid
+            self._edge_ids[edge] = edge_id
+            self._edges[edge_id] = edge
+        return edge_id
+
+    def _intern(self, route):
+        """
+        Packs a route of edges.EDGES indices as a blob of store edge ids.
+        """
+        store_ids = self._store_ids
+        if len(store_ids) < len(EDGES):
+            store_ids.extend([-1] * (len(EDGES) - len(store_ids)))
+        ids = array('i')
+        for e in route:
+            if store_ids[e] < 0:
+                store_ids[e] = self._store_id(EDGES.ids[e])
+            ids.append(store_ids[e])
+        return ids.tobytes()
+
+    def _unintern(self, blob):
+        ids = array('i')
+        ids.frombytes(blob)
+        edges = self._edges
+        return array('i', [EDGES.intern(edges[edge_id]) for edge_id in ids])
+
+    def add_candidate(self, run_id, candidate, trucks, routes):
+        """
+        Stores one evaluated candidate of insertion.enumerate_candidates(). trucks and routes
+        are route_stream's per-truck results ({truck: {'cost', 'edges'}} and
+        {truck: {'edges'}}, routes as edges.EDGES indices); the total is computed from the two-decimal truck costs like
+        process_routes() does.
+        """
+        costs = {truck: float(f"{info['cost']:.2f}") for truck, info in trucks.items()}
+        self.db.execute("INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?, ?)",
+                        (run_id, candidate['iteration'], candidate['kind'], candidate['index'], candidate['truck'],
+                         sum(costs.values())))
+        self.db.execute("DELETE FROM trucks WHERE run_id = ? AND iteration = ?", (run_id, candidate['iteration']))
+        self.db.executemany("INSERT INTO trucks VALUES (?, ?, ?, ?, ?, ?)",
+                            [(run_id, candidate['iteration'], position, truck, costs[truck],
+                              self._intern(routes.get(truck, trucks[truck])['edges']))
+                             for position, truck in enumerate(trucks)])
+        return sum(costs.values())
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def runs(self):
+        """
+        Returns [(run id, created timestamp, metadata dict)] for every stored run.
+        """
+        return [(run_id, created, json.loads(meta))
+                for run_id, created, meta in self.db.execute("SELECT id, created, meta FROM runs ORDER BY id")]
+
+    def top_k(self, run_id=None, k=10, worst=False):
+        """
+        The k cheapest (or most expensive) candidates of a run, or of all runs when run_id is
+        None, as dicts; ties are ordered by run and iteration.
+        """
+        order = "total_cost DESC" if worst else "total_cost ASC"
+        where, args = ("WHERE run_id = ?", (run_id,)) if run_id is not None else ("", ())
+        rows = self.db.execute(f"SELECT run_id, iteration, kind, trip_index, truck, total_cost FROM candidates "
+                               f"{where} ORDER BY {order}, run_id, iteration LIMIT ?", args + (k,))
+        return [{'run_id': row[0], 'iteration': row[1], 'kind': row[2], 'index': row[3], 'truck': row[4], 'total': row[5]}
+                for row in rows]
+
+    def best(self, run_id=None):
+        found = self.top_k(run_id, 1)
+        return found[0] if found else None
+
+    def worst(self, run_id=None):
+        found = self.top_k(run_id, 1, worst=True)
+        return found[0] if found else None
+
+    def candidate_routes(self, run_id, iteration):
+        """
+        Returns {truck: (cost, route of edges.EDGES indices)} of one candidate, in the stored truck order.
+        """
+        rows = self.db.execute("SELECT truck, cost, edges FROM trucks WHERE run_id = ? AND iteration = ? ORDER BY position",
+                               (run_id, iteration))
+        return {truck: (cost, self._unintern(edges)) for truck, cost, edges in rows}
+
+    def export(self, run_id, iteration, routes_file, alt_file=None):
+        """
+        Writes a candidate as merged routes (and optionally the .alt.xml with per-truck costs).
+        """
+        routes = self.candidate_routes(run_id, iteration)
+        write_merged_routes({truck: {'edges': edges} for truck, (_, edges) in routes.items()}, routes_file)
+        if alt_file is not None:
+            write_merged_routes_alt({truck: {'cost': cost, 'edges': edges} for truck, (cost, edges) in routes.items()}, alt_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and export stored insertion runs")
+    parser.add_argument('store', help="SQLite result store written by algo.py --store")
+    parser.add_argument('--run', type=int, default=None, help="run id (default: latest; 'top' queries accept --all-runs)")
+    parser.add_argument('--all-runs', action='store_true', help="rank candidates across every stored run")
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--worst', action='store_true', help="rank most expensive first")
+    parser.add_argument('--export', type=int, default=None, metavar='ITERATION',
+                        help="write this candidate to merged_routes_<iteration>.xml / .alt.xml")
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    runs = store.runs()
+    if not runs:
+        print("No runs stored.")
+        return
+    run_id = args.run if args.run is not None else runs[-1][0]
+    if args.export is not None:
+        store.export(run_id, args.export, f"merged_routes_{args.export}.xml", f"merged_routes_{args.export}.alt.xml")
+        return
+    for row in store.top_k(None if args.all_runs else run_id, args.top, args.worst):
+        print(f"run {row['run_id']} iteration {row['iteration']} ({row['kind']} at trip {row['index']}, "
+              f"truck {row['truck']}): {round(row['total'], 3)}")
+
+
+if __name__ == "__main__":
+    main()
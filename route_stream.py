@@ -0,0 +1,215 @@
+import xml.etree.ElementTree as ET
+from array import array
+
+import instrument
+from edges import EDGES, append_route
+
+
+def iter_elements(file_path, tag):
+    """
+    Yields the top-level elements named tag of a SUMO XML file one at a time, freeing
+    each one after it has been consumed so memory stays flat for any file size.
+    """
+    instrument.count_bytes('xml_bytes_parsed', file_path)
+    context = ET.iterparse(file_path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == tag:
+            yield elem
+            root.clear()
+
+
+def iter_vehicles(file_path):
+    """
+    Yields the <vehicle> elements of a routes file one at a time.
+    """
+    return iter_elements(file_path, 'vehicle')
+
+
+def chosen_route(route_dist_elem):
+    """
+    The <route> of a routeDistribution that its 'last' attribute points at, the route
+    the vehicle actually drives; the other routes are alternatives.
+    """
+    routes = route_dist_elem.findall('route')
+    if not routes:
+        return None
+    last = int(route_dist_elem.get('last', 0))
+    return routes[last] if 0 <= last < len(routes) else routes[-1]
+
+
+@instrument.timed()
+def stream_routes_alt(input_file, output_file=None):
+    """
+    Merges the legs of routes_*.alt.xml per truck in a single streaming pass.
+    Returns {truck: {'cost': total leg cost, 'edges': merged route}} and writes the
+    merged routeDistribution file only when output_file is given. Routes are array('i')
+    of edges.EDGES indices.
+    """
+    trucks = {}
+    try:
+        for vehicle in iter_vehicles(input_file):
+            info = trucks.setdefault(vehicle.get('id').split('_')[1], {'cost': 0.0, 'edges': array('i')})
+            route_dist_elem = vehicle.find('routeDistribution')
+            if route_dist_elem is None:
+                print(f"Warning: 'routeDistribution' element not found for vehicle {vehicle.get('id')}.")
+                continue
+            route_elem = chosen_route(route_dist_elem)
+            if route_elem is not None:
+                append_route(info['edges'], EDGES.route(route_elem.get('edges')))
+                info['cost'] += float(route_elem.get('cost', 0))
+    except FileNotFoundError:
+        print(f"Error: The file {input_file} was not found.")
+        return {}
+    except ET.ParseError as e:
+        print(f"Error parsing {input_file}: {e}")
+        return {}
+
+    if output_file is not None:
+        write_merged_routes_alt(trucks, output_file)
+    return trucks
+
+
+@instrument.timed()
+def stream_routes(input_file, output_file=None):
+    """
+    Merges the legs of routes_*.xml per truck in a single streaming pass.
+    Returns {truck: merged route} and writes the merged file only when output_file is given.
+    """
+    trucks = {}
+    try:
+        for vehicle in iter_vehicles(input_file):
+            info = trucks.setdefault(vehicle.get('id').split('_')[1], {'edges': array('i')})
+            route_elem = vehicle.find('route')
+            if route_elem is None:
+                print(f"Warning: 'route' element not found for vehicle {vehicle.get('id')}.")
+                continue
+            append_route(info['edges'], EDGES.route(route_elem.get('edges')))
+    except FileNotFoundError:
+        print(f"Error: The file {input_file} was not found.")
+        return {}
+    except ET.ParseError as e:
+        print(f"Error parsing {input_file}: {e}")
+        return {}
+
+    if output_file is not None:
+        write_merged_routes(trucks, output_file)
+    return {truck: info['edges'] for truck, info in trucks.items()}
+
+
+def write_merged_routes_alt(trucks, output_file):
+    """
+    Writes {truck: {'cost', 'edges'}} as a merged routes .alt.xml with one route per truck.
+    """
+    merged_root = ET.Element('routes')
+    for truck, info in trucks.items():
+        vehicle_elem = ET.SubElement(merged_root, 'vehicle', id=truck, depart='0.00')
+        route_distribution_elem = ET.SubElement(vehicle_elem, 'routeDistribution', last='0')
+        new_route_elem = ET.SubElement(route_distribution_elem, 'route', cost=f"{info['cost']:.2f}", probability='1.00000000')
+        new_route_elem.set('edges', EDGES.join(info['edges']))
+    _write(merged_root, output_file)
+
+
+def write_merged_routes(trucks, output_file):
+    """
+    Writes {truck: {'edges'}} as a merged routes file with one route per truck.
+    """
+    merged_root = ET.Element('routes')
+    for truck, info in trucks.items():
+        vehicle_elem = ET.SubElement(merged_root, 'vehicle', id=truck, depart='0.00')
+        ET.SubElement(vehicle_elem, 'route', edges=EDGES.join(info['edges']))
+    _write(merged_root, output_file)
+
+
+def _write(root, output_file):
+    try:
+        ET.ElementTree(root).write(output_file, encoding='UTF-8', xml_declaration=True)
+        instrument.count_bytes('xml_bytes_written', output_file)
+    except Exception as e:
+        print(f"Error writing to {output_file}: {e}")
+
+
+def truck_costs(trucks):
+    """
+    Per-truck costs as parse_routes_alt() would read them back from the merged file,
+    i.e. rounded to the two decimals written there.
+    """
+    return {truck: float(f"{info['cost']:.2f}") for truck, info in trucks.items()}
+
+
+@instrument.timed()
+def process_routes(routes_file, routes_alt_file, merged_routes_file=None, merged_routes_alt_file=None):
+    """
+    Replaces merge_routes_alt() + merge_routes() + parse_routes_alt() with one streaming
+    pass per input. Returns (per-truck costs, per-truck merged edges, total cost).
+    """
+    trucks = stream_routes_alt(routes_alt_file, merged_routes_alt_file)
+    edges = stream_routes(routes_file, merged_routes_file) if merged_routes_file is not None else \
+        {truck: info['edges'] for truck, info in trucks.items()}
+    costs = truck_costs(trucks)
+    return costs, edges, sum(costs.values())
+
+
+def split_scenario_id(vehicle_id):
+    """
+    Splits a batched vehicle id "c{i}_{trip}_{truck}_{order}" into ("c{i}", "{trip}_{truck}_{order}").
+    """
+    scenario, _, vehicle = vehicle_id.partition('_')
+    return scenario, vehicle
+
+
+@instrument.timed()
+def collect_scenarios(routes_file, routes_alt_file, scenarios):
+    """
+    Merges the routes of several scenarios routed in one batch per scenario and truck.
+    Returns {scenario: (trucks, routes)} where trucks is stream_routes_alt()'s
+    {truck: {'cost', 'edges'}} and routes is stream_routes()'s {truck: {'edges'}}, both
+    built from the scenario's own vehicles only.
+    """
+    alt_trucks = {scenario: {} for scenario in scenarios}
+    for vehicle in iter_vehicles(routes_alt_file):
+        scenario, vehicle_id = split_scenario_id(vehicle.get('id'))
+        if scenario not in alt_trucks:
+            continue
+        info = alt_trucks[scenario].setdefault(vehicle_id.split('_')[1], {'cost': 0.0, 'edges': array('i')})
+        route_dist_elem = vehicle.find('routeDistribution')
+        if route_dist_elem is None:
+            print(f"Warning: 'routeDistribution' element not found for vehicle {vehicle.get('id')}.")
+            continue
+        route_elem = chosen_route(route_dist_elem)
+        if route_elem is not None:
+            append_route(info['edges'], EDGES.route(route_elem.get('edges')))
+            info['cost'] += float(route_elem.get('cost', 0))
+
+    routes = {scenario: {} for scenario in scenarios}
+    for vehicle in iter_vehicles(routes_file):
+        scenario, vehicle_id = split_scenario_id(vehicle.get('id'))
+        if scenario not in routes:
+            continue
+        info = routes[scenario].setdefault(vehicle_id.split('_')[1], {'edges': array('i')})
+        route_elem = vehicle.find('route')
+        if route_elem is None:
+            print(f"Warning: 'route' element not found for vehicle {vehicle.get('id')}.")
+            continue
+        append_route(info['edges'], EDGES.route(route_elem.get('edges')))
+    return {scenario: (alt_trucks[scenario], routes[scenario]) for scenario in scenarios}
+
+
+@instrument.timed()
+def demux_routes(routes_file, routes_alt_file, outputs):
+    """
+    Splits the routes of several scenarios routed in one batch back into per-scenario
+    merged files. outputs maps a scenario prefix to (merged_routes_file,
+    merged_routes_alt_file); each pair is byte-identical to what process_routes() writes
+    for that scenario routed on its own.
+
+    Returns {scenario: (per-truck costs, total cost)}.
+    """
+    results = {}
+    for scenario, (trucks, routes) in collect_scenarios(routes_file, routes_alt_file, outputs).items():
+        merged_routes_file, merged_routes_alt_file = outputs[scenario]
+        write_merged_routes_alt(trucks, merged_routes_alt_file)
+        write_merged_routes(routes, merged_routes_file)
+        costs = truck_costs(trucks)
+        results[scenario] = (costs, sum(costs.values()))
+    return results
@@ -0,0 +1,186 @@
+import heapq
+import math
+import xml.etree.ElementTree as ET
+
+import instrument
+from network import load_network, bound_speed, stamped
+
+
+class Router:
+    """
+    In-process edge-to-edge shortest path router over a Network.
+
+    Costs follow duarouter's convention: the travel time of every edge on the
+    route, including the departure and arrival edges.
+    """
+
+    def __init__(self, network, weights=None, use_astar=True):
+        self.network = network
+        self.weights = weights if weights is not None else network.travel_times
+        self.max_speed = network.max_speed if weights is None else bound_speed(network, weights)
+        self.use_astar = use_astar and self.max_speed > 0
+
+    def _heuristic(self, target):
+        net = self.network
+        tx = net.node_x[net.to_node[target]]
+        ty = net.node_y[net.to_node[target]]
+        if not self.use_astar or math.isnan(tx):
+            return lambda e: 0.0
+        inv_speed = 1.0 / self.max_speed
+
+        def h(e):
+            n = net.to_node[e]
+            d = math.hypot(net.node_x[n] - tx, net.node_y[n] - ty)
+            return 0.0 if math.isnan(d) else d * inv_speed
+        return h
+
+    def _search_heuristic(self, source, target):
+        """
+        A* heuristic for one search; subclasses may tailor it to the search's source.
+        """
+        return self._heuristic(target)
+
+    def route_index(self, source, target):
+        """
+        Shortest path between two edge indices. Returns (edge index list, cost) or None.
+        """
+        weights = self.weights
+        offsets = self.network.offsets
+        targets = self.network.targets
+        h = self._search_heuristic(source, target)
+        instrument.count('router_searches')
+
+        dist = {source: weights[source]}
+        pred = {source: -1}
+        heap = [(dist[source] + h(source), source)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if u == target:
+                path = []
+                while u != -1:
+                    path.append(u)
+                    u = pred[u]
+                path.reverse()
+                return path, dist[target]
+            done.add(u)
+            du = dist[u]
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                nd = du + weights[v]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd + h(v), v))
+        return None
+
+    def one_to_all(self, source, reverse=False):
+        """
+        Plain Dijkstra from edge index source to every edge. Returns (dist, pred) lists
+        indexed by edge, with math.inf / -1 for unreachable edges.
+
+        With reverse=True the search runs backwards: dist[e] is the cost from e to source
+        and pred[e] is the next edge after e on that path.
+        """
+        weights = self.weights
+        instrument.count('router_searches')
+        if reverse:
+            offsets, targets = self.network.reverse_adjacency()
+        else:
+            offsets, targets = self.network.offsets, self.network.targets
+
+        dist = [math.inf] * len(self.network)
+        pred = [-1] * len(self.network)
+        dist[source] = weights[source]
+        heap = [(dist[source], source)]
+        while heap:
+            du, u = heapq.heappop(heap)
+            if du > dist[u]:
+                continue
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                nd = du + weights[v]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def route(self, from_edge, to_edge):
+        """
+        Shortest path between two edge ids. Returns (edge id list, cost) or None if unreachable.
+        """
+        index = self.network.edge_index
+        if from_edge not in index or to_edge not in index:
+            return None
+        result = self.route_index(index[from_edge], index[to_edge])
+        if result is None:
+            return None
+        path, cost = result
+        edge_ids = self.network.edge_ids
+        return [edge_ids[e] for e in path], cost
+
+    def cost(self, from_edge, to_edge):
+        result = self.route(from_edge, to_edge)
+        return math.inf if result is None else result[1]
+
+    def lower_bound(self, from_edge, to_edge):
+        """
+        Lower bound of cost(from_edge, to_edge) from the A* heuristic, without searching.
+        Edges missing from the network get 0.
+        """
+        index = self.network.edge_index
+        if from_edge not in index or to_edge not in index:
+            return 0.0
+        source = index[from_edge]
+        return self.weights[source] + self._search_heuristic(source, index[to_edge])(source)
+
+
+_routers = {}
+
+
+def get_router(network_file):
+    """
+    Returns a Router for network_file, built once per process and version of the file.
+    """
+    return stamped(_routers, network_file, lambda: Router(load_network(network_file)))
+
+
+def read_trips(trips_file):
+    """
+    Yields (vehicle id, depart, from_edge, to_edge) for every trip in a trips file.
+    """
+    for trip in ET.parse(trips_file).getroot().findall('trip'):
+        yield trip.get('id'), trip.get('depart', '0.00'), trip.get('from'), trip.get('to')
+
+
+def write_routes(trips_file, router, output_file, trips=None):
+    """
+    Routes every trip in trips_file, or the (vehicle id, depart, from_edge, to_edge)
+    tuples in trips when given, and writes duarouter-compatible output: output_file
+    with plain routes and the matching .alt.xml with routeDistribution costs.
+    """
+    alt_file = output_file[:-len('.xml')] + '.alt.xml' if output_file.endswith('.xml') else output_file + '.alt'
+
+    routes_root = ET.Element('routes')
+    alt_root = ET.Element('routes')
+    for vehicle_id, depart, from_edge, to_edge in (read_trips(trips_file) if trips is None else trips):
+        result = router.route(from_edge, to_edge)
+        if result is None:
+            print(f"Warning: no route for trip {vehicle_id} from {from_edge} to {to_edge}.")
+            continue
+        edges, cost = result
+        attrs = {'id': vehicle_id, 'depart': depart}
+
+        vehicle_elem = ET.SubElement(routes_root, 'vehicle', attrs)
+        ET.SubElement(vehicle_elem, 'route', edges=' '.join(edges))
+
+        alt_vehicle_elem = ET.SubElement(alt_root, 'vehicle', attrs)
+        route_dist_elem = ET.SubElement(alt_vehicle_elem, 'routeDistribution', last='0')
+        ET.SubElement(route_dist_elem, 'route', cost=f"{cost:.2f}", probability='1.00000000', edges=' '.join(edges))
+
+    ET.ElementTree(routes_root).write(output_file, encoding='UTF-8', xml_declaration=True)
+    ET.ElementTree(alt_root).write(alt_file, encoding='UTF-8', xml_declaration=True)
+    instrument.count_bytes('xml_bytes_written', output_file, alt_file)
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import math
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrument
+from fleet import Fleet, trucks_from_trips
+from leg_cache import get_leg_cache
+from local_search import write_tours
+from snapping import get_snapper
+
+
+class RoutingService:
+    """
+    Answers insert / price / routes requests against a warm fleet.Fleet whose legs are
+    priced through a LegCache.
+
+    Requests are newline-delimited JSON objects over a Unix socket or localhost TCP.
+    Requests that arrive while a batch is being handled are queued and handled
+    together in the next batch, in arrival order, on a single worker thread that owns
+    the fleet and its SQLite leg cache.
+    """
+
+    def __init__(self, trips, network_file, cache_file=None, batch_window=0.002):
+        self.batch_window = batch_window
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.fleet = None
+        self.leg_cache = None
+        self.batches = 0
+        self.requests = 0
+        self.network_file = network_file
+        self._load = (trips, cache_file)
+
+    def _load_fleet(self):
+        trips, cache_file = self._load
+        self.leg_cache = get_leg_cache(self.network_file, cache_file)
+        self.fleet = Fleet(trucks_from_trips(trips), self.leg_cache.cost)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        await loop.run_in_executor(self.executor, self._load_fleet)
+        self._batcher = asyncio.create_task(self._run_batches())
+
+    async def submit(self, message):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, future))
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                replies = await loop.run_in_executor(self.executor, self.handle_batch, [message for message, _ in batch])
+            except Exception as e:
+                # Fail this batch only; the batcher must keep serving later requests
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), reply in zip(batch, replies):
+                if not future.cancelled():
+                    future.set_result(reply)
+
+    def _refresh(self):
+        """
+        Re-prices the fleet through a new LegCache when the network file has changed
+        since the last batch; get_leg_cache() closes the one for the old network.
+        """
+        leg_cache = get_leg_cache(self.network_file, self._load[1])
+        if leg_cache is not self.leg_cache:
+            self.leg_cache = leg_cache
+            self.fleet.reprice(leg_cache.cost)
+
+    def handle_batch(self, messages):
+        self._refresh()
+        with instrument.span('service.batch'):
+            replies = [self.handle(message) for message in messages]
+        self.leg_cache.flush()
+        self.batches += 1
+        self.requests += len(messages)
+        return replies
+
+    def handle(self, message):
+        start = time.perf_counter()
+        try:
+            op = message.get('op')
+            if op == 'insert':
+                reply = self._insert(message)
+            elif op == 'price':
+                reply = self._price(message)
+            elif op == 'routes':
+                reply = self._routes(message)
+            elif op == 'save':
+                stops, tours = self.fleet.tours()
+                write_tours(tours, stops, self.leg_cache, message['output'], message.get('alt_output'),
+                            [truck.id for truck in self.fleet.trucks])
+                reply = {'output': message['output']}
+            elif op == 'stats':
+                reply = {'batches': self.batches, 'requests': self.requests, 'leg_cache': self.leg_cache.stats()}
+            else:
+                raise ValueError(f"unknown op {op!r}")
+            reply['ok'] = True
+        except Exception as e:
+            # Any failure is reported to its own request and must not reach the batcher
+            reply = {'ok': False, 'error': str(e)}
+        reply['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        if 'id' in message:
+            reply['id'] = message['id']
+        return reply
+
+    def _check_edge(self, edge):
+        if edge not in self.leg_cache.edges.index:
+            raise ValueError(f"unknown edge {edge!r}")
+
+    def _truck(self, message):
+        """
+        Index of the truck a request names by its id, the trip id prefix of the trips file.
+        """
+        for t, truck in enumerate(self.fleet.trucks):
+            if truck.id == str(message['truck']):
+                return t
+        raise ValueError(f"unknown truck {message['truck']!r}")
+
+    def _insert(self, message):
+        """
+        Finds the cheapest position for an order and, unless commit is false, adds it to the fleet.
+        The order is an edge id ('edge') or a position ('lon', 'lat', optional 'heading')
+        snapped to the nearest edge within 'max_distance' metres.
+        """
+        if 'edge' in message:
+            edge = message['edge']
+            self._check_edge(edge)
+        else:
+            snapper = get_snapper(self.network_file)
+            edges, _, _ = snapper.snap_lonlat([[message['lon'], message['lat']]], message.get('max_distance', 50.0),
+                                              message.get('heading'))
+            edge = snapper.edge_ids(edges)[0]
+            if edge is None:
+                raise ValueError(f"no edge near {message['lon']},{message['lat']}")
+        best = self.fleet.best_insertion(edge)
+        if best is None or math.isinf(best[2]):
+            raise ValueError(f"no truck can reach edge {edge!r}")
+        truck, position, delta = best
+        base = self.fleet.total_cost()
+        if message.get('commit', True):
+            self.fleet.insert(edge, truck, position)
+        # Positions count the depot as 0, so the first stop is position 1
+        return {'edge': edge, 'truck': self.fleet.trucks[truck].id, 'position': position + 1, 'delta': round(delta, 3), 'total': round(base + delta, 3),
+                'committed': message.get('commit', True)}
+
+    def _price(self, message):
+        """
+        Prices a truck's current tour ('truck') or an explicit list of stop edges ('edges').
+        """
+        if 'edges' in message:
+            for edge in message['edges']:
+                self._check_edge(edge)
+            legs = [self.leg_cache.cost(a, b) for a, b in zip(message['edges'], message['edges'][1:])]
+            return {'cost': round(sum(legs), 3), 'legs': [round(cost, 3) for cost in legs]}
+        if 'truck' in message:
+            truck = self.fleet.trucks[self._truck(message)]
+            return {'truck': truck.id, 'cost': round(truck.cost(), 3)}
+        return {'cost': round(self.fleet.total_cost(), 3)}
+
+    def _routes(self, message):
+        trucks = [self._truck(message)] if 'truck' in message else range(len(self.fleet.trucks))
+        return {'routes': {self.fleet.trucks[truck].id: {'cost': round(self.fleet.trucks[truck].cost(), 3),
+                                                         'edges': self.fleet.routes(truck, self.leg_cache)}
+                           for truck in trucks}}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as e:
+                    reply = {'ok': False, 'error': f"bad request: {e}"}
+                else:
+                    try:
+                        reply = await self.submit(message)
+                    except Exception as e:
+                        reply = {'ok': False, 'error': f"batch failed: {e}"}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(service, socket_path=None, port=None):
+    await service.start()
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, path=socket_path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host='127.0.0.1', port=port)
+    print(f"Serving on {socket_path or f'127.0.0.1:{port}'}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def call(message, socket_path=None, port=None):
+    """
+    Sends one request to a running service and returns its reply.
+    """
+    if socket_path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    else:
+        sock = socket.create_connection(('127.0.0.1', port))
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(message).encode() + b'\n')
+        f.flush()
+        return json.loads(f.readline())
+
+
+def main():
+    from algo import extract_trips
+
+    parser = argparse.ArgumentParser(description="Long-running order insertion service")
+    parser.add_argument('--trips', default='trips.xml', help="trips file with the initial truck tours")
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--leg-cache', default=None, help="SQLite file for the persistent leg-cost cache")
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--socket', default=None, help="Unix socket path to listen on")
+    address.add_argument('--port', type=int, default=8765, help="localhost TCP port to listen on")
+    parser.add_argument('--batch-window', type=float, default=0.002,
+                        help="seconds to wait for more requests before handling a batch")
+    parser.add_argument('--send', default=None, help="send one JSON request to a running service and print the reply")
+    args = parser.parse_args()
+
+    if args.send is not None:
+        print(json.dumps(call(json.loads(args.send), args.socket, args.port)))
+        return
+
+    service = RoutingService(extract_trips(args.trips), args.network, args.leg_cache, args.batch_window)
+    try:
+        asyncio.run(serve(service, args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
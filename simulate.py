@@ -0,0 +1,232 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from network import load_network
+from result_store import ResultStore
+from route_stream import chosen_route, iter_elements, iter_vehicles
+
+SUMOCFG_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<configuration>
+    <input>
+        <net-file value="{net_file}"/>
+        <route-files value="{routes_file}"/>
+    </input>
+    <output>
+        <tripinfo-output value="{tripinfo_file}"/>
+    </output>
+    <report>
+        <no-step-log value="true"/>
+        <no-warnings value="true"/>
+    </report>
+</configuration>
+"""
+
+
+class SumoBackend:
+    """
+    Runs a sumocfg with SUMO's command-line simulator (sumo, or another binary such as
+    sumo-gui given as binary).
+    """
+
+    def __init__(self, binary='sumo'):
+        self.binary = binary
+
+    def run(self, config_file, net_file, routes_file, tripinfo_file):
+        subprocess.run([self.binary, '-c', config_file], check=True, stdout=subprocess.DEVNULL)
+
+
+class StubBackend:
+    """
+    Stand-in simulator for machines without SUMO: every vehicle drives its route at free
+    flow, with no interactions, and a tripinfo file in SUMO's format is written for it.
+    Durations follow Router's cost convention (every edge of the route in full).
+    """
+
+    def run(self, config_file, net_file, routes_file, tripinfo_file):
+        network = load_network(net_file)
+        index = network.edge_index
+        root = ET.Element('tripinfos')
+        for vehicle in iter_vehicles(routes_file):
+            route_elem = vehicle.find('route')
+            if route_elem is None:
+                continue
+            edges = [index[edge_id] for edge_id in route_elem.get('edges', '').split() if edge_id in index]
+            if not edges:
+                continue
+            depart = float(vehicle.get('depart', 0))
+            duration = sum(network.travel_times[e] for e in edges)
+            ET.SubElement(root, 'tripinfo', {
+                'id': vehicle.get('id'), 'depart': f"{depart:.2f}", 'arrival': f"{depart + duration:.2f}",
+                'duration': f"{duration:.2f}", 'routeLength': f"{sum(network.lengths[e] for e in edges):.2f}",
+                'waitingTime': '0.00', 'timeLoss': '0.00',
+                'departLane': f"{network.edge_ids[edges[0]]}_0", 'arrivalLane': f"{network.edge_ids[edges[-1]]}_0",
+            })
+        ET.ElementTree(root).write(tripinfo_file, encoding='UTF-8', xml_declaration=True)
+
+
+BACKENDS = {'sumo': SumoBackend, 'stub': StubBackend}
+
+
+def truck_of(vehicle_id):
+    """
+    Truck of a vehicle: merged routes name vehicles after their truck, routed legs are
+    "{trip}_{truck}_{order}" and the trips of a trips file "{truck}_{n}".
+    """
+    parts = vehicle_id.split('_')
+    if len(parts) == 3:
+        return parts[1]
+    return parts[0] if len(parts) == 2 else vehicle_id
+
+
+def aggregate_tripinfo(tripinfo_file):
+    """
+    Per-truck duration, route length, waiting time and time loss summed over a tripinfo
+    output, read one element at a time. Returns ({truck: stats}, totals).
+    """
+    trucks = {}
+    for tripinfo in iter_elements(tripinfo_file, 'tripinfo'):
+        stats = trucks.setdefault(truck_of(tripinfo.get('id')),
+                                  {'vehicles': 0, 'duration': 0.0, 'route_length': 0.0, 'waiting_time': 0.0,
+                                   'time_loss': 0.0, 'arrival': 0.0})
+        stats['vehicles'] += 1
+        stats['duration'] += float(tripinfo.get('duration', 0))
+        stats['route_length'] += float(tripinfo.get('routeLength', 0))
+        stats['waiting_time'] += float(tripinfo.get('waitingTime', 0))
+        stats['time_loss'] += float(tripinfo.get('timeLoss', 0))
+        stats['arrival'] = max(stats['arrival'], float(tripinfo.get('arrival', tripinfo.get('endTime', 0))))
+    totals = {key: sum(stats[key] for stats in trucks.values())
+              for key in ('vehicles', 'duration', 'route_length', 'waiting_time', 'time_loss')}
+    totals['makespan'] = max((stats['arrival'] for stats in trucks.values()), default=0.0)
+    return trucks, totals
+
+
+def write_sumocfg(config_file, net_file, routes_file, tripinfo_file):
+    with open(config_file, 'w') as f:
+        f.write(SUMOCFG_TEMPLATE.format(net_file=os.path.abspath(net_file), routes_file=os.path.abspath(routes_file),
+                                        tripinfo_file=os.path.abspath(tripinfo_file)))
+
+
+def _simulate(args):
+    """
+    Simulates one candidate in its own directory and aggregates its tripinfo.
+    """
+    candidate, net_file, sim_dir, backend_name, backend_options = args
+    os.makedirs(sim_dir, exist_ok=True)
+    config_file = os.path.join(sim_dir, 'run.sumocfg')
+    tripinfo_file = os.path.join(sim_dir, 'tripinfo.xml')
+    write_sumocfg(config_file, net_file, candidate['routes_file'], tripinfo_file)
+    BACKENDS[backend_name](**backend_options).run(config_file, net_file, candidate['routes_file'], tripinfo_file)
+    trucks, totals = aggregate_tripinfo(tripinfo_file)
+    expected = sum(1 for _ in iter_vehicles(candidate['routes_file']))
+    totals['missing'] = expected - totals['vehicles']
+    return dict(candidate, config_file=config_file, trucks=trucks, totals=totals)
+
+
+def folder_candidates(folder_path, k):
+    """
+    The k cheapest candidates of a run folder by the route cost in their
+    merged_routes_*.alt.xml, as dicts with 'iteration', 'cost' and 'routes_file'.
+    """
+    candidates = []
+    for alt_file in glob.glob(os.path.join(folder_path, 'merged_routes_*.alt.xml')):
+        routes_file = alt_file[:-len('.alt.xml')] + '.xml'
+        if not os.path.exists(routes_file):
+            continue
+        cost = 0.0
+        for vehicle in iter_vehicles(alt_file):
+            route_dist_elem = vehicle.find('routeDistribution')
+            route_elem = chosen_route(route_dist_elem) if route_dist_elem is not None else None
+            if route_elem is not None:
+                cost += float(route_elem.get('cost', 0))
+        iteration = int(re.search(r'merged_routes_(\d+)\.alt\.xml$', alt_file).group(1))
+        candidates.append({'iteration': iteration, 'cost': round(cost, 2), 'routes_file': routes_file})
+    candidates.sort(key=lambda candidate: (candidate['cost'], candidate['iteration']))
+    return candidates[:k]
+
+
+def store_candidates(store_file, run_id, k, folder_path):
+    """
+    The k cheapest candidates of a stored run, exported as merged routes into folder_path.
+    """
+    store = ResultStore(store_file)
+    try:
+        if run_id is None:
+            runs = store.runs()
+            if not runs:
+                return []
+            run_id = runs[-1][0]
+        candidates = []
+        for row in store.top_k(run_id, k):
+            routes_file = os.path.join(folder_path, f"merged_routes_{row['iteration']}.xml")
+            store.export(run_id, row['iteration'], routes_file)
+            candidates.append({'iteration': row['iteration'], 'cost': round(row['total'], 2), 'routes_file': routes_file})
+        return candidates
+    finally:
+        store.close()
+
+
+def simulate_candidates(candidates, net_file, sim_path, backend='sumo', workers=1, **backend_options):
+    """
+    Simulates every candidate (dicts with 'iteration' and 'routes_file') with a generated
+    sumocfg in sim_path/<iteration>/, up to `workers` at a time. Returns the candidates
+    with per-truck 'trucks' and overall 'totals' tripinfo statistics, re-ranked by
+    simulated total duration (candidates with vehicles that never arrived last).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown simulator backend {backend!r}")
+    tasks = [(candidate, net_file, os.path.join(sim_path, str(candidate['iteration'])), backend, backend_options)
+             for candidate in candidates]
+    if workers <= 1:
+        results = [_simulate(task) for task in tasks]
+    else:
+        # Spawned workers start clean instead of inheriting open files
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(_simulate, tasks))
+    results.sort(key=lambda result: (result['totals']['missing'] > 0, result['totals']['duration'], result['iteration']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-rank the top candidates of an insertion run by simulation")
+    parser.add_argument('folder', help="run folder (output_*) holding merged_routes_*.xml; simulations go to its 'simulations' directory")
+    parser.add_argument('--store', default=None, help="take candidates from this result store instead of the folder's route files")
+    parser.add_argument('--run', type=int, default=None, help="stored run id (default: latest)")
+    parser.add_argument('--top', type=int, default=10, help="number of cheapest candidates to simulate")
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sumo',
+                        help="'sumo' runs SUMO; 'stub' drives every route at free flow without SUMO")
+    parser.add_argument('--sumo-binary', default='sumo')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="simulations run in parallel")
+    args = parser.parse_args()
+
+    sim_path = os.path.join(args.folder, 'simulations')
+    os.makedirs(sim_path, exist_ok=True)
+    if args.store:
+        candidates = store_candidates(args.store, args.run, args.top, sim_path)
+    else:
+        candidates = folder_candidates(args.folder, args.top)
+    if not candidates:
+        print(f"No candidates found in {args.store or args.folder}.")
+        return
+
+    backend_options = {'binary': args.sumo_binary} if args.backend == 'sumo' else {}
+    results = simulate_candidates(candidates, args.network, sim_path, args.backend, args.workers, **backend_options)
+    with open(os.path.join(sim_path, 'simulation.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'rank':>4} {'iteration':>9} {'route cost':>10} {'sim duration':>12} {'length (m)':>11} {'makespan':>9} {'missing':>7}")
+    for rank, result in enumerate(results, start=1):
+        totals = result['totals']
+        print(f"{rank:>4} {result['iteration']:>9} {result['cost']:>10.2f} {totals['duration']:>12.2f} "
+              f"{totals['route_length']:>11.1f} {totals['makespan']:>9.2f} {totals['missing']:>7}")
+
+
+if __name__ == "__main__":
+    main()
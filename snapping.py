@@ -0,0 +1,207 @@
+import argparse
+import csv
+import math
+
+import numpy as np
+
+from geometry import from_lonlat
+from network import load_network, stamped
+
+
+class EdgeSnapper:
+    """
+    Uniform grid over the segments of every edge shape, for snapping points to edges.
+
+    Each segment is registered in every cell its bounding box touches; cells are stored
+    CSR-style (sorted cell keys with start offsets into one segment array). A query only
+    looks at the cells within max_distance of each point, for a whole batch of points at
+    once.
+    """
+
+    def __init__(self, network, cell_size=50.0):
+        self.network = network
+        self.cell_size = cell_size
+        shape_offsets = np.asarray(network.shape_offsets)
+        shape_xy = np.asarray(network.shape_xy)
+        points_per_edge = np.diff(shape_offsets)
+
+        # Segment k joins shape point seg_start[k] to seg_start[k] + 1 of edge seg_edge[k]
+        segments_per_edge = np.maximum(points_per_edge - 1, 0)
+        self.seg_edge = np.repeat(np.arange(len(points_per_edge)), segments_per_edge)
+        first = np.cumsum(segments_per_edge) - segments_per_edge
+        seg_start = shape_offsets[self.seg_edge] + (np.arange(len(self.seg_edge)) - first[self.seg_edge])
+        self.seg_a = shape_xy[seg_start]
+        self.seg_b = shape_xy[seg_start + 1]
+        seg_len = np.hypot(*(self.seg_b - self.seg_a).T)
+
+        # Distance along the edge where each segment starts, scaled to the edge's length
+        cumulative = np.cumsum(seg_len) - seg_len
+        edge_first = np.zeros(len(points_per_edge), dtype=np.int64)
+        edge_first[1:] = np.cumsum(segments_per_edge)[:-1]
+        shape_length = np.bincount(self.seg_edge, weights=seg_len, minlength=len(points_per_edge))
+        lengths = np.asarray(network.lengths, dtype=np.float64)
+        self.scale = np.where(shape_length > 0, lengths / np.maximum(shape_length, 1e-9), 1.0)
+        self.seg_pos = cumulative - cumulative[edge_first[self.seg_edge]]
+        self.seg_len = seg_len
+
+        low = np.minimum(self.seg_a, self.seg_b)
+        high = np.maximum(self.seg_a, self.seg_b)
+        self.origin = low.min(axis=0) if len(low) else np.zeros(2)
+        cell_low = np.floor((low - self.origin) / cell_size).astype(np.int64)
+        cell_high = np.floor((high - self.origin) / cell_size).astype(np.int64)
+        self.grid_shape = (cell_high.max(axis=0) + 1) if len(cell_high) else np.ones(2, dtype=np.int64)
+
+        spans = cell_high - cell_low + 1
+        cells_per_seg = spans[:, 0] * spans[:, 1]
+        seg = np.repeat(np.arange(len(cells_per_seg)), cells_per_seg)
+        k = np.arange(cells_per_seg.sum()) - np.repeat(np.cumsum(cells_per_seg) - cells_per_seg, cells_per_seg)
+        cx = cell_low[seg, 0] + k % spans[seg, 0]
+        cy = cell_low[seg, 1] + k // spans[seg, 0]
+        keys = cx * self.grid_shape[1] + cy
+        order = np.argsort(keys, kind='stable')
+        self.cell_segments = seg[order]
+        self.cell_keys, starts = np.unique(keys[order], return_index=True)
+        self.cell_starts = np.append(starts, len(order))
+
+    def _candidates(self, xy, radius):
+        """
+        Returns (point, segment) pairs for every segment registered in a cell within
+        radius cells of each point.
+        """
+        cells = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+        points, segments = [], []
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                cx, cy = cells[:, 0] + dx, cells[:, 1] + dy
+                inside = (cx >= 0) & (cy >= 0) & (cx < self.grid_shape[0]) & (cy < self.grid_shape[1])
+                keys = np.where(inside, cx * self.grid_shape[1] + cy, -1)
+                slot = np.searchsorted(self.cell_keys, keys)
+                slot = np.minimum(slot, len(self.cell_keys) - 1)
+                found = inside & (self.cell_keys[slot] == keys) if len(self.cell_keys) else np.zeros(len(keys), bool)
+                counts = np.where(found, self.cell_starts[slot + 1] - self.cell_starts[slot], 0)
+                point = np.repeat(np.arange(len(xy)), counts)
+                offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                points.append(point)
+                segments.append(self.cell_segments[self.cell_starts[slot[point]] + offset])
+        return np.concatenate(points), np.concatenate(segments)
+
+    def snap_xy(self, xy, max_distance=50.0, heading=None, max_heading_diff=90.0, lefthand=False, chunk=65536):
+        """
+        Snaps an (n, 2) array of network coordinates to the nearest edge within max_distance.
+
+        Returns (edge index array with -1 where nothing is in range, distance array, position
+        along the edge). When an edge and its reverse are equally close (shared centreline
+        shapes), the one the point is on the driving side of wins. An optional per-point
+        heading in degrees (0 = +y, 90 = +x, NaN = unknown) excludes edges pointing more than
+        max_heading_diff away from it.
+        """
+        if not math.isfinite(max_distance) or max_distance < 0:
+            raise ValueError(f"max_distance must be a finite, non-negative number of metres, not {max_distance!r}")
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        n = len(xy)
+        edges = np.full(n, -1, dtype=np.int64)
+        distances = np.full(n, np.inf)
+        positions = np.zeros(n)
+        if not len(self.seg_edge):
+            return edges, distances, positions
+        radius = max(1, int(math.ceil(max_distance / self.cell_size)))
+        headings = None if heading is None else np.broadcast_to(np.asarray(heading, dtype=np.float64), (n,))
+
+        for lo in range(0, n, chunk):
+            hi = min(lo + chunk, n)
+            point, seg = self._candidates(xy[lo:hi], radius)
+            a, b, p = self.seg_a[seg], self.seg_b[seg], xy[lo:hi][point]
+            d = b - a
+            norm = (d * d).sum(axis=1)
+            t = np.where(norm > 0, np.clip(((p - a) * d).sum(axis=1) / np.where(norm > 0, norm, 1), 0, 1), 0)
+            dist = np.hypot(*(p - (a + t[:, None] * d)).T)
+            keep = dist <= max_distance
+            if headings is not None:
+                bearing = np.degrees(np.arctan2(d[:, 0], d[:, 1]))
+                diff = np.abs((bearing - headings[lo:hi][point] + 180) % 360 - 180)
+                keep &= (diff <= max_heading_diff) | np.isnan(diff)
+            point, seg, dist, t = point[keep], seg[keep], dist[keep], t[keep]
+            cross = d[keep, 0] * (p[keep, 1] - a[keep, 1]) - d[keep, 1] * (p[keep, 0] - a[keep, 0])
+            wrong_side = cross > 0 if not lefthand else cross < 0
+
+            # Mirrored shapes give an edge and its reverse the same distance up to rounding
+            order = np.lexsort((wrong_side, np.round(dist, 6), point))
+            point, seg, dist, t = point[order], seg[order], dist[order], t[order]
+            best = np.unique(point, return_index=True)[1]
+            rows = lo + point[best]
+            e = self.seg_edge[seg[best]]
+            edges[rows] = e
+            distances[rows] = dist[best]
+            positions[rows] = (self.seg_pos[seg[best]] + t[best] * self.seg_len[seg[best]]) * self.scale[e]
+        return edges, distances, positions
+
+    def snap_lonlat(self, lonlat, max_distance=50.0, heading=None, **kwargs):
+        """
+        snap_xy() for an (n, 2) array of lon/lat.
+        """
+        return self.snap_xy(from_lonlat(self.network, lonlat), max_distance, heading, **kwargs)
+
+    def edge_ids(self, edges):
+        """
+        Edge ids for the result of a snap, None where nothing was in range.
+        """
+        ids = self.network.edge_ids
+        return [ids[e] if e >= 0 else None for e in edges.tolist()]
+
+
+_snappers = {}
+
+
+def get_snapper(network_file, cell_size=50.0):
+    """
+    Returns an EdgeSnapper for network_file, built once per process and version of the file.
+    """
+    return stamped(_snappers, network_file, lambda: EdgeSnapper(load_network(network_file), cell_size), cell_size)
+
+
+def snap_order(network_file, lon, lat, max_distance=50.0, heading=None):
+    """
+    Edge id of the order at lon/lat, for feeding algo.main()'s new_order.
+    """
+    snapper = get_snapper(network_file)
+    edges, distances, _ = snapper.snap_lonlat([[lon, lat]], max_distance, heading)
+    if edges[0] < 0:
+        raise ValueError(f"no edge within {max_distance} m of {lon},{lat}")
+    return snapper.edge_ids(edges)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snap order coordinates to network edges")
+    parser.add_argument('orders', help="CSV with lon and lat columns (and optionally id and heading)")
+    parser.add_argument('--network', default='kharagpur.net.xml')
+    parser.add_argument('--output', default='snapped_orders.csv')
+    parser.add_argument('--max-distance', type=float, default=50.0, help="metres")
+    parser.add_argument('--xy', action='store_true', help="orders are in network x/y instead of lon/lat")
+    args = parser.parse_args()
+
+    with open(args.orders, newline='') as f:
+        rows = list(csv.DictReader(f))
+    if args.xy:
+        coords = np.array([[float(row['x']), float(row['y'])] for row in rows]).reshape(-1, 2)
+    else:
+        coords = np.array([[float(row['lon']), float(row['lat'])] for row in rows]).reshape(-1, 2)
+    heading = None
+    if rows and 'heading' in rows[0]:
+        heading = np.array([float(row['heading']) if row['heading'] else np.nan for row in rows])
+
+    # The grid cell size is independent of the query radius, which may be 0
+    snapper = get_snapper(args.network)
+    if args.xy:
+        edges, distances, positions = snapper.snap_xy(coords, args.max_distance, heading)
+    else:
+        edges, distances, positions = snapper.snap_lonlat(coords, args.max_distance, heading)
+
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'edge', 'distance', 'position'])
+        for k, (edge, distance, position) in enumerate(zip(snapper.edge_ids(edges), distances, positions)):
+            writer.writerow([rows[k].get('id', k), edge or '', f"{distance:.2f}" if edge else '', f"{position:.2f}" if edge else ''])
+
+
+if __name__ == "__main__":
+    main()
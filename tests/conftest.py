@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+@pytest.fixture(scope='session')
+def network(tmp_path_factory):
+    """
+    A small generated network with irregular geometry and speeds: (net file, street edge ids).
+    """
+    net_file = str(tmp_path_factory.mktemp('net') / 'test.net.xml')
+    streets = benchmark.generate_network(net_file, 200, kind='random', seed=1)
+    return net_file, streets
+
+
+@pytest.fixture(scope='session')
+def fleet(network, tmp_path_factory):
+    """
+    A 3-truck, 12-trip trips file on the test network: (trips file, new order edge).
+    """
+    trips_file = str(tmp_path_factory.mktemp('fleet') / 'trips.xml')
+    new_order = benchmark.generate_fleet(trips_file, network[1], 3, 12, seed=2)
+    return trips_file, new_order
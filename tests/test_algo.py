@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import algo
+from insertion import enumerate_candidates
+
+
+def run_main(tmp_path, monkeypatch, network, fleet, evaluation):
+    work_dir = tmp_path / evaluation
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    min_cost, best_file, max_cost, worst_file = algo.main(
+        backend='internal', evaluation=evaluation, network_file=network[0], trips_file_path=fleet[0], new_order=fleet[1])
+    return min_cost, os.path.basename(best_file), max_cost, os.path.basename(worst_file)
+
+
+def test_delta_picks_the_full_evaluation_best_and_worst(tmp_path, monkeypatch, network, fleet):
+    full = run_main(tmp_path, monkeypatch, network, fleet, 'full')
+    delta = run_main(tmp_path, monkeypatch, network, fleet, 'delta')
+    assert delta[1] == full[1] and delta[3] == full[3]
+    assert delta[0] == pytest.approx(full[0]) and delta[2] == pytest.approx(full[2])
+
+
+def test_batch_matches_per_candidate_runs(tmp_path, network, fleet):
+    trips = algo.extract_trips(fleet[0])
+    candidates = list(enumerate_candidates(trips))
+    results = {}
+    for batch in (False, True):
+        folder = tmp_path / ('batch' if batch else 'single')
+        folder.mkdir()
+        results[batch] = algo.evaluate_candidates(candidates, trips, fleet[1], str(folder), network[0], 'internal',
+                                                  batch=batch)
+
+    for single, batched in zip(results[False], results[True]):
+        assert batched[0] == pytest.approx(single[0])
+        for single_file, batched_file in zip(single[1:], batched[1:]):
+            assert os.path.basename(batched_file) == os.path.basename(single_file)
+            with open(single_file) as f, open(batched_file) as g:
+                assert g.read() == f.read()
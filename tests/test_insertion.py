@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+import algo
+from insertion import (Trips, best_and_worst, check_pruning, enumerate_candidates, evaluate_insertions,
+                       prune_insertions, truck_numbers)
+from landmarks import LandmarkRouter, select_landmarks
+from network import load_network
+from router import Router, get_router
+
+
+def test_pruning_agrees_with_exhaustive_pricing(network, fleet):
+    trips = algo.extract_trips(fleet[0])
+    router = get_router(network[0])
+    net = load_network(network[0])
+    landmarks, from_landmark, to_landmark = select_landmarks(Router(net), 6, seed=0)
+    alt = LandmarkRouter(net, landmarks, from_landmark, to_landmark, active=2)
+    for leg_bound in (router.lower_bound, alt.lower_bound):
+        exhaustive, pruned = check_pruning(trips, fleet[1], leg_bound, router.cost)
+        assert pruned['iteration'] == exhaustive['iteration']
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_prune_insertions_finds_the_cheapest(seed):
+    rng = random.Random(seed)
+    candidates = []
+    for iteration in range(30):
+        total = rng.uniform(100, 200)
+        # Ties make sure the earliest cheapest candidate still wins
+        if iteration % 7 == 3:
+            total = candidates[0]['total']
+        candidates.append({'iteration': iteration, 'bound': total - rng.uniform(0, 50), 'total': total})
+    exact = {candidate['iteration']: candidate.pop('total') for candidate in candidates}
+
+    def evaluate(batch):
+        for candidate in batch:
+            candidate['total'] = exact[candidate['iteration']]
+
+    evaluated = prune_insertions(candidates, evaluate, round_size=rng.randint(1, 4))
+    best, _ = best_and_worst(evaluated)
+    expected = min(exact, key=lambda iteration: (exact[iteration], iteration))
+    assert best['iteration'] == expected
+
+
+def test_delta_costs_match_full_fleet_repricing(network, fleet):
+    trips = algo.extract_trips(fleet[0])
+    router = get_router(network[0])
+    new_order = fleet[1]
+    for candidate in evaluate_insertions(trips, new_order, router.cost):
+        j = candidate['index']
+        legs = list(trips)
+        if candidate['kind'] == 'insert':
+            legs[j:j + 1] = [(trips[j][0], new_order), (new_order, trips[j][1])]
+        else:
+            legs.insert(j + 1, (trips[j][1], new_order))
+        assert candidate['total'] == pytest.approx(sum(router.cost(*leg) for leg in legs))
+
+
+def test_trip_ids_decide_trucks_and_the_last_append():
+    # The second truck's first trip happens to start on the reverse of the first truck's
+    # last stop, and the last trip is a round trip
+    trips = [('a', 'b'), ('-b', 'c'), ('-c', 'd'), ('-d', 'e'), ('-e', 'e')]
+    with_ids = Trips(trips, ['0_1', '0_2', '1_1', '1_2', '1_3'])
+    assert truck_numbers(with_ids) == [1, 1, 2, 2, 2]
+    assert [candidate['iteration'] for candidate in enumerate_candidates(with_ids)] == [0, 1, 7, 2, 3, 4, 10]
+
+    # Without ids the reverse-edge rule sees one truck ending in a round trip
+    assert truck_numbers(trips) == [1, 1, 1, 1, 1]
+    assert [candidate['iteration'] for candidate in enumerate_candidates(trips)] == [0, 1, 2, 3, 4]
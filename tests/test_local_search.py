@@ -0,0 +1,53 @@
+import copy
+import random
+
+import pytest
+
+import local_search
+from local_search import LocalSearch
+
+MOVES = ['try_two_opt', 'try_or_opt', 'try_relocate', 'try_exchange', 'try_cross_exchange']
+
+
+def random_search(seed, n_trucks=3, n_stops=12):
+    """
+    A LocalSearch over random asymmetric costs; stops 0..n_trucks-1 are the depots.
+    """
+    rng = random.Random(seed)
+    n = n_trucks + n_stops
+    table = [[0.0 if b < n_trucks else rng.uniform(1, 100) for b in range(n)] for _ in range(n)]
+    stops = list(range(n_trucks, n))
+    rng.shuffle(stops)
+    tours = [[t] + stops[t::n_trucks] for t in range(n_trucks)]
+    return LocalSearch(tours, table, seed=seed)
+
+
+def applies(search, move, monkeypatch, epsilon):
+    """
+    Whether move would be applied to a copy of search with local_search.EPSILON at epsilon.
+    The copy shares no state, random generator included, with search.
+    """
+    probe = copy.deepcopy(search)
+    monkeypatch.setattr(local_search, 'EPSILON', epsilon)
+    getattr(probe, move)()
+    return probe.moves_applied > search.moves_applied, probe
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_move_deltas_match_full_recomputation(seed, monkeypatch):
+    search = random_search(seed)
+    checked = 0
+    for step in range(300):
+        move = MOVES[step % len(MOVES)]
+        # Forcing the move shows its real effect; a move is applied iff its computed delta
+        # is below -EPSILON, so bracketing -EPSILON around the real delta checks the delta.
+        applied, forced = applies(search, move, monkeypatch, float('-inf'))
+        if not applied:
+            search.rng = forced.rng
+            continue
+        delta = forced.total_cost() - search.total_cost()
+        assert applies(search, move, monkeypatch, -delta + 1e-7)[0] is False
+        assert applies(search, move, monkeypatch, -delta - 1e-7)[0] is True
+        search = forced
+        checked += 1
+    assert checked > 100
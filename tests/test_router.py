@@ -0,0 +1,71 @@
+import math
+import random
+
+from landmarks import LandmarkRouter, select_landmarks
+from network import load_network
+from router import Router
+
+
+def brute_force_costs(network, source):
+    """
+    Cost from edge source to every edge by Bellman-Ford relaxation over all connections.
+    """
+    weights, offsets, targets = network.travel_times, network.offsets, network.targets
+    dist = [math.inf] * len(network)
+    dist[source] = weights[source]
+    changed = True
+    while changed:
+        changed = False
+        for u in range(len(network)):
+            if math.isinf(dist[u]):
+                continue
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                if dist[u] + weights[v] < dist[v] - 1e-12:
+                    dist[v] = dist[u] + weights[v]
+                    changed = True
+    return dist
+
+
+def check_router(router, network, sources, targets):
+    weights = network.travel_times
+    for source in sources:
+        expected = brute_force_costs(network, source)
+        for target in targets:
+            result = router.route_index(source, target)
+            if math.isinf(expected[target]):
+                assert result is None
+                continue
+            path, cost = result
+            assert math.isclose(cost, expected[target], rel_tol=1e-9)
+            # The path is connected and costs what the router says
+            assert path[0] == source and path[-1] == target
+            for u, v in zip(path, path[1:]):
+                assert v in network.targets[network.offsets[u]:network.offsets[u + 1]]
+            assert math.isclose(sum(weights[e] for e in path), cost, rel_tol=1e-9)
+
+
+def test_astar_matches_brute_force(network):
+    net = load_network(network[0])
+    rng = random.Random(0)
+    edges = range(len(net))
+    check_router(Router(net), net, rng.sample(edges, 5), rng.sample(edges, 20))
+
+
+def test_alt_matches_brute_force(network):
+    net = load_network(network[0])
+    landmarks, from_landmark, to_landmark = select_landmarks(Router(net), 6, seed=0)
+    router = LandmarkRouter(net, landmarks, from_landmark, to_landmark, active=2)
+    rng = random.Random(1)
+    edges = range(len(net))
+    check_router(router, net, rng.sample(edges, 5), rng.sample(edges, 20))
+
+
+def test_lower_bounds_never_exceed_costs(network):
+    net = load_network(network[0])
+    landmarks, from_landmark, to_landmark = select_landmarks(Router(net), 6, seed=0)
+    rng = random.Random(2)
+    for router in (Router(net), LandmarkRouter(net, landmarks, from_landmark, to_landmark, active=2)):
+        for _ in range(50):
+            from_edge, to_edge = rng.choice(net.edge_ids), rng.choice(net.edge_ids)
+            assert router.lower_bound(from_edge, to_edge) <= router.cost(from_edge, to_edge) + 1e-9
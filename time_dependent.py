@@ -0,0 +1,269 @@
+import heapq
+import math
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from insertion import truck_numbers, enumerate_candidates
+from network import bound_speed
+from route_stream import iter_elements
+
+
+def free_flow_table(network, n_buckets):
+    """
+    Returns an [n_edges x n_buckets] travel time table filled with free-flow times.
+    """
+    return np.repeat(np.frombuffer(network.travel_times, dtype=np.float64)[:, None], n_buckets, axis=1)
+
+
+def _buckets(begin, end, bucket_size, n_buckets):
+    first = max(int(begin // bucket_size), 0)
+    last = min(int(math.ceil(end / bucket_size)), n_buckets)
+    return range(first, max(last, first + 1) if first < n_buckets else first)
+
+
+def load_edge_data(edge_data_files, network, bucket_size=300.0, n_buckets=96, table=None):
+    """
+    Fills a travel time table from SUMO edgeData (meandata) outputs. Each <interval> sets
+    every bucket it overlaps; edges without measurements keep their current time.
+    """
+    if table is None:
+        table = free_flow_table(network, n_buckets)
+    index = network.edge_index
+    for edge_data_file in edge_data_files:
+        for _, interval in ET.iterparse(edge_data_file, events=('end',)):
+            if interval.tag != 'interval':
+                continue
+            buckets = _buckets(float(interval.get('begin')), float(interval.get('end')), bucket_size, table.shape[1])
+            for edge in interval.findall('edge'):
+                e = index.get(edge.get('id'))
+                if e is None:
+                    continue
+                if edge.get('traveltime') is not None:
+                    travel_time = float(edge.get('traveltime'))
+                elif edge.get('speed') is not None and float(edge.get('speed')) > 0:
+                    travel_time = network.lengths[e] / float(edge.get('speed'))
+                else:
+                    continue
+                table[e, buckets.start:buckets.stop] = travel_time
+            interval.clear()
+    return table
+
+
+def _lane_edge(lane_id):
+    return lane_id.rsplit('_', 1)[0] if lane_id else None
+
+
+def load_tripinfo(tripinfo_files, router, bucket_size=300.0, n_buckets=96, table=None):
+    """
+    Scales free-flow times with SUMO tripinfo outputs. Each trip's measured duration is
+    compared with the free-flow cost of its from -> to route (departLane / arrivalLane
+    when from / to are not written), and that slowdown factor is averaged per edge over
+    the buckets the trip departed in. Edges no trip crossed keep their current time.
+    """
+    network = router.network
+    if table is None:
+        table = free_flow_table(network, n_buckets)
+    factors = np.zeros(table.shape)
+    counts = np.zeros(table.shape)
+    for tripinfo_file in tripinfo_files:
+        for tripinfo in iter_elements(tripinfo_file, 'tripinfo'):
+            from_edge = tripinfo.get('from') or _lane_edge(tripinfo.get('departLane'))
+            to_edge = tripinfo.get('to') or _lane_edge(tripinfo.get('arrivalLane'))
+            result = router.route(from_edge, to_edge)
+            duration = float(tripinfo.get('duration', 0))
+            if result is None or result[1] <= 0 or duration <= 0:
+                continue
+            edges, cost = result
+            b = min(int(float(tripinfo.get('depart', 0)) // bucket_size), table.shape[1] - 1)
+            rows = [network.edge_index[edge] for edge in edges]
+            factors[rows, b] += duration / cost
+            counts[rows, b] += 1
+    measured = counts > 0
+    free_flow = np.frombuffer(network.travel_times, dtype=np.float64)[:, None]
+    table[measured] = (free_flow * factors / np.maximum(counts, 1))[measured]
+    return table
+
+
+def read_departures(trips_file):
+    """
+    Returns the depart time of every trip in a trips file, in file order.
+    """
+    return [float(trip.get('depart', 0)) for trip in ET.parse(trips_file).getroot().findall('trip')]
+
+
+class TimeDependentRouter:
+    """
+    Edge-to-edge router whose edge travel times depend on the time the edge is entered,
+    looked up in a flat [n_edges x n_buckets] table. Leg paths are memoized per departure
+    bucket, so each leg is searched at most once per bucket.
+    """
+
+    def __init__(self, network, table, bucket_size=300.0):
+        self.network = network
+        self.bucket_size = bucket_size
+        self.n_buckets = table.shape[1]
+        self.times = array('d')
+        self.times.frombytes(np.ascontiguousarray(table, dtype=np.float64).tobytes())
+        self.max_speed = bound_speed(network, table.min(axis=1))
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, t):
+        return min(max(int(t // self.bucket_size), 0), self.n_buckets - 1)
+
+    def travel_time(self, e, t):
+        return self.times[e * self.n_buckets + self.bucket(t)]
+
+    def route_index(self, source, target, depart):
+        """
+        Earliest-arrival search from edge index source, entered at time depart, to target.
+        Returns (edge index list, travel time) or None.
+        """
+        net = self.network
+        offsets, targets = net.offsets, net.targets
+        tx, ty = net.node_x[net.to_node[target]], net.node_y[net.to_node[target]]
+        inv_speed = 1.0 / self.max_speed if self.max_speed > 0 and not math.isnan(tx) else 0.0
+
+        def h(e):
+            n = net.to_node[e]
+            d = math.hypot(net.node_x[n] - tx, net.node_y[n] - ty)
+            return 0.0 if math.isnan(d) else d * inv_speed
+
+        arrival = {source: depart + self.travel_time(source, depart)}
+        pred = {source: -1}
+        heap = [(arrival[source] + h(source), source)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if u == target:
+                path = []
+                while u != -1:
+                    path.append(u)
+                    u = pred[u]
+                path.reverse()
+                return path, arrival[target] - depart
+            done.add(u)
+            tu = arrival[u]
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                tv = tu + self.travel_time(v, tu)
+                if tv < arrival.get(v, math.inf):
+                    arrival[v] = tv
+                    pred[v] = u
+                    heapq.heappush(heap, (tv + h(v), v))
+        return None
+
+    def path_time(self, path, depart):
+        """
+        Travel time of an edge index path entered at time depart, each edge timed at the
+        moment it is entered.
+        """
+        t = depart
+        for e in path:
+            t += self.travel_time(e, t)
+        return t - depart
+
+    def route(self, from_edge, to_edge, depart=0.0):
+        """
+        Time-dependent route between two edge ids, searched from depart. Returns (edge id
+        list, travel time) or None if unreachable.
+
+        Paths are memoized per departure bucket: a later departure in the same bucket
+        reuses the path found for the first one but is timed from its own depart, so the
+        clock is exact and only the choice of path is shared within a bucket.
+        """
+        key = (from_edge, to_edge, self.bucket(depart))
+        if key in self.cache:
+            self.hits += 1
+            path = self.cache[key]
+            cost = None if path is None else self.path_time(path, depart)
+        else:
+            self.misses += 1
+            index = self.network.edge_index
+            path = cost = None
+            if from_edge in index and to_edge in index:
+                found = self.route_index(index[from_edge], index[to_edge], depart)
+                if found is not None:
+                    path, cost = found
+            self.cache[key] = path
+        if path is None:
+            return None
+        return [self.network.edge_ids[e] for e in path], cost
+
+    def cost(self, from_edge, to_edge, depart=0.0):
+        result = self.route(from_edge, to_edge, depart)
+        return math.inf if result is None else result[1]
+
+    def price_legs(self, legs, depart, service_time=0.0):
+        """
+        Prices consecutive legs of one truck, propagating the clock from leg to leg.
+        Returns (total travel time, arrival time at the end of each leg).
+        """
+        t = depart
+        total = 0.0
+        arrivals = []
+        for from_edge, to_edge in legs:
+            cost = self.cost(from_edge, to_edge, t)
+            total += cost
+            t += cost
+            arrivals.append(t)
+            t += service_time
+        return total, arrivals
+
+
+def evaluate_insertions_td(trips, departs, new_order, router, service_time=0.0):
+    """
+    Time-dependent counterpart of insertion.evaluate_insertions(). Every truck leaves at
+    the depart time of its first trip; a candidate re-prices its truck's tour with the
+    clock propagated through the new stop, so later legs see their shifted departure.
+
+    Legs before the new stop are unchanged, so their costs and clock come from the base
+    tour's arrivals and only the shifted suffix is re-priced.
+
+    Each candidate also gets 'departs': the depart time of every trip in departs and of
+    each leg the candidate adds, for writing its routed trips with real departures.
+    """
+    trucks = truck_numbers(trips)
+    tours = {}
+    for j, truck in enumerate(trucks):
+        tours.setdefault(truck, []).append(j)
+
+    base = {}
+    # Per trip j: (clock, base cost of the rest of its truck's tour) just before its leg
+    # and just after it.
+    before, after = {}, {}
+    for truck, tour in tours.items():
+        clock = departs[tour[0]]
+        base[truck], arrivals = router.price_legs([trips[j] for j in tour], clock, service_time)
+        left = base[truck]
+        for j, arrival in zip(tour, arrivals):
+            before[j] = clock, left
+            left -= arrival - clock
+            clock = arrival + service_time
+            after[j] = clock, left
+    base_total = sum(base.values())
+    positions = {j: position for tour in tours.values() for position, j in enumerate(tour)}
+
+    candidates = []
+    for candidate in enumerate_candidates(trips):
+        j = candidate['index']
+        from_edge, to_edge = trips[j]
+        if candidate['kind'] == 'insert':
+            legs = [(from_edge, new_order), (new_order, to_edge)]
+            clock, replaced = before[j]
+        else:
+            legs = [(to_edge, new_order)]
+            clock, replaced = after[j]
+        legs.extend(trips[k] for k in tours[trucks[j]][positions[j] + 1:])
+        cost, arrivals = router.price_legs(legs, clock, service_time)
+        added = [clock] if candidate['kind'] == 'append' else [clock, arrivals[0] + service_time]
+        candidate['departs'] = (departs, added)
+        candidate['delta'] = cost - replaced
+        candidate['total'] = base_total + candidate['delta']
+        candidates.append(candidate)
+    return candidates
@@ -0,0 +1,63 @@
+import instrument
+
+TRIPS_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
+"""
+
+
+class TripSet:
+    """
+    In-memory set of trips for one routing run.
+
+    Replaces repeated create_trips_file() calls: trips are accumulated with O(1)
+    duplicate detection and either serialized once or handed straight to an
+    in-process router. Iterating yields (vehicle id, depart, from_edge, to_edge).
+    """
+
+    def __init__(self):
+        self.trips = []
+        self._seen = set()
+
+    def add(self, from_edge, to_edge, trip_id, truck_id, order, depart='0.00'):
+        """
+        Adds trip "{trip_id}_{truck_id}_{order}" unless the identical trip is already present.
+        Returns True if the trip was added.
+        """
+        trip = (f"{trip_id}_{truck_id}_{order}", depart, from_edge, to_edge)
+        if trip in self._seen:
+            return False
+        self._seen.add(trip)
+        self.trips.append(trip)
+        return True
+
+    def extend(self, other, prefix):
+        """
+        Adds every trip of other with its vehicle id namespaced as "{prefix}_{id}", so several
+        scenarios can be routed as one batch and split apart again by id.
+        """
+        for vehicle_id, depart, from_edge, to_edge in other:
+            trip = (f"{prefix}_{vehicle_id}", depart, from_edge, to_edge)
+            if trip not in self._seen:
+                self._seen.add(trip)
+                self.trips.append(trip)
+
+    def __len__(self):
+        return len(self.trips)
+
+    def __iter__(self):
+        return iter(self.trips)
+
+    def to_xml(self):
+        lines = [f'<trip id="{vehicle_id}" depart="{depart}" from="{from_edge}" to="{to_edge}"/>\n'
+                 for vehicle_id, depart, from_edge, to_edge in self.trips]
+        return TRIPS_HEADER + ''.join(lines) + '</routes>'
+
+    @instrument.timed('TripSet.write')
+    def write(self, trips_file):
+        """
+        Writes the trips file with a single buffered write.
+        """
+        content = self.to_xml()
+        with open(trips_file, 'w') as f:
+            f.write(content)
+        instrument.count('xml_bytes_written', len(content))